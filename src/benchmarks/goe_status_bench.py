@@ -0,0 +1,86 @@
+"""
+Cost of handling the status of a fleet of go-eCharger wallboxes polled every second.
+
+Compares the time per poll of the plugin path (goeDevice.get_status):
+    record       ... Parse the status into a GoeStatus record with its connection state, publish it once
+    record+dict  ... What a poll did before: publish the parsed record, publish a copy with the connection
+                     state and create the nested dict of it
+and the memory held by the last status of every wallbox, as record and as record with dict.
+Every mode runs `--repeat` times, the fastest run counts.
+
+Usage (from src/):
+    python3 benchmarks/goe_status_bench.py --wallboxes 50 --seconds 60
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+import importlib
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+GoeStatus = importlib.import_module("plugins.go-echarger.goe_status").GoeStatus
+from snapshot import SnapshotPublisher
+
+CONNECTION = {"state": "closed", "failures": 0, "retry_in": 0.0}
+
+def synthetic_status(no):
+    """
+    Full v1 status (as returned by /status) of wallbox number no.
+    """
+    status = {key: "0" for key in ("version", "stp", "tmp", "dwo", "adi", "wst", "wen", "tof", "tds", "lbr", "aho", "afi",
+                                   "ama", "cid", "cch", "cfi", "lse", "ust", "r1x", "dto", "nmo", "ecd", "ec4", "ec5", "ec6",
+                                   "ec7", "ec8", "ec9", "ec1", "cbl", "wss", "wke", "wak")}
+    status.update({
+        "sse": f"{no:06d}", "fwv": "040.0", "ast": "0", "alw": "1", "uby": "1", "car": "2", "amp": "16", "pha": "63",
+        "nrg": [230, 231, 229, 0, 160, 160, 160, 37, 37, 37, 0, 1104 + no, 99, 99, 99, 0], "dws": str(36000 + no),
+        "eto": "1234", "err": "0", "eca": "10", "ecr": "20", "al1": "6", "al2": "10", "al3": "16", "al4": "20", "al5": "32"
+    })
+    for suffix in ("a", "r", "d", "4", "5", "6", "7", "8", "9", "1"):
+        status[f"rc{suffix}"] = ""
+    for key in ("rna", "rnm", "rne", "rn4", "rn5", "rn6", "rn7", "rn8", "rn9", "rn1"):
+        status[key] = ""
+    # Simulate the wallbox answer, so every poll starts with freshly decoded JSON like in the plugin
+    return json.dumps(status)
+
+def measure_time(responses, seconds, with_dict, repeat):
+    publishers = {ip: SnapshotPublisher(f"wallbox:{ip}", GoeStatus(ip)) for (ip, _) in responses}
+    def poll_all():
+        for (ip, response) in responses:
+            publisher = publishers[ip]
+            record = GoeStatus.parse(json.loads(response), ip)
+            if with_dict:
+                publisher.publish(record)
+                publisher.publish(publisher.get().data.with_connection(CONNECTION)).data.as_dict()
+            else:
+                record.connection = CONNECTION
+                publisher.publish(record)
+    total = min(timeit.repeat(poll_all, number=seconds, repeat=repeat))
+    return total / seconds / len(responses) * 1e6
+
+def measure_memory(responses, with_dict):
+    decoded = [(ip, json.loads(response)) for (ip, response) in responses]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    statuses = [GoeStatus.parse(status, ip) for (ip, status) in decoded]
+    if with_dict:
+        for status in statuses:
+            status.as_dict()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the go-eCharger status handling.")
+    parser.add_argument("--wallboxes", type=int, default=50, help="Number of wallboxes")
+    parser.add_argument("--seconds", type=int, default=60, help="Number of polls per wallbox (one per second)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per mode")
+    args = parser.parse_args()
+
+    responses = [(f"10.0.{no // 250}.{no % 250 + 1}", synthetic_status(no)) for no in range(args.wallboxes)]
+    for (name, with_dict) in (("record", False), ("record+dict", True)):
+        per_poll = measure_time(responses, args.seconds, with_dict, args.repeat)
+        memory = measure_memory(responses, with_dict)
+        print(f"{name:<12} {per_poll:7.1f} us per poll   {per_poll * args.wallboxes / 1000.0:6.2f} ms per second of {args.wallboxes} wallboxes   "
+              f"{memory / 1024.0:7.1f} KiB held ({memory / args.wallboxes:6.0f} B per wallbox)")
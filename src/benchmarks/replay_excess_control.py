@@ -0,0 +1,72 @@
+"""
+Replay recorded days through the automatic charging of the Dashboard plugin (see replay.py)
+and compare the reactive control with the forecast based control. Both use the same
+hysteresis, so the difference is the effect of the forecast. A third configuration adds
+a shorter hysteresis to the forecast, to tell the two effects apart.
+
+Reports per configuration:
+    switches          ... How often charging was allowed/stopped
+    self_consumption  ... Share of PV production used on site (battery not simulated)
+    wallbox_pv_share  ... Share of the charged energy that came from PV
+
+Usage (from src/):
+    python3 benchmarks/replay_excess_control.py --db data/senec/senec.sqlite --day 2023-06-01 --day 2023-06-02
+    python3 benchmarks/replay_excess_control.py --synthetic 7
+"""
+import os
+import sys
+import math
+import random
+import argparse
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import log_config
+from replay import replay_days, summarize, load_senec_db_day
+
+# Keep the replay quiet
+log_config.setup(logging.WARNING)
+
+CONFIGURATIONS = {
+    "reactive"     : {"forecast_enabled": False, "hysteresis_seconds": 30},
+    "predictive"   : {"forecast_enabled": True, "hysteresis_seconds": 30},
+    "predictive-15": {"forecast_enabled": True, "hysteresis_seconds": 15}
+}
+
+def synthetic_day(seed, start=1685570400.0, peak=9000.0, base_load=450.0):
+    """
+    One day of 1 Hz samples with a partly cloudy sky.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    cloud = 1.0
+    for second in range(0, 86400):
+        sun = max(math.sin(math.pi * (second - 6 * 3600) / (15 * 3600)), 0.0) if 6 * 3600 <= second <= 21 * 3600 else 0.0
+        if rnd.random() < 1 / 300:
+            cloud = rnd.choice([0.2, 0.4, 1.0, 1.0])
+        load = base_load + (2000.0 if rnd.random() < 0.002 else 0.0) + rnd.gauss(0, 30)
+        rows.append((start + second, peak * sun * cloud, max(load, 0.0), ((True, 3), (False, 3))))
+    return rows
+
+def report(name, results):
+    total = summarize(results)
+    print(f"{name:<14} switches: {total['switches']:>5}   self_consumption: {total['self_consumption']:6.1%}   "
+          f"wallbox_pv_share: {total['wallbox_pv_share']:6.1%}   wallbox_energy: {total['wallbox_energy'] / 1000.0:8.1f} kWh")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded days through the automatic charging.")
+    parser.add_argument("--db", help="SenecDB file with recorded measurements")
+    parser.add_argument("--day", action="append", default=[], help="Local day (YYYY-MM-DD) to replay, can be repeated")
+    parser.add_argument("--synthetic", type=int, default=0, help="Number of synthetic days to replay instead")
+    parser.add_argument("--workers", type=int, default=1, help="Replay days in parallel in this many processes")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        days = [synthetic_day(seed) for seed in range(args.synthetic)]
+    elif args.db and args.day:
+        days = [load_senec_db_day(args.db, day) for day in args.day]
+    else:
+        parser.error("Either --db and --day or --synthetic is required.")
+
+    for name, settings in CONFIGURATIONS.items():
+        report(name, replay_days(days, settings, {"sunChargingParking": True}, args.workers))
@@ -0,0 +1,172 @@
+"""
+Append-only log of raw device responses, e.g. to reproduce incidents or to feed replays.
+
+File layout:
+    MAGIC
+    Block*      BLOCK_HEADER (magic, flags, raw length, stored length) + stored bytes
+Records within a block (after decompression):
+    Record*     RECORD_HEADER (wall-clock ts, monotonic ns, source length, payload length) + source + payload
+
+Blocks are compressed with zstd if requested and the zstandard package is installed.
+"""
+import os
+import mmap
+import time
+import struct
+import atexit
+import logging
+import threading
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger("CaptureLog")
+
+MAGIC = b"SWCAP01\n"
+BLOCK_MAGIC = b"BLK1"
+BLOCK_HEADER = struct.Struct("<4sBII")
+RECORD_HEADER = struct.Struct("<dQHI")
+FLAG_ZSTD = 0x01
+
+CaptureRecord = namedtuple("CaptureRecord", ["source", "wall_ts", "monotonic_ns", "payload"])
+
+class CaptureWriter():
+    """
+    Appends records to a capture log. Records are buffered and written as one block
+    when the buffer exceeds block_size or flush_interval seconds have passed.
+    """
+
+    def __init__(self, path, compress=False, block_size=64 * 1024, flush_interval=5.0):
+        self.path = path
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.compressor = None
+        if compress:
+            if zstandard:
+                self.compressor = zstandard.ZstdCompressor()
+            else:
+                log.warning("Package zstandard not installed. Capturing without compression.")
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+            self.file.flush()
+
+    def append(self, source, payload):
+        source = source.encode()
+        monotonic_ns = time.monotonic_ns()
+        with self.lock:
+            self.buffer += RECORD_HEADER.pack(time.time(), monotonic_ns, len(source), len(payload))
+            self.buffer += source
+            self.buffer += payload
+            if len(self.buffer) >= self.block_size or monotonic_ns / 1e9 - self.last_flush >= self.flush_interval:
+                self.__write_block()
+
+    def flush(self):
+        with self.lock:
+            self.__write_block()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.__write_block()
+                self.file.close()
+
+    def __write_block(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer or self.file.closed:
+            return
+        raw = bytes(self.buffer)
+        self.buffer.clear()
+        if self.compressor:
+            stored = self.compressor.compress(raw)
+            flags = FLAG_ZSTD
+        else:
+            stored = raw
+            flags = 0
+        self.file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, flags, len(raw), len(stored)))
+        self.file.write(stored)
+        self.file.flush()
+
+class CaptureReader():
+    """
+    Iterates over the records of a capture log. The file is memory-mapped,
+    only the block that is currently iterated is decompressed.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+        if self.mmap is None or self.mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a capture log.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.mmap:
+            self.mmap.close()
+        self.file.close()
+
+    def __iter__(self):
+        offset = len(MAGIC)
+        end = len(self.mmap)
+        while offset + BLOCK_HEADER.size <= end:
+            magic, flags, raw_length, stored_length = BLOCK_HEADER.unpack_from(self.mmap, offset)
+            offset += BLOCK_HEADER.size
+            if magic != BLOCK_MAGIC or offset + stored_length > end:
+                # Block was not written completely, e.g. process killed while writing
+                log.warning("Capture log ends with an incomplete block at offset %s.", offset - BLOCK_HEADER.size)
+                return
+            if flags & FLAG_ZSTD:
+                if zstandard is None:
+                    raise RuntimeError("Package zstandard is required to read compressed capture logs.")
+                block = zstandard.ZstdDecompressor().decompress(self.mmap[offset:offset + stored_length], max_output_size=raw_length)
+                yield from self.__iter_block(block, 0, raw_length)
+            else:
+                yield from self.__iter_block(self.mmap, offset, offset + stored_length)
+            offset += stored_length
+
+    def __iter_block(self, block, offset, end):
+        while offset < end:
+            wall_ts, monotonic_ns, source_length, payload_length = RECORD_HEADER.unpack_from(block, offset)
+            offset += RECORD_HEADER.size
+            source = block[offset:offset + source_length].decode()
+            offset += source_length
+            yield CaptureRecord(source, wall_ts, monotonic_ns, block[offset:offset + payload_length])
+            offset += payload_length
+
+writers = {}
+writers_lock = threading.Lock()
+
+def get_writer(settings):
+    """
+    Shared writer for the capture log configured in settings["common"]["capture_file"],
+    or None if capturing is not enabled.
+    """
+    path = settings.get("common", {}).get("capture_file")
+    if not path:
+        return None
+    with writers_lock:
+        if path not in writers:
+            log.info("Capturing raw device responses to %s", path)
+            writers[path] = CaptureWriter(path, compress=settings["common"].get("capture_compress", False))
+        return writers[path]
+
+@atexit.register
+def close_writers():
+    with writers_lock:
+        for writer in writers.values():
+            writer.close()
@@ -0,0 +1,94 @@
+"""
+Circuit breaker for appliances that may be unreachable.
+"""
+import time
+import random
+import logging
+import threading
+
+from metrics import registry
+
+log = logging.getLogger("CircuitBreaker")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+registry.describe("device_circuit_state", "gauge", "Circuit breaker state per device (0 closed, 1 half open, 2 open)")
+registry.describe("device_request_failures_total", "counter", "Failed requests per device")
+registry.describe("device_requests_short_circuited_total", "counter", "Requests per device answered without accessing the device")
+
+class CircuitBreaker():
+    """
+    After failure_threshold consecutive failures the circuit opens: requests fail fast
+    without accessing the device. After a backoff one request is let through as a probe.
+    If it fails, the backoff doubles (up to max_backoff, with random jitter), if it
+    succeeds the circuit closes again.
+    """
+
+    def __init__(self, name, failure_threshold=3, base_backoff=2.0, max_backoff=300.0, jitter=0.2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = 0.0
+        self.next_attempt = 0.0
+        registry.set("device_circuit_state", STATE_VALUES[CLOSED], device=name)
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.next_attempt:
+                self.__set_state(HALF_OPEN)
+                return True
+        registry.inc("device_requests_short_circuited_total", device=self.name)
+        return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                log.info("%s: Reachable again.", self.name)
+                self.__set_state(CLOSED)
+            self.failures = 0
+            self.backoff = 0.0
+
+    def record_failure(self):
+        registry.inc("device_request_failures_total", device=self.name)
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.backoff = min(self.backoff * 2 if self.backoff else self.base_backoff, self.max_backoff)
+                delay = self.backoff * random.uniform(1 - self.jitter, 1 + self.jitter)
+                self.next_attempt = time.monotonic() + delay
+                if self.state != OPEN:
+                    log.warning("%s: Not reachable. Trying again in %.1f s.", self.name, delay)
+                self.__set_state(OPEN)
+
+    def record_skipped(self):
+        """
+        An allowed request was not sent after all, e.g. it was invalid. A probe may be made again.
+        """
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.__set_state(OPEN)
+
+    def is_closed(self):
+        return self.state == CLOSED
+
+    def get_state(self):
+        with self.lock:
+            return {
+                "state"   : self.state,
+                "failures": self.failures,
+                "retry_in": round(max(self.next_attempt - time.monotonic(), 0.0), 1) if self.state == OPEN else 0.0
+            }
+
+    def __set_state(self, state):
+        self.state = state
+        registry.set("device_circuit_state", STATE_VALUES[state], device=self.name)
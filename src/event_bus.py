@@ -0,0 +1,134 @@
+"""
+In-process publish/subscribe between plugins.
+
+Sources publish events when they have new data, consumers subscribe with topic
+filters and wait for events instead of polling other plugins. Every subscription
+has a bounded queue: if a consumer falls behind, its oldest events are dropped.
+
+Topics are paths like "measurement/house" or "command/wallbox/0", filters are
+fnmatch patterns like "measurement/*".
+"""
+import time
+import logging
+import threading
+from collections import deque
+from fnmatch import fnmatchcase
+
+from metrics import registry
+
+log = logging.getLogger("EventBus")
+
+registry.describe("event_bus_published_total", "counter", "Events published per topic")
+registry.describe("event_bus_dropped_total", "counter", "Events dropped per subscription because its queue was full")
+
+class Event():
+    """
+    Payload should not be changed after publishing, all subscribers get the same object.
+    """
+    __slots__ = ("topic", "payload", "source", "ts")
+
+    def __init__(self, topic, payload, source=None, ts=None):
+        self.topic = topic
+        self.payload = payload
+        self.source = source
+        self.ts = ts if ts is not None else time.time()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.topic!r}, source={self.source!r}, ts={self.ts})"
+
+class Measurement(Event):
+    """
+    New data of a source, usually a snapshot.Snapshot.
+    """
+    __slots__ = ()
+
+class Command(Event):
+    """
+    Request to a plugin to change something on its appliance.
+    """
+    __slots__ = ()
+
+class Subscription():
+
+    def __init__(self, bus, name, patterns, event_type, maxlen):
+        self.bus = bus
+        self.name = name
+        self.patterns = patterns
+        self.event_type = event_type
+        self.queue = deque(maxlen=maxlen)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def add_patterns(self, patterns):
+        """
+        Also receive events matching these patterns from now on.
+        """
+        # Publishers iterate without lock, so the list is replaced, never changed
+        self.patterns = self.patterns + [pattern for pattern in patterns if pattern not in self.patterns]
+
+    def matches(self, event):
+        return isinstance(event, self.event_type) and any(fnmatchcase(event.topic, pattern) for pattern in self.patterns)
+
+    def put(self, event):
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                # The deque drops the oldest event
+                self.dropped += 1
+                registry.inc("event_bus_dropped_total", subscription=self.name)
+            self.queue.append(event)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Next event, or None if there is none within timeout seconds.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue, timeout):
+                return None
+            return self.queue.popleft()
+
+    def get_all(self, timeout=None):
+        """
+        All pending events, waits up to timeout seconds for at least one.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue, timeout):
+                return []
+            events = list(self.queue)
+            self.queue.clear()
+            return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+class EventBus():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = ()
+
+    def subscribe(self, name, patterns="*", event_type=Event, maxlen=100):
+        """
+        name:       Used in logs and metrics
+        patterns:   fnmatch pattern or list of patterns the topic must match
+        event_type: Only events of this type (or subclasses)
+        maxlen:     Queue length, older events are dropped
+        """
+        patterns = [patterns] if isinstance(patterns, str) else list(patterns)
+        subscription = Subscription(self, name, patterns, event_type, maxlen)
+        with self.lock:
+            # Publishers iterate without lock, so the tuple is replaced, never changed
+            self.subscriptions = self.subscriptions + (subscription,)
+        log.debug("%s subscribed to %s.", name, patterns)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+
+    def publish(self, event):
+        registry.inc("event_bus_published_total", topic=event.topic)
+        for subscription in self.subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+        return event
@@ -0,0 +1,47 @@
+"""
+Requests handled by plugin endpoints in another process, see multi_worker.py and plugin_process.py.
+"""
+from requests.structures import CaseInsensitiveDict
+
+def get_params(req):
+    """
+    Query parameters of a request to send to another process, as they are read with req.params[key].
+    The QueryDict of responder would become lists of values with dict().
+    """
+    return {key: req.params[key] for key in req.params}
+
+class ForwardedRequest():
+    """
+    The parts of a request the plugin endpoints use.
+    """
+
+    def __init__(self, params, headers):
+        self.params = params
+        self.headers = CaseInsensitiveDict(headers)
+
+class ForwardedResponse():
+
+    def __init__(self):
+        self.status_code = 200
+        self.headers = {}
+        self.media = None
+        self.text = None
+        self.html = None
+        self.content = None
+
+    def get_result(self):
+        return (self.status_code, self.headers, self.media, self.text, self.html, self.content)
+
+    @staticmethod
+    def apply_result(result, resp):
+        (status_code, headers, media, text, html, content) = result
+        resp.status_code = status_code
+        resp.headers.update(headers)
+        if content is not None:
+            resp.content = content
+        elif media is not None:
+            resp.media = media
+        elif html is not None:
+            resp.html = html
+        elif text is not None:
+            resp.text = text
@@ -0,0 +1,52 @@
+"""
+Serialize published data to JSON once and serve the bytes to every request.
+
+Uses orjson if it is installed, otherwise the json module of the standard library.
+"""
+import json
+import hashlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(data):
+    """
+    Serialize data to JSON bytes. Non-string dict keys are converted to strings, like json.dumps does.
+    Objects with an as_dict() method are serialized as that dict.
+    """
+    if orjson:
+        return orjson.dumps(data, default=as_serializable, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=as_serializable, separators=(",", ":")).encode()
+
+def as_serializable(obj):
+    """
+    Fallback for objects the JSON encoder does not know.
+    """
+    if hasattr(obj, "as_dict"):
+        return obj.as_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def serialize(data):
+    """
+    (body, etag) for data, where etag is a strong ETag over the body.
+    """
+    body = dumps(data)
+    return body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def serve(req, resp, body, etag):
+    resp.headers["ETag"] = etag
+    if etag_matches(req.headers.get("If-None-Match", ""), etag):
+        resp.status_code = 304
+        resp.content = b""
+        return
+    resp.headers["Content-Type"] = "application/json"
+    resp.content = body
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison as required for If-None-Match
+    return "*" in candidates or etag in [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
@@ -0,0 +1,89 @@
+"""
+Central logging configuration.
+
+Records are handed to a queue by the logging thread and written by a separate
+listener thread, so writing to the console never blocks a control or poll loop.
+Repeated warnings and errors (same logger, level and message, e.g. an unreachable
+device every second) are only written once per interval, with a count.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+FORMAT = '%(asctime)s %(levelname)s:%(message)s'
+
+class RepeatFilter(logging.Filter):
+    """
+    Passes a message, then suppresses the same message for `interval` seconds.
+    The next message after the interval tells how often it was suppressed.
+    Messages are identified by logger, level and the message with its arguments.
+    Only messages of min_level and above are filtered, informational ones all pass.
+    """
+
+    def __init__(self, interval=60.0, min_level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.min_level = min_level
+        self.lock = threading.Lock()
+        self.seen = {} # (logger, level, message) -> (time passed, suppressed since)
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            (passed, suppressed) = self.seen.get(key, (None, 0))
+            if passed is not None and now - passed < self.interval:
+                self.seen[key] = (passed, suppressed + 1)
+                return False
+            self.seen[key] = (now, 0)
+            if len(self.seen) > 1000:
+                self.__forget_old(now)
+        if suppressed:
+            record.msg = f"{record.msg} (repeated {suppressed} times)"
+        return True
+
+    def __forget_old(self, now):
+        self.seen = {key: value for key, value in self.seen.items() if now - value[0] < self.interval}
+
+listener = None
+
+def setup(level=logging.INFO, repeat_interval=60.0):
+    """
+    Configure the root logger. Can be called again, e.g. to change the level.
+    """
+    global listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if listener is not None:
+        return
+    records = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(FORMAT))
+    handler = QueueHandler(records)
+    handler.addFilter(RepeatFilter(repeat_interval))
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    listener = QueueListener(records, console, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=restart_after_fork)
+
+def restart_after_fork():
+    """
+    A forked process (see multi_worker.py) has the queue, but not the listener thread.
+    """
+    global listener
+    listener = QueueListener(listener.queue, *listener.handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+def setup_from_settings(settings):
+    common = settings.get("common", {})
+    setup(logging.getLevelName(common.get("log_level", "INFO")), common.get("log_repeat_interval", 60.0))
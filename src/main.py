@@ -4,10 +4,13 @@ import time
 import json
 import logging
 
+import log_config
+import multi_worker
+from state_store import Checkpointer
 from web_server import WebServer
 from plugin_collection import PluginCollection
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
+log_config.setup()
 log = logging.getLogger("Main")
 
 if __name__ == "__main__":
@@ -20,6 +23,7 @@ if __name__ == "__main__":
         log.error("Could not open src/config/settings.json")
         log.error("Please fill in sample_settings.json to your needs and copy to src/config/settings.json or to your config volume!")
         sys.exit("Could not open settings.json")
+    log_config.setup_from_settings(settings)
 
     # Create plugin collection with all plugins found in the plugins folder
     # and install assets
@@ -34,7 +38,15 @@ if __name__ == "__main__":
     # default settings will be used.
     plugin_collection.apply_settings(settings)
 
+    # Continue where the last run stopped: switches, controller state and the last data
+    checkpointer = Checkpointer.from_settings(settings, plugin_collection)
+    if checkpointer:
+        checkpointer.restore()
+
     try:
-        WebServer(settings, plugin_collection).run()
+        if settings['web'].get('workers', 1) > 1:
+            multi_worker.run(settings, plugin_collection)
+        else:
+            WebServer(settings, plugin_collection).run()
     except KeyboardInterrupt:
         log.info("Bye bye!")
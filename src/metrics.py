@@ -0,0 +1,60 @@
+"""
+Process wide metrics, served in Prometheus text format on /metrics.
+"""
+import threading
+
+class Metrics():
+    """
+    Gauges and counters, identified by name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}        # (name, ((label, value), ...)) -> value
+        self.descriptions = {}  # name -> (type, help)
+
+    def describe(self, name, metric_type, description):
+        self.descriptions[name] = (metric_type, description)
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, name, **labels):
+        return self.values.get((name, tuple(sorted(labels.items()))))
+
+    def get_values(self):
+        """
+        Copy of all values: (name, ((label, value), ...)) -> value
+        """
+        with self.lock:
+            return dict(self.values)
+
+    def clear(self):
+        """
+        Forget all values, e.g. those a forked process copied from its parent.
+        """
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        lines = []
+        last_name = None
+        for (name, labels), value in values:
+            if name != last_name and name in self.descriptions:
+                metric_type, description = self.descriptions[name]
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+            last_name = name
+            label_str = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = Metrics()
@@ -0,0 +1,205 @@
+"""
+Serve HTTP from several worker processes, poll devices in one collector process.
+
+The collector runs the plugin runtimes as usual. It writes the serialized snapshots
+of all plugins to a SharedSnapshotStore (see shared_snapshots.py), the workers serve
+?format=json requests of the plugins from there, without asking the collector or the
+devices. All other requests (pages, commands, /metrics) are forwarded to the collector,
+which handles them with the plugin endpoints as in single process mode.
+
+The workers are forked after the plugins were loaded and configured, but before any
+runtime was started, and share one listening socket.
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import socket
+import logging
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+
+import json_cache
+from web_server import WebServer
+from forwarding import ForwardedRequest, ForwardedResponse, get_params
+from shared_snapshots import SharedSnapshotStore, get_default_path
+
+log = logging.getLogger("MultiWorker")
+
+class CommandServer():
+    """
+    Collector side: handles forwarded requests with the real endpoints.
+    """
+
+    def __init__(self, address, authkey):
+        self.listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        self.endpoints = {}
+
+    def start(self, endpoints):
+        self.endpoints = endpoints
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except Exception as e:
+                log.warning("Rejected worker connection: %s", e)
+                continue
+            threading.Thread(target=self.__handle, args=(connection,), daemon=True).start()
+
+    def __handle(self, connection):
+        with connection:
+            while True:
+                try:
+                    (path, params, headers) = connection.recv()
+                except (EOFError, OSError):
+                    return
+                resp = ForwardedResponse()
+                try:
+                    self.endpoints[path](ForwardedRequest(params, headers), resp)
+                except Exception as e:
+                    log.exception("Forwarded request to %s failed.", path)
+                    resp = ForwardedResponse()
+                    resp.status_code = 500
+                    resp.text = str(e)
+                connection.send(resp.get_result())
+
+class CommandClient():
+    """
+    Worker side: forwards requests to the collector. Every concurrent request uses its own connection.
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.idle = queue.SimpleQueue()
+
+    def forward(self, path, req, resp):
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        try:
+            connection.send((path, get_params(req), dict(req.headers)))
+            result = connection.recv()
+        except (EOFError, OSError):
+            connection.close()
+            raise
+        self.idle.put(connection)
+        ForwardedResponse.apply_result(result, resp)
+
+class WorkerBackend():
+    """
+    Endpoints of a worker's WebServer.
+    """
+
+    def __init__(self, store, client, snapshot_paths):
+        self.store = store
+        self.client = client
+        self.snapshot_paths = snapshot_paths
+
+    def get_endpoint(self, path):
+        def endpoint(req, resp):
+            if path in self.snapshot_paths and req.params.get('format') == "json":
+                self.__serve_snapshot(path, req, resp)
+                return
+            try:
+                self.client.forward(path, req, resp)
+            except (EOFError, OSError) as e:
+                log.error("Collector not reachable: %s", e)
+                resp.status_code = 503
+                resp.text = "Collector not reachable."
+        return endpoint
+
+    def __serve_snapshot(self, path, req, resp):
+        key = f"{path}?device={req.params['device']}" if 'device' in req.params else path
+        entry = self.store.get(key)
+        if entry is None:
+            resp.status_code = 503 if path == key else 404
+            resp.text = "No data yet." if path == key else "Unknown device."
+            return
+        (body, etag) = entry
+        json_cache.serve(req, resp, body, etag)
+
+class SnapshotExporter():
+    """
+    Collector side: writes all snapshots to the store whenever one of them changed.
+    """
+
+    def __init__(self, store, plugins, interval=0.1):
+        self.store = store
+        self.plugins = plugins
+        self.interval = interval
+        self.seqs = None
+
+    def get_snapshots(self):
+        snapshots = {}
+        for plugin in self.plugins.get_plugins():
+            for key, publisher in plugin.get_publishers().items():
+                snapshots[key] = publisher.get()
+        return snapshots
+
+    def export(self):
+        snapshots = self.get_snapshots()
+        seqs = {key: snapshot.seq for key, snapshot in snapshots.items()}
+        if seqs == self.seqs:
+            return False
+        self.store.write({key: snapshot.get_json() for key, snapshot in snapshots.items()})
+        self.seqs = seqs
+        return True
+
+    def run(self, workers):
+        while True:
+            try:
+                self.export()
+            except Exception as e:
+                log.error("Exporting snapshots failed: %s", e)
+            for worker in workers:
+                if worker.exitcode is not None and not worker.reported:
+                    log.error("Worker %s exited with %s.", worker.name, worker.exitcode)
+                    worker.reported = True
+            time.sleep(self.interval)
+
+def run_worker(settings, plugins, sock, store_path, address, authkey, snapshot_paths):
+    store = SharedSnapshotStore(store_path)
+    backend = WorkerBackend(store, CommandClient(address, authkey), snapshot_paths)
+    WebServer(settings, plugins, backend).run(sockets=[sock])
+
+def run(settings, plugins):
+    """
+    Start settings['web']['workers'] web workers, then run the plugins in this process. Does not return.
+    """
+    worker_count = settings['web']['workers']
+    store_path = settings['web'].get('snapshot_file') or get_default_path()
+    store = SharedSnapshotStore.create(store_path, settings['web'].get('snapshot_store_size', 4 * 1024 * 1024))
+    exporter = SnapshotExporter(store, plugins)
+    # Workers must never see an empty store if the plugins already have data
+    exporter.export()
+    snapshot_paths = {plugin.settings['plugin_path'] for plugin in plugins.get_plugins() if plugin.get_publishers()}
+
+    address = os.path.join(tempfile.mkdtemp(prefix="solar-wallbox-"), "collector.sock")
+    authkey = os.urandom(32)
+    command_server = CommandServer(address, authkey)
+
+    sock = socket.create_server((settings['web']['address'], settings['web']['port']))
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for n in range(worker_count):
+        worker = context.Process(target=run_worker, name=f"web-worker-{n}", daemon=True,
+                                 args=(settings, plugins, sock, store_path, address, authkey, snapshot_paths))
+        worker.start()
+        worker.reported = False
+        workers.append(worker)
+    sock.close()
+    log.info("Started %s web workers on %s:%s.", worker_count, settings['web']['address'], settings['web']['port'])
+
+    # Threads only from here on, the workers were forked without them
+    collector = WebServer(settings, plugins)
+    command_server.start(collector.get_endpoints())
+    # Exit normally on SIGTERM (e.g. docker stop), so the state is saved, see state_store.py
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    exporter.run(workers)
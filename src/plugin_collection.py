@@ -4,12 +4,15 @@ import shutil
 import errno
 import pkgutil
 import logging
+import threading
+
+from event_bus import EventBus
+from plugin_process import PluginProcess
 
 """
 Greatfully taken from: https://github.com/gdiepen/python_plugin_example
 """
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
 log = logging.getLogger("PluginCollection")
 
 class Plugin(object):
@@ -26,6 +29,29 @@ class Plugin(object):
         """
         raise NotImplementedError
 
+    def get_publishers(self):
+        """Snapshot publishers whose json may be served without asking the plugin,
+        by plugin_path (or plugin_path?device=n). See multi_worker.py.
+        """
+        return {}
+
+    def get_sources(self):
+        """Snapshot publishers by source name, e.g. "house", combined in /api/snapshot.
+        See snapshot_api.py.
+        """
+        return {}
+
+    def get_state(self):
+        """State to keep across restarts as JSON serializable dict, None if there is none.
+        See state_store.py.
+        """
+        return None
+
+    def restore_state(self, state):
+        """Called with the dict of get_state() before the runtime is started.
+        """
+        pass
+
 
 class PluginCollection(object):
     """Upon creation, this class will read the plugins package for modules
@@ -39,6 +65,10 @@ class PluginCollection(object):
         self.plugin_package = plugin_package
         self.assets_destination_dir = assets_dir
         self.templates_destination_dir = templates_dir
+        # Plugins publish and subscribe to measurements and commands here, see event_bus.py
+        self.events = EventBus()
+        # Isolated plugins by name, their runtimes run in child processes, see plugin_process.py
+        self.processes = {}
         self.reload_plugins()
 
 
@@ -48,14 +78,42 @@ class PluginCollection(object):
         """
         self.plugins = []
         self.seen_paths = []
-        log.info(f' Looking for plugins under package {self.plugin_package}')
+        log.info(' Looking for plugins under package %s', self.plugin_package)
         self.walk_package(self.plugin_package)
-        log.info(f' ... done!')
+        log.info(' ... done!')
         self.install_plugin_frontends()
 
     def apply_settings(self, settings):
         for plugin in self.plugins:
             plugin.apply_settings(settings)
+        self.processes = {type(plugin).__name__: PluginProcess(plugin, self) for plugin in self.plugins
+                          if plugin.has_runtime and plugin.settings.get('isolated', False)}
+        for name in self.processes:
+            log.info(' Runtime of %s will run in its own process.', name)
+
+    def start_runtimes(self):
+        """Start the runtimes of all plugins that have one. Isolated plugins first,
+        their zygotes are forked before this process starts the threads of the others.
+        """
+        for process in self.processes.values():
+            process.fork_zygote()
+        for process in self.processes.values():
+            process.start()
+        for plugin in self.plugins:
+            if plugin.has_runtime and type(plugin).__name__ not in self.processes:
+                threading.Thread(target=plugin.runtime, args=(self,), daemon=True).start()
+
+    def get_endpoint(self, plugin):
+        """Endpoint of the plugin, forwarded to its process if it is isolated
+        """
+        process = self.processes.get(type(plugin).__name__)
+        return process.endpoint if process else plugin.endpoint
+
+    def get_state(self, plugin):
+        """State of the plugin to save, as reported by its process if it is isolated
+        """
+        process = self.processes.get(type(plugin).__name__)
+        return process.get_state() if process else plugin.get_state()
 
     def list_plugins(self):
         """Output a list of the plugin names
@@ -79,10 +137,10 @@ class PluginCollection(object):
         """
         for plugin in self.plugins:
             if(plugin_name == type(plugin).__name__):
-                log.debug(f"Plugin {plugin_name} found. Executing!")
+                log.debug("Plugin %s found. Executing!", plugin_name)
                 return plugin.perform_operation(argument)
             else:
-                log.debug(f"Plugin {plugin_name} not found :-(")
+                log.debug("Plugin %s not found :-(", plugin_name)
 
 
     def apply_all_plugins_on_value(self, argument):
@@ -96,7 +154,7 @@ class PluginCollection(object):
             - Static assets in: assets_destination_dir + "/{pluginname}/"
             - Templates in: templates_destination_dir + "/{pluginname}/"
         """
-        log.info(f' Installing plugin assets...')
+        log.info(' Installing plugin assets...')
         for plugin in self.plugins:
             plugin_folder = type(plugin).__module__.split('.')[1]
             # Check if plugin has "assets" folder, and copy
@@ -105,9 +163,9 @@ class PluginCollection(object):
             # Clear destination folder
             shutil.rmtree(dest_dir, ignore_errors=True)
             if os.path.isdir(source_dir):
-                log.debug(f" Copy assets for plugin {type(plugin).__name__}")
-                log.debug(f"    from: {source_dir}")
-                log.debug(f"    to  : {dest_dir}")
+                log.debug(" Copy assets for plugin %s", type(plugin).__name__)
+                log.debug("    from: %s", source_dir)
+                log.debug("    to  : %s", dest_dir)
                 self.copy(source_dir, dest_dir)
             
             # Check if plugin has "templates" folder, and copy
@@ -116,11 +174,11 @@ class PluginCollection(object):
             # Clear destination folder
             shutil.rmtree(dest_dir, ignore_errors=True)
             if os.path.isdir(source_dir):
-                log.debug(f" Copy templates for plugin {type(plugin).__name__}")
-                log.debug(f"    from: {source_dir}")
-                log.debug(f"    to  : {dest_dir}")
+                log.debug(" Copy templates for plugin %s", type(plugin).__name__)
+                log.debug("    from: %s", source_dir)
+                log.debug("    to  : %s", dest_dir)
                 self.copy(source_dir, dest_dir)
-        log.info(f' ... done!')
+        log.info(' ... done!')
 
     def walk_package(self, package):
         """Recursively walk the supplied package to retrieve all plugins
@@ -134,7 +192,7 @@ class PluginCollection(object):
                 for (_, c) in clsmembers:
                     # Only add classes that are a sub class of Plugin, but NOT Plugin itself
                     if issubclass(c, Plugin) & (c is not Plugin):
-                        log.info(f'    Found plugin class: {c.__module__}.{c.__name__}')
+                        log.info('    Found plugin class: %s.%s', c.__module__, c.__name__)
                         self.plugins.append(c())
 
 
@@ -165,4 +223,4 @@ class PluginCollection(object):
             if e.errno == errno.ENOTDIR:
                 shutil.copy(src, dest)
             else:
-                log.error('Directory not copied. Error: %s' % e)
+                log.error('Directory not copied. Error: %s', e)
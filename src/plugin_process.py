@@ -0,0 +1,461 @@
+"""
+Run plugin runtimes in child processes, for plugins that block or need a lot of CPU.
+
+The runtime of a plugin with "isolated": true in its settings runs in a process of its own
+instead of a thread of the web server. It does not compete with request handling and the
+other runtimes for the GIL, and a crash does not take them down. The child is forked after
+the state was restored and exchanges everything else over a pipe:
+    events:     Events the plugin publishes go to the EventBus of the main process. Events of
+                the main process matching the plugin's subscriptions go to the child.
+    snapshots:  New snapshots of the plugin's publishers are mirrored to the plugin object in
+                the main process, where /api/snapshot, the Dashboard and the web workers read them.
+    requests:   The plugin endpoint is called in the child, like web workers forward requests
+                to the collector (see multi_worker.py).
+    state:      get_state() of the child every state_interval seconds. The Checkpointer of the
+                main process saves it, a restarted child continues with it.
+    metrics:    The metrics of the child, with the additional label process="<plugin>".
+A supervisor thread restarts a crashed child, with increasing delay if it keeps crashing.
+
+Children are not forked from the main process itself, which runs many threads by then: a lock
+held by one of them at the time of the fork (e.g. of the metrics registry or the EventBus)
+would never be released in the child. A zygote process is forked at the start instead, before
+the main process starts the other runtimes, and forks every child of the plugin.
+
+Messages are pickled tuples. The main process imports the plugin modules as well, so this
+protects against blocking, CPU load and crashes, not against malicious plugins.
+"""
+import os
+import sys
+import time
+import atexit
+import logging
+import itertools
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.connection
+import concurrent.futures
+from multiprocessing import reduction
+
+from metrics import registry
+from event_bus import EventBus, Event
+from forwarding import ForwardedRequest, ForwardedResponse, get_params
+
+log = logging.getLogger("PluginProcess")
+
+registry.describe("plugin_process_running", "gauge", "1 while the child process of an isolated plugin runs")
+registry.describe("plugin_process_restarts_total", "counter", "Restarts of the child process of an isolated plugin")
+
+class Channel():
+    """
+    One end of the pipe. Several threads may send, one receives.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.connection.send(message)
+
+    def recv(self):
+        return self.connection.recv()
+
+    def close(self):
+        self.connection.close()
+
+class ChildEventBus(EventBus):
+    """
+    EventBus of the child, connected to the EventBus of the main process.
+    """
+
+    def __init__(self, channel):
+        super().__init__()
+        self.channel = channel
+
+    def subscribe(self, name, patterns="*", event_type=Event, maxlen=100):
+        subscription = super().subscribe(name, patterns, event_type, maxlen)
+        self.channel.send(("subscribe", subscription.patterns))
+        return subscription
+
+    def publish(self, event):
+        super().publish(event)
+        self.channel.send(("event", event))
+        return event
+
+    def deliver(self, event):
+        """
+        Event of the main process, only to the subscribers in this process.
+        """
+        return super().publish(event)
+
+def get_mirrored_publishers(plugin):
+    """
+    (kind, key) -> publisher, for the publishers of Plugin.get_publishers() and Plugin.get_sources().
+    """
+    publishers = {("publisher", key): publisher for key, publisher in plugin.get_publishers().items()}
+    publishers.update({("source", name): publisher for name, publisher in plugin.get_sources().items()})
+    return publishers
+
+class PluginChild():
+    """
+    Child side: runs the runtime of the plugin and reports to the main process.
+    """
+
+    def __init__(self, plugin, plugins, connection, parent_connection, state, sync_interval, state_interval):
+        self.plugin = plugin
+        self.plugins = plugins
+        self.name = type(plugin).__name__
+        self.connection = connection
+        self.parent_connection = parent_connection
+        self.state = state
+        self.sync_interval = sync_interval
+        self.state_interval = state_interval
+        self.channel = None
+        self.bus = None
+
+    def run(self):
+        if self.parent_connection is not None:
+            # Otherwise the pipe would not be closed when the main process is gone
+            self.parent_connection.close()
+        self.channel = Channel(self.connection)
+        # Values copied from the main process are reported there already
+        registry.clear()
+        self.bus = ChildEventBus(self.channel)
+        self.plugins.events = self.bus
+        if self.state is not None:
+            try:
+                self.plugin.restore_state(self.state)
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("Could not restore state of %s: %s", self.name, e)
+        threading.Thread(target=self.__receive, name=f"{self.name} receiver", daemon=True).start()
+        threading.Thread(target=self.__sync, name=f"{self.name} sync", daemon=True).start()
+        self.plugin.runtime(self.plugins)
+
+    def __receive(self):
+        while True:
+            try:
+                message = self.channel.recv()
+            except (EOFError, OSError):
+                # The main process is gone
+                os._exit(0)
+            if message[0] == "event":
+                self.bus.deliver(message[1])
+            elif message[0] == "request":
+                threading.Thread(target=self.__handle, args=message[1:], daemon=True).start()
+
+    def __handle(self, request_id, params, headers):
+        resp = ForwardedResponse()
+        try:
+            self.plugin.endpoint(ForwardedRequest(params, headers), resp)
+        except Exception as e:
+            log.exception("Request to %s failed.", self.name)
+            resp = ForwardedResponse()
+            resp.status_code = 500
+            resp.text = str(e)
+        try:
+            self.channel.send(("response", request_id, resp.get_result()))
+        except OSError:
+            pass
+
+    def __sync(self):
+        seqs = {}
+        metrics = {}
+        state = self.state
+        state_checked = time.monotonic()
+        while True:
+            try:
+                for key, publisher in get_mirrored_publishers(self.plugin).items():
+                    snapshot = publisher.get()
+                    if seqs.get(key) != snapshot.seq:
+                        self.channel.send(("snapshot", key, snapshot))
+                        seqs[key] = snapshot.seq
+                values = registry.get_values()
+                changed = {key: value for key, value in values.items() if metrics.get(key) != value}
+                if changed:
+                    self.channel.send(("metrics", changed))
+                    metrics = values
+                if time.monotonic() - state_checked >= self.state_interval:
+                    state_checked = time.monotonic()
+                    current = self.plugin.get_state()
+                    if current != state:
+                        self.channel.send(("state", current))
+                        state = current
+            except OSError:
+                # The main process is gone, the receiver exits
+                return
+            except Exception as e:
+                log.error("Reporting to the main process failed: %s", e)
+            time.sleep(self.sync_interval)
+
+class Zygote():
+    """
+    Forks the children of a plugin, see above. Runs in a process of its own, with no threads
+    but the logging listener (see log_config.py).
+
+    Commands from the main process are the state for the new child, followed by the file
+    descriptor of the child's end of the pipe. Answers are ("started", pid) and
+    ("exited", pid, exitcode), with the exit code as in multiprocessing.Process.
+    """
+
+    def __init__(self, plugin, plugins, sync_interval, state_interval, poll_interval=0.5):
+        self.plugin = plugin
+        self.plugins = plugins
+        self.name = type(plugin).__name__
+        self.sync_interval = sync_interval
+        self.state_interval = state_interval
+        self.poll_interval = poll_interval
+        self.children = set()
+
+    def run(self, control, main_control):
+        main_control.close()
+        while True:
+            if multiprocessing.connection.wait([control], self.poll_interval):
+                try:
+                    state = control.recv()
+                    connection = multiprocessing.connection.Connection(reduction.recv_handle(control))
+                except (EOFError, OSError):
+                    # The main process is gone, the children notice it themselves
+                    os._exit(0)
+                pid = self.__fork(control, connection, state)
+                connection.close()
+                self.children.add(pid)
+                control.send(("started", pid))
+            for pid in list(self.children):
+                (done, status) = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    self.children.discard(pid)
+                    control.send(("exited", pid, os.waitstatus_to_exitcode(status)))
+
+    def __fork(self, control, connection, state):
+        pid = os.fork()
+        if pid != 0:
+            return pid
+        # The child, which must never return from here
+        exitcode = 1
+        try:
+            control.close()
+            PluginChild(self.plugin, self.plugins, connection, None, state, self.sync_interval, self.state_interval).run()
+            exitcode = 0
+        except BaseException:
+            # Like multiprocessing.Process does
+            sys.stderr.write(f"Process plugin-{self.name}:\n")
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)
+
+class PluginProcess():
+    """
+    Main process side of an isolated plugin: starts and supervises the child, forwards events
+    and requests to it and takes over what it reports.
+
+    restart_delay:      Seconds before the first restart, doubled with every crash in a row
+    max_restart_delay:  Longest delay. A child that ran that long did not crash in a row.
+    request_timeout:    Seconds the child may take for a request
+    sync_interval:      Seconds between checks of the child for new snapshots and metrics
+    state_interval:     Seconds between checks of the child for a new state
+    """
+
+    def __init__(self, plugin, plugins, restart_delay=1, max_restart_delay=60, request_timeout=10,
+                 sync_interval=0.1, state_interval=5):
+        self.plugin = plugin
+        self.plugins = plugins
+        self.name = type(plugin).__name__
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.request_timeout = request_timeout
+        self.sync_interval = sync_interval
+        self.state_interval = state_interval
+        self.context = multiprocessing.get_context("fork")
+        self.zygote = None
+        self.control = None
+        self.channel = None
+        self.state = None
+        self.subscription = None
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.started = False
+        self.stopping = False
+
+    def fork_zygote(self):
+        """
+        Fork the process that forks the children, before the caller starts more threads.
+        """
+        if self.zygote is not None:
+            return
+        # Duplex, i.e. a socket pair that can pass file descriptors
+        (self.control, zygote_control) = self.context.Pipe()
+        zygote = Zygote(self.plugin, self.plugins, self.sync_interval, self.state_interval)
+        self.zygote = self.context.Process(target=zygote.run, args=(zygote_control, self.control),
+                                           name=f"plugin-{self.name}-zygote", daemon=True)
+        self.zygote.start()
+        zygote_control.close()
+
+    def start(self):
+        """
+        Start the child, forking the zygote first if that was not done yet.
+        """
+        if self.started:
+            return
+        self.started = True
+        self.fork_zygote()
+        self.state = self.plugin.get_state()
+        # The child tells which topics it wants, see ChildEventBus
+        self.subscription = self.plugins.events.subscribe(f"{self.name} process", [], Event)
+        pid = self.__start_child(None)
+        # After the start, so it runs before multiprocessing terminates the zygote at exit
+        atexit.register(self.__stop)
+        threading.Thread(target=self.__forward_events, name=f"{self.name} events", daemon=True).start()
+        threading.Thread(target=self.__supervise, args=(pid,), name=f"{self.name} supervisor", daemon=True).start()
+
+    def get_state(self):
+        """
+        Latest state the child reported, or that was restored before it was started.
+        """
+        return self.state if self.started else self.plugin.get_state()
+
+    def endpoint(self, req, resp):
+        channel = self.channel
+        if channel is None:
+            resp.status_code = 503
+            resp.text = f"{self.name} is not running."
+            return
+        request_id = next(self.request_ids)
+        future = self.pending[request_id] = concurrent.futures.Future()
+        try:
+            channel.send(("request", request_id, get_params(req), dict(req.headers)))
+            result = future.result(self.request_timeout)
+        except (EOFError, OSError):
+            resp.status_code = 503
+            resp.text = f"{self.name} is not running."
+            return
+        except concurrent.futures.TimeoutError:
+            log.warning("%s did not answer within %s s.", self.name, self.request_timeout)
+            resp.status_code = 504
+            resp.text = f"{self.name} did not answer."
+            return
+        finally:
+            self.pending.pop(request_id, None)
+        ForwardedResponse.apply_result(result, resp)
+
+    def __start_child(self, state):
+        """
+        Let the zygote fork a child, returns its pid. Raises EOFError or OSError if the zygote is gone.
+        """
+        (parent_connection, child_connection) = self.context.Pipe()
+        try:
+            self.control.send(state)
+            reduction.send_handle(self.control, child_connection.fileno(), self.zygote.pid)
+            (_, pid) = self.control.recv()
+        finally:
+            child_connection.close()
+        self.channel = Channel(parent_connection)
+        registry.set("plugin_process_running", 1, plugin=self.name)
+        log.info("Started runtime of %s in process %s.", self.name, pid)
+        return pid
+
+    def __supervise(self, pid):
+        failures = 0
+        while True:
+            started = time.monotonic()
+            self.__receive(self.channel)
+            try:
+                exitcode = self.__wait_for_exit(pid)
+            except (EOFError, OSError):
+                exitcode = None
+            self.__stopped()
+            if self.stopping:
+                return
+            if exitcode is None:
+                log.error("Zygote of %s is gone, the runtime can not be restarted.", self.name)
+                return
+            if exitcode == 0:
+                log.info("Runtime of %s ended.", self.name)
+                return
+            if time.monotonic() - started >= self.max_restart_delay:
+                failures = 0
+            delay = min(self.restart_delay * 2 ** failures, self.max_restart_delay)
+            failures += 1
+            log.error("Runtime of %s exited with %s. Restarting in %s s...", self.name, exitcode, delay)
+            time.sleep(delay)
+            registry.inc("plugin_process_restarts_total", plugin=self.name)
+            try:
+                pid = self.__start_child(self.state)
+            except (EOFError, OSError):
+                log.error("Zygote of %s is gone, the runtime can not be restarted.", self.name)
+                return
+
+    def __wait_for_exit(self, pid):
+        while True:
+            message = self.control.recv()
+            if message[0] == "exited" and message[1] == pid:
+                return message[2]
+
+    def __receive(self, channel):
+        """
+        Handle the messages of the child until it is gone.
+        """
+        while True:
+            try:
+                message = channel.recv()
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                log.error("Invalid message from %s: %s", self.name, e)
+                continue
+            kind = message[0]
+            if kind == "event":
+                self.plugins.events.publish(message[1])
+            elif kind == "subscribe":
+                self.subscription.add_patterns(message[1])
+            elif kind == "snapshot":
+                self.__mirror(message[1], message[2])
+            elif kind == "state":
+                self.state = message[1]
+            elif kind == "metrics":
+                for (name, labels), value in message[1].items():
+                    registry.set(name, value, **{**dict(labels), "process": self.name})
+            elif kind == "response":
+                future = self.pending.pop(message[1], None)
+                if future is not None:
+                    future.set_result(message[2])
+
+    def __mirror(self, key, snapshot):
+        publisher = get_mirrored_publishers(self.plugin).get(key)
+        if publisher is None:
+            log.debug("%s has no publisher %s.", self.name, key)
+            return
+        publisher.mirror(snapshot)
+
+    def __stop(self):
+        self.stopping = True
+
+    def __stopped(self):
+        channel = self.channel
+        self.channel = None
+        channel.close()
+        registry.set("plugin_process_running", 0, plugin=self.name)
+        while self.pending:
+            try:
+                (_, future) = self.pending.popitem()
+            except KeyError:
+                break
+            future.set_exception(EOFError(f"{self.name} is not running."))
+
+    def __forward_events(self):
+        while True:
+            for event in self.subscription.get_all():
+                channel = self.channel
+                if channel is None or event.source == self.name:
+                    # Not running, or published by the child itself
+                    continue
+                try:
+                    channel.send(("event", event))
+                except OSError:
+                    # Gone, the supervisor restarts it
+                    pass
+                except Exception as e:
+                    log.warning("Could not forward %s to %s: %s", event, self.name, e)
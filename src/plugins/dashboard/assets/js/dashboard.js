@@ -163,9 +163,17 @@ function initVars() {
     });
 }
 
+/* Only what the page shows */
+const dashboardFields = [
+    "house.live_data",
+    "wallbox*.charging.current_power",
+    "wallbox*.access_control.allow_charging",
+    "dashboard.sunCharging*"
+].join(",");
+
 function updateHTML() {
     /*  */
-    fetch("/dashboard?format=json")
+    fetch("/api/snapshot?fields=" + dashboardFields)
         .then(response => {
             return response.json();
         })
@@ -222,8 +230,8 @@ function updateHelperHTML(json) {
     wallbox2.innerHTML  = json['wallbox2']['charging']['current_power'] + " W";
     wallbox2_switch.checked = json['wallbox2']['access_control']['allow_charging'];
 
-    automaticChargingParking_switch.checked = json['sunChargingParking']
-    automaticChargingGarage_switch.checked = json['sunChargingGarage']
+    automaticChargingParking_switch.checked = json['dashboard']['sunChargingParking']
+    automaticChargingGarage_switch.checked = json['dashboard']['sunChargingGarage']
 }
 
 function setSquareBackground(div, color) {
@@ -0,0 +1,169 @@
+"""
+Divide excess PV power across several wallboxes.
+"""
+import logging
+
+log = logging.getLogger("ExcessAllocator")
+
+class WallboxState():
+    """
+    Per wallbox state of the allocator: hysteresis counter and last commands.
+    """
+
+    def __init__(self, device_no, priority):
+        self.device_no = device_no
+        self.priority = priority    # Lower value is served first
+        self.enabled = False        # Sun charging switched on by the user
+        self.counter = 0            # Seconds with enough excess power for this wallbox
+        self.charging = False       # Charging was allowed by the allocator
+        self.ampere = None          # Last max_ampere sent to the wallbox
+        self.last_command = None    # Monotonic timestamp of last command sent to the wallbox
+
+    def reset(self):
+        self.counter = 0
+        self.charging = False
+        self.ampere = None
+
+    def get_state(self):
+        return {
+            "enabled" : self.enabled,
+            "priority": self.priority,
+            "counter" : self.counter,
+            "charging": self.charging,
+            "ampere"  : self.ampere
+        }
+
+class ExcessPowerAllocator():
+    """
+    Divides the excess power of one tick across all wallboxes with sun charging enabled.
+
+    Wallboxes are served in order of priority. Each one gets the highest amp level
+    that fits into the remaining excess power (amp * voltage * phases).
+    Charging is only allowed after a wallbox had enough power for `hysteresis` seconds
+    and stopped after the counter has drained again. Commands to a wallbox are sent
+    at most every `min_command_interval` seconds, except for stopping the charging.
+    Ticks may come at any rate, the counters advance by the time between them,
+    but by `max_tick_interval` seconds at most.
+    """
+
+    def __init__(self, amp_levels=(6, 8, 10, 12, 16), voltage=230, hysteresis=30, min_command_interval=30, max_tick_interval=10):
+        self.amp_levels = sorted(amp_levels)
+        self.voltage = voltage
+        self.hysteresis = hysteresis
+        self.min_command_interval = min_command_interval
+        self.max_tick_interval = max_tick_interval
+        self.wallboxes = {}
+        self.last_tick = None
+
+    def add_wallbox(self, device_no, priority):
+        self.wallboxes[device_no] = WallboxState(device_no, priority)
+
+    def set_enabled(self, device_no, enabled):
+        state = self.wallboxes[device_no]
+        if state.enabled != enabled:
+            # Leave the wallbox as it is, but start over with the hysteresis
+            state.reset()
+        state.enabled = enabled
+
+    def get_state(self):
+        return {device_no: state.get_state() for device_no, state in self.wallboxes.items()}
+
+    def get_checkpoint(self):
+        """
+        Everything needed to continue after a restart: {device_no: {...}}
+        """
+        return {device_no: {**state.get_state(), "last_command": state.last_command} for device_no, state in self.wallboxes.items()}
+
+    def restore(self, checkpoint):
+        """
+        Continue with the state of get_checkpoint(). Keys may be strings, as in JSON.
+        """
+        for device_no, saved in checkpoint.items():
+            state = self.wallboxes.get(int(device_no))
+            if state is None:
+                continue
+            state.enabled = saved["enabled"]
+            state.counter = min(saved["counter"], self.hysteresis)
+            state.charging = saved["charging"]
+            state.ampere = saved["ampere"]
+            state.last_command = saved["last_command"]
+
+    def is_pending(self):
+        """
+        True while a wallbox is on its way to being switched on or off, i.e. fresh data matters most.
+        """
+        return any(state.enabled and 0 < state.counter < self.hysteresis for state in self.wallboxes.values())
+
+    def allocate(self, now, excess_power, wallbox_data):
+        """
+        Run one tick of the allocator.
+
+        now:          Monotonic timestamp (s)
+        excess_power: Power (W) available for all wallboxes together,
+                      i.e. PV production - house consumption + current wallbox power
+        wallbox_data: Dict device_no -> {"phases": ..., "current_power": ...}
+
+        Returns a list of commands (device_no, key, value) to send to the wallboxes.
+        """
+        commands = []
+        remaining = excess_power
+        # No time has passed for the first tick, e.g. after a restart
+        elapsed = 0 if self.last_tick is None else min(max(now - self.last_tick, 0), self.max_tick_interval)
+        self.last_tick = now
+        for state in sorted(self.wallboxes.values(), key=lambda s: s.priority):
+            if not state.enabled or state.device_no not in wallbox_data:
+                continue
+            data = wallbox_data[state.device_no]
+            ampere, power = self.__get_level(remaining, data)
+            commands += self.__step(now, elapsed, state, ampere)
+            if state.charging:
+                # The level actually set, e.g. the lowest one while the counter drains
+                power = self.__get_power(state.ampere, data)
+            remaining -= power
+        return commands
+
+    def __get_level(self, power_available, data):
+        for ampere in reversed(self.amp_levels):
+            power = self.__get_power(ampere, data)
+            if power <= power_available:
+                return ampere, power
+        return None, 0
+
+    def __get_power(self, ampere, data):
+        # If the number of phases is unknown, be conservative and assume three
+        return ampere * self.voltage * (data.get("phases") or 3)
+
+    def __step(self, now, elapsed, state, ampere):
+        if ampere:
+            state.counter = min(state.counter + elapsed, self.hysteresis)
+        else:
+            state.counter = max(state.counter - elapsed, 0)
+
+        if not state.charging:
+            if state.counter == self.hysteresis and self.__may_send(now, state):
+                log.info("Wallbox %s: Enough power to charge for %s seconds. Activating wallbox with %s A!", state.device_no, self.hysteresis, ampere)
+                state.charging = True
+                state.ampere = ampere
+                return self.__sent(now, state, [(state.device_no, "max_ampere", ampere), (state.device_no, "allow_charging", 1)])
+            return []
+
+        if state.counter == 0:
+            log.info("Wallbox %s: Not enough power to charge for %s seconds. Deactivating wallbox!", state.device_no, self.hysteresis)
+            state.charging = False
+            state.ampere = None
+            return self.__sent(now, state, [(state.device_no, "allow_charging", 0)])
+
+        # While the counter drains keep charging with the lowest level
+        target = ampere or self.amp_levels[0]
+        if target != state.ampere and self.__may_send(now, state):
+            log.info("Wallbox %s: Changing charging current from %s A to %s A.", state.device_no, state.ampere, target)
+            state.ampere = target
+            return self.__sent(now, state, [(state.device_no, "max_ampere", target)])
+        return []
+
+    def __may_send(self, now, state):
+        return state.last_command is None or now - state.last_command >= self.min_command_interval
+
+    def __sent(self, now, state, commands):
+        state.last_command = now
+        return commands
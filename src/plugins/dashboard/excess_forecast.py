@@ -0,0 +1,76 @@
+"""
+Short-horizon forecast of PV production, house consumption and the resulting excess power.
+"""
+import logging
+
+log = logging.getLogger("ExcessForecast")
+
+class HoltSmoothing():
+    """
+    Double exponential smoothing (level and trend) for irregularly sampled values.
+    alpha and beta are the smoothing factors for samples one second apart.
+    """
+
+    def __init__(self, alpha, beta, max_gap=60):
+        self.alpha = alpha
+        self.beta = beta
+        self.max_gap = max_gap
+        self.level = None
+        self.trend = 0.0
+        self.last_ts = None
+
+    def update(self, ts, value):
+        if self.level is None:
+            self.level = value
+        else:
+            dt = ts - self.last_ts
+            if 0 < dt <= self.max_gap:
+                alpha = 1 - (1 - self.alpha) ** dt
+                beta = 1 - (1 - self.beta) ** dt
+                last_level = self.level
+                self.level = alpha * value + (1 - alpha) * (self.level + self.trend * dt)
+                self.trend = beta * (self.level - last_level) / dt + (1 - beta) * self.trend
+            elif dt > self.max_gap or dt < 0:
+                # Old values say nothing about the current trend
+                self.level = value
+                self.trend = 0.0
+        self.last_ts = ts
+
+    def predict(self, horizon):
+        if self.level is None:
+            return None
+        return self.level + self.trend * horizon
+
+class ExcessForecast():
+    """
+    Forecast of the excess power available for charging `horizon` seconds ahead:
+    PV production - house consumption (without wallboxes).
+    """
+
+    def __init__(self, horizon=60, alpha=0.02, beta=0.002, max_gap=60):
+        self.horizon = horizon
+        self.pv_production = HoltSmoothing(alpha, beta, max_gap)
+        self.base_load = HoltSmoothing(alpha, beta, max_gap)
+
+    def seed(self, rows):
+        """
+        Warm up with recorded rows of (unix timestamp, pv_production, house_power, ...).
+        """
+        for row in rows:
+            if row[1] is not None and row[2] is not None:
+                self.update(row[0], row[1], row[2])
+        log.debug("Seeded forecast with %s recorded values.", len(rows))
+
+    def update(self, ts, pv_production, house_power, wallbox_power=0):
+        self.pv_production.update(ts, pv_production)
+        self.base_load.update(ts, house_power - wallbox_power)
+
+    def predict(self):
+        """
+        Predicted excess power (W) without wallboxes at the end of the horizon.
+        """
+        pv_production = self.pv_production.predict(self.horizon)
+        base_load = self.base_load.predict(self.horizon)
+        if pv_production is None:
+            return None
+        return max(pv_production, 0.0) - max(base_load, 0.0)
@@ -6,10 +6,20 @@ import time
 import logging
 
 import plugin_collection
+from snapshot import Snapshot, SnapshotPublisher, SnapshotView
+from event_bus import Measurement, Command
+from .excess_allocator import ExcessPowerAllocator
+from .excess_forecast import ExcessForecast
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
 log = logging.getLogger("Dashboard")
 
+# Topics of the measurements used, and their names in the data of the Dashboard
+SOURCES = {
+    "measurement/house": "house",
+    "measurement/wallbox/0": "wallbox1",
+    "measurement/wallbox/1": "wallbox2"
+}
+
 class Dashboard(plugin_collection.Plugin):
     
     def __init__(self):
@@ -19,13 +29,25 @@ class Dashboard(plugin_collection.Plugin):
         self.pluginPackage = type(self).__module__.split('.')[1]
         self.type = "sink"
         self.has_runtime = True
-        self.current_data = {}
-        self.settings = {}
+        self.publisher = SnapshotPublisher("dashboard")
+        self.settings = {
+            "plugin_path": "/dashboard",
+            "amp_levels": [6, 8, 10, 12, 16], # Charging currents (A) the allocator can choose from
+            "voltage": 230, # Voltage per phase (V)
+            "hysteresis_seconds": 30, # Seconds of (not) enough excess power before (de)activating a wallbox
+            "min_command_interval": 30, # Minimum seconds between commands to the same wallbox
+            "wallbox_priorities": [0, 1], # Priority per wallbox (device_no), lower is served first
+            "forecast_enabled": False, # Act on the predicted instead of the current excess power
+            "forecast_horizon_seconds": 60, # How far to look ahead
+            "forecast_history_minutes": 15, # Recorded history used to warm up the forecast
+            "forecast_alpha": 0.02, # Smoothing factor for the level (per second)
+            "forecast_beta": 0.002 # Smoothing factor for the trend (per second)
+        }
         self.sunChargingParking = False
         self.sunChargingGarage = False
         self.forceCharging = False
-        self.enoughPowerCounter = 0
-        self.automaticChargingPowerAvailable = False
+        self.decision_pending = False
+        self.__create_allocator()
 
     def add_webserver(self, webserver):
         self.webserver = webserver
@@ -33,66 +55,136 @@ class Dashboard(plugin_collection.Plugin):
     def apply_settings(self, settings):
         if(type(self).__name__ in settings):
             log.info("Found custom config. Applying...")
-            self.settings = settings[type(self).__name__]
+            self.settings = {**self.settings, **settings[type(self).__name__]}
+            self.__create_allocator()
+
+    def __create_allocator(self):
+        self.allocator = ExcessPowerAllocator(
+            amp_levels=self.settings['amp_levels'],
+            voltage=self.settings['voltage'],
+            hysteresis=self.settings['hysteresis_seconds'],
+            min_command_interval=self.settings['min_command_interval'])
+        for device_no, priority in enumerate(self.settings['wallbox_priorities']):
+            self.allocator.add_wallbox(device_no, priority)
+        self.forecast = ExcessForecast(
+            horizon=self.settings['forecast_horizon_seconds'],
+            alpha=self.settings['forecast_alpha'],
+            beta=self.settings['forecast_beta']) if self.settings['forecast_enabled'] else None
 
     def runtime(self, other_plugins):
-        self.senec = other_plugins.get_plugin("SenecHomeV3Hybrid")
-        self.goe = other_plugins.get_plugin("GoEcharger")
-        # This is run permanently in the background
+        self.events = other_plugins.events
+        measurements = self.events.subscribe(type(self).__name__, list(SOURCES), Measurement, maxlen=50)
+        if self.forecast:
+            senec = other_plugins.get_plugin("SenecHomeV3Hybrid")
+            self.forecast.seed(senec.get_history(self.settings['forecast_history_minutes']))
+        # Start with the restored data (see restore_state()), so sources without news yet are not empty
+        restored = self.publisher.get()
+        latest = {name: Snapshot(0, restored.ts, restored.data.get(name, {})) for name in SOURCES.values()}
+        # This is run permanently in the background, whenever producers or consumers publish new data
         while True:
-            # Get data from (energy) producers and consumers
-
-            self.current_data = {
-                "house": self.senec.get_data(),
-                "wallbox1": self.goe.get_data(0),
-                "wallbox2": self.goe.get_data(1),
+            for event in measurements.get_all():
+                latest[SOURCES[event.topic]] = event.payload
+            # Snapshots do not change, so the whole tick works on one consistent view
+            view = SnapshotView(latest)
+            snapshot = self.publisher.publish({
+                **view.get_data(),
                 "sunChargingParking": self.sunChargingParking,
                 "sunChargingGarage": self.sunChargingGarage,
-                "forceCharging": self.forceCharging
-            }
-
-            # Calculate if charging should be allowed:
-            # If spare energy is > 3500W for 30s then allow charging
-            # Where spare energy is: PV production - house consumption + currently charging
-            if(self.sunChargingParking):
-                self.__automaticChargingExcessPower(self.goe, 0, 3500, 30)
-            if(self.sunChargingGarage):
-                self.__automaticChargingExcessPower(self.goe, 1, 3500, 30)
-            
-            time.sleep(1)
-
-    def __automaticChargingExcessPower(self, goe, device_no, watts, seconds):
-        weHaveExcessPower = self.__weHaveExcessPowerFor(watts)
-        if(weHaveExcessPower and self.enoughPowerCounter < seconds):
-            self.enoughPowerCounter += 1
-            if(self.enoughPowerCounter == seconds):
-                log.info(f"We have enough power to charge for {seconds} seconds. Activating wallbox!")
-                self.automaticChargingPowerAvailable = True
-                goe.set_charging(device_no,on_off=1)
-        elif(not weHaveExcessPower and self.enoughPowerCounter > 0):
-            self.enoughPowerCounter -= 1
-            if(self.enoughPowerCounter == 0):
-                log.info(f"Not enough power to charge for {seconds} seconds. Deactivating wallbox!")
-                self.automaticChargingPowerAvailable = False
-                goe.set_charging(device_no,on_off=0)
-
-    def __weHaveExcessPowerFor(self, watts):
+                "forceCharging": self.forceCharging,
+                "automaticCharging": self.allocator.get_state()
+            })
+
+            for (device_no, key, value) in self.control(snapshot.ts, snapshot.data):
+                self.events.publish(Command(f"command/wallbox/{device_no}", (key, value), source=type(self).__name__))
+            if self.allocator.is_pending() != self.decision_pending:
+                # The SENEC plugin polls faster while the allocator is about to decide
+                self.decision_pending = not self.decision_pending
+                self.events.publish(Command("command/senec/sample_fast", self.decision_pending, source=type(self).__name__))
+
+    @property
+    def current_data(self):
+        return self.publisher.get().data
+
+    def control(self, now, data):
+        """
+        One tick of automatic charging for the data of one point in time.
+        Returns the commands (device_no, key, value) for the wallboxes, but does not send them.
+        """
+        self.allocator.set_enabled(0, self.sunChargingParking)
+        self.allocator.set_enabled(1, self.sunChargingGarage)
+        # Calculate how much charging power the wallboxes may use:
+        # Spare energy is split across wallboxes with sun charging enabled, by priority
+        # Where spare energy is: PV production - house consumption + currently charging
+        excessPower = self.__getExcessPower(now, data)
+        if excessPower is None:
+            return []
+        wallboxes = {
+            0: self.__getWallboxInfo(data["wallbox1"]),
+            1: self.__getWallboxInfo(data["wallbox2"])
+        }
+        return self.allocator.allocate(now, excessPower, wallboxes)
+
+    def __getExcessPower(self, now, data):
         try:
-            excessPower = self.current_data["house"]["live_data"]["pv_production"] \
-                        - self.current_data["house"]["live_data"]["house_power"] \
-                        + self.current_data["wallbox1"]["charging"]["current_power"] \
-                        + self.current_data["wallbox2"]["charging"]["current_power"]
-            log.debug(f"Excess power: {round(excessPower, 2)} W")
-            return excessPower >= watts
+            pvProduction = data["house"]["live_data"]["pv_production"]
+            housePower = data["house"]["live_data"]["house_power"]
+            wallboxPower = data["wallbox1"]["charging"]["current_power"] \
+                         + data["wallbox2"]["charging"]["current_power"]
         except KeyError:
-            return False
+            return None
+        excessPower = pvProduction - housePower + wallboxPower
+        log.debug("Excess power: %.2f W", excessPower)
+        if self.forecast:
+            self.forecast.update(now, pvProduction, housePower, wallboxPower)
+            excessPower = self.forecast.predict()
+            log.debug("Predicted excess power: %.2f W", excessPower)
+        return excessPower
+
+    def __getWallboxInfo(self, wallbox):
+        charging = wallbox["charging"]
+        return {
+            "phases": charging["pha_used"] if charging["current_power"] > 0 else charging["pha_available"],
+            "current_power": charging["current_power"]
+        }
+
+    def get_publishers(self):
+        return {self.settings['plugin_path']: self.publisher}
+
+    def get_state(self):
+        snapshot = self.publisher.get()
+        return {
+            "sunChargingParking": self.sunChargingParking,
+            "sunChargingGarage": self.sunChargingGarage,
+            "forceCharging": self.forceCharging,
+            "allocator": self.allocator.get_checkpoint(),
+            "ts": snapshot.ts,
+            "data": snapshot.data
+        }
+
+    def restore_state(self, state):
+        self.sunChargingParking = state["sunChargingParking"]
+        self.sunChargingGarage = state["sunChargingGarage"]
+        self.forceCharging = state["forceCharging"]
+        self.allocator.restore(state["allocator"])
+        if state["data"]:
+            # Served until the first measurement arrives, with its original timestamp
+            self.publisher.publish({
+                **state["data"],
+                "sunChargingParking": self.sunChargingParking,
+                "sunChargingGarage": self.sunChargingGarage,
+                "forceCharging": self.forceCharging,
+                "automaticCharging": self.allocator.get_state()
+            }, state["ts"])
+        log.info("Restored sun charging Parkplatz %s, Garage %s, force charging %s.",
+                 self.sunChargingParking, self.sunChargingGarage, self.forceCharging)
 
+    def get_sources(self):
+        return {"dashboard": self.publisher}
 
     def endpoint(self, req, resp):
         viewmodel = self.__create_view_model(req)
         if (self.__get_output_format(req) == "json"):
-            res = self.current_data
-            resp.media = res
+            self.publisher.get().serve(req, resp)
             return
         if (self.__process_req_params(req)):
             resp.media = {"message": "Params set successfully."}
@@ -111,19 +203,19 @@ class Dashboard(plugin_collection.Plugin):
         try:
             if('setAutomaticChargingParking' in req.params):
                 self.sunChargingParking = int(req.params['setAutomaticChargingParking']) == 1
-                log.info(f"Sun charging for Parkplatz set to {self.sunChargingParking}")
+                log.info("Sun charging for Parkplatz set to %s", self.sunChargingParking)
                 return True
             if('setAutomaticChargingGarage' in req.params):
                 self.sunChargingGarage = int(req.params['setAutomaticChargingGarage']) == 1
-                log.info(f"Sun charging for Garage set to {self.sunChargingGarage}")
+                log.info("Sun charging for Garage set to %s", self.sunChargingGarage)
                 return True
             if('setForceCharging' in req.params):
                 self.forceCharging = int(req.params['setForceCharging']) == 1
-                log.info(f"Set force charging to {self.forceCharging}")
-                self.senec.api.set_force_charge_battery(self.forceCharging)
+                log.info("Set force charging to %s", self.forceCharging)
+                self.events.publish(Command("command/senec/force_charge", self.forceCharging, source=type(self).__name__))
                 return True
         except KeyError:
-            log.warn(f"Unknown parameter: {req.params}")
+            log.warning("Unknown parameter: %s", req.params)
         return False
 
     def __get_output_format(self, req):
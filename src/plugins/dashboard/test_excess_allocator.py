@@ -0,0 +1,99 @@
+"""
+Tests for dividing excess power across wallboxes
+"""
+import logging
+import unittest
+
+from .excess_allocator import ExcessPowerAllocator
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("ExcessAllocator-Tests")
+
+class TestExcessPowerAllocator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.allocator = ExcessPowerAllocator(amp_levels=[6, 8, 10, 12, 16], voltage=230, hysteresis=3, min_command_interval=10)
+        self.allocator.add_wallbox(0, priority=1)
+        self.allocator.add_wallbox(1, priority=0)
+        self.allocator.set_enabled(0, True)
+        self.allocator.set_enabled(1, True)
+        self.wallboxes = {0: {"phases": 1, "current_power": 0}, 1: {"phases": 1, "current_power": 0}}
+
+    def run_ticks(self, ticks, excess_power, start=0, interval=1):
+        commands = []
+        for tick in range(ticks):
+            commands += self.allocator.allocate(start + tick * interval, excess_power, self.wallboxes)
+        return commands
+
+    def test_excess_is_divided_by_priority(self) -> None:
+        # Act: 3000 W: 12 A (2760 W) for wallbox 1, nothing left for wallbox 0
+        commands = self.run_ticks(4, 3000)
+
+        # Assert
+        self.assertEqual(commands, [(1, "max_ampere", 12), (1, "allow_charging", 1)])
+        self.assertFalse(self.allocator.get_state()[0]["charging"])
+
+    def test_counters_are_kept_per_wallbox(self) -> None:
+        # Act: 5000 W: 16 A (3680 W) for wallbox 1, 1320 W are not enough for wallbox 0
+        commands = self.run_ticks(4, 5000)
+        state = self.allocator.get_state()
+
+        # Assert
+        self.assertEqual(commands, [(1, "max_ampere", 16), (1, "allow_charging", 1)])
+        self.assertEqual(state[1]["counter"], 3)
+        self.assertEqual(state[0]["counter"], 0)
+
+    def test_commands_are_rate_limited_and_hysteresis_drains(self) -> None:
+        # Arrange
+        self.allocator.set_enabled(0, False)
+        self.run_ticks(4, 3000)
+
+        # Act
+        changes = self.run_ticks(10, 1500, start=4)
+        drained = self.run_ticks(3, 0, start=14)
+
+        # Assert: Current is reduced only after min_command_interval, then charging is stopped
+        self.assertEqual(changes, [(1, "max_ampere", 6)])
+        self.assertEqual(drained, [(1, "allow_charging", 0)])
+
+    def test_hysteresis_counts_seconds_not_ticks(self) -> None:
+        # Act: Ticks for every measurement, three per second
+        early = self.run_ticks(7, 3000, interval=1/3)
+        commands = self.run_ticks(3, 3000, start=3, interval=1/3)
+
+        # Assert: Activated after 3 s, not after 3 ticks
+        self.assertEqual(early, [])
+        self.assertEqual(commands, [(1, "max_ampere", 12), (1, "allow_charging", 1)])
+
+    def test_level_kept_while_draining_is_not_divided_again(self) -> None:
+        # Arrange: Wallbox 1 charges with 8 A on three phases (5520 W)
+        self.wallboxes[1]["phases"] = 3
+        self.run_ticks(4, 6000)
+
+        # Act: 3000 W are not enough for wallbox 1, but it keeps charging while the counter drains
+        commands = self.run_ticks(3, 3000, start=4)
+
+        # Assert: Wallbox 0 only counts after wallbox 1 was stopped
+        self.assertEqual(commands, [(1, "allow_charging", 0)])
+        self.assertEqual(self.allocator.get_state()[0]["counter"], 1)
+
+    def test_restored_allocator_continues(self) -> None:
+        # Arrange: Charging at 12 A, saved as JSON would give it back
+        self.run_ticks(4, 3000)
+        checkpoint = {str(device_no): state for device_no, state in self.allocator.get_checkpoint().items()}
+        restarted = ExcessPowerAllocator(amp_levels=[6, 8, 10, 12, 16], voltage=230, hysteresis=3, min_command_interval=10)
+        restarted.add_wallbox(0, priority=1)
+        restarted.add_wallbox(1, priority=0)
+
+        # Act
+        restarted.restore(checkpoint)
+        restarted.set_enabled(1, True)
+        commands = restarted.allocate(5, 3000, self.wallboxes)
+
+        # Assert: No new activation, the rate limit still counts from the last command
+        self.assertEqual(commands, [])
+        self.assertEqual(restarted.get_state(), self.allocator.get_state())
+        self.assertEqual(restarted.allocate(13, 1500, self.wallboxes), [(1, "max_ampere", 6)])
+
+if __name__ == '__main__':
+    unittest.main()
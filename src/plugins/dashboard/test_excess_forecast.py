@@ -0,0 +1,37 @@
+"""
+Tests for the short-horizon excess power forecast
+"""
+import logging
+import unittest
+
+from .excess_forecast import ExcessForecast
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("ExcessForecast-Tests")
+
+class TestExcessForecast(unittest.TestCase):
+
+    def test_rising_production_is_extrapolated(self) -> None:
+        # Arrange
+        forecast = ExcessForecast(horizon=60, alpha=0.2, beta=0.1)
+
+        # Act: PV production rises by 10 W/s, house consumption incl. 1000 W wallbox is flat
+        for second in range(600):
+            forecast.update(second, 2000.0 + 10.0 * second, 1500.0, 1000.0)
+
+        # Assert: 7990 W - 500 W now, plus 600 W within the next minute
+        self.assertAlmostEqual(forecast.predict(), 8090.0, delta=20.0)
+
+    def test_gaps_reset_the_trend(self) -> None:
+        # Arrange
+        forecast = ExcessForecast(horizon=60)
+        forecast.seed([(second, 100.0 * second, 0.0) for second in range(60)])
+
+        # Act
+        forecast.update(10000, 3000.0, 1000.0)
+
+        # Assert
+        self.assertEqual(forecast.predict(), 2000.0)
+
+if __name__ == '__main__':
+    unittest.main()
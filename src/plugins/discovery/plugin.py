@@ -0,0 +1,75 @@
+"""
+Find the devices again when DHCP gave them another IP address.
+
+Scans the configured subnets every scan_interval seconds and whenever a plugin asks for it
+(command/discovery/scan, e.g. when a device is not reachable anymore). The devices found are
+published on discovery/devices, the plugins of the devices remap themselves.
+"""
+import time
+import logging
+
+import plugin_collection
+from metrics import registry
+from snapshot import SnapshotPublisher
+from event_bus import Measurement, Command
+from .scanner import Scanner, get_default_probes
+
+log = logging.getLogger("Discovery")
+
+registry.describe("discovery_scan_seconds", "gauge", "Duration of the last subnet scan")
+registry.describe("discovery_devices_found", "gauge", "Devices found by the last scan per kind")
+
+class DeviceDiscovery(plugin_collection.Plugin):
+
+    def __init__(self):
+        super().__init__()
+        self.title = "Device Discovery"
+        self.description = "Find wallboxes and SENEC appliances in the local network."
+        self.pluginPackage = type(self).__module__.split('.')[1]
+        self.type = "service"
+        self.has_runtime = False # Only if enabled, see apply_settings()
+        self.publisher = SnapshotPublisher("discovery")
+        self.settings = { # Will be read from src/config/settings.json
+            "plugin_path": "/discovery",
+            "enabled": False,
+            "subnets": [], # e.g. ["192.168.178.0/24"]
+            "concurrency": 64, # Hosts probed at the same time
+            "timeout": 0.5, # Seconds per request
+            "scan_interval": 3600, # Seconds between scans if nobody asks
+            "min_scan_interval": 60, # Seconds between scans at most
+            "goe_port": 80,
+            "senec_port": 443
+        }
+
+    def add_webserver(self, webserver):
+        self.webserver = webserver
+
+    def apply_settings(self, settings):
+        if(type(self).__name__ in settings):
+            log.info("Found custom config. Applying...")
+            self.settings = {**self.settings, **settings[type(self).__name__]}
+            self.has_runtime = self.settings['enabled'] and bool(self.settings['subnets'])
+
+    def runtime(self, other_plugins):
+        events = other_plugins.events
+        requests = events.subscribe(type(self).__name__, "command/discovery/scan", Command)
+        scanner = Scanner(get_default_probes(self.settings['goe_port'], self.settings['senec_port']),
+                          concurrency=self.settings['concurrency'], timeout=self.settings['timeout'])
+        last_scan = None
+        while True:
+            wait = 0 if last_scan is None else max(last_scan + self.settings['scan_interval'] - time.monotonic(), 0)
+            for event in requests.get_all(timeout=wait):
+                log.info("Scan requested by %s: %s", event.source, event.payload)
+            if last_scan is not None and time.monotonic() - last_scan < self.settings['min_scan_interval']:
+                # Requests in the meantime are served by the next scan
+                time.sleep(last_scan + self.settings['min_scan_interval'] - time.monotonic())
+            last_scan = time.monotonic()
+            found = scanner.scan(self.settings['subnets'])
+            registry.set("discovery_scan_seconds", round(time.monotonic() - last_scan, 3))
+            for kind in ("goe", "senec"):
+                registry.set("discovery_devices_found", sum(device.kind == kind for device in found), kind=kind)
+            snapshot = self.publisher.publish({"devices": [device._asdict() for device in found]})
+            events.publish(Measurement("discovery/devices", snapshot, source=type(self).__name__, ts=snapshot.ts))
+
+    def endpoint(self, req, resp):
+        self.publisher.get().serve(req, resp)
@@ -0,0 +1,154 @@
+"""
+Find go-eCharger wallboxes and SENEC appliances in local subnets.
+
+All hosts of the subnets are probed concurrently with asyncio, at most `concurrency`
+connections at a time and with a short timeout per host, so a /24 takes a few seconds.
+Devices are identified by what they answer, not by their address:
+    go-eCharger:  serial number (sse) of /api/status (API v2) or /status (API v1)
+    SENEC:        /lala.cgi answers with type-prefixed values ("st_...", "u8_..."), id is FACTORY.DEVICE_ID
+"""
+import ssl
+import json
+import time
+import asyncio
+import logging
+import ipaddress
+from collections import namedtuple
+
+log = logging.getLogger("Scanner")
+
+FoundDevice = namedtuple("FoundDevice", ["kind", "id", "ip"])
+
+def parse_goe(body):
+    status = json.loads(body)
+    serial = status.get("sse") if isinstance(status, dict) else None
+    return str(serial) if serial else None
+
+def parse_senec(body):
+    data = json.loads(body)
+    device_id = data.get("FACTORY", {}).get("DEVICE_ID") if isinstance(data, dict) else None
+    if not isinstance(device_id, str) or device_id[2:3] != "_":
+        # Not the encoding of the SENEC API
+        return None
+    return device_id[3:] if device_id.startswith("st_") else device_id
+
+class Probe():
+    """
+    One HTTP request that identifies a kind of device. parse(body) returns the id of the device or None.
+    Of several probes of one kind, the first that identifies the device wins.
+    """
+
+    def __init__(self, kind, port, path, parse, method="GET", body=None, use_ssl=False):
+        self.kind = kind
+        self.port = port
+        self.path = path
+        self.parse = parse
+        self.method = method
+        self.body = json.dumps(body).encode() if body is not None else b""
+        self.use_ssl = use_ssl
+
+    def get_request(self, host):
+        headers = [f"{self.method} {self.path} HTTP/1.0", f"Host: {host}", "Connection: close"]
+        if self.body:
+            headers += ["Content-Type: application/json", f"Content-Length: {len(self.body)}"]
+        return ("\r\n".join(headers) + "\r\n\r\n").encode() + self.body
+
+def get_default_probes(goe_port=80, senec_port=443):
+    return [
+        Probe("goe", goe_port, "/api/status?filter=sse", parse_goe),
+        Probe("goe", goe_port, "/status", parse_goe),
+        Probe("senec", senec_port, "/lala.cgi", parse_senec, method="POST", body={"FACTORY": {"DEVICE_ID": ""}}, use_ssl=True)
+    ]
+
+class Scanner():
+    """
+    concurrency:  Hosts probed at the same time
+    timeout:      Seconds per request, including connecting
+    max_size:     Larger answers are not read (bytes)
+    """
+
+    def __init__(self, probes=None, concurrency=64, timeout=0.5, max_size=64 * 1024):
+        self.probes = probes if probes is not None else get_default_probes()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_size = max_size
+        # The appliances use self-signed certificates
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    def scan(self, subnets):
+        """
+        Devices found in the subnets (e.g. ["192.168.178.0/24"]), as list of FoundDevice.
+        Single addresses are allowed too.
+        """
+        started = time.perf_counter()
+        hosts = get_hosts(subnets)
+        found = asyncio.run(self.scan_hosts(hosts))
+        log.info("Scanned %s hosts in %.1f s, found %s devices.", len(hosts), time.perf_counter() - started, len(found))
+        return found
+
+    async def scan_hosts(self, hosts):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self.__scan_host(semaphore, host) for host in hosts))
+        return [device for devices in results for device in devices]
+
+    async def __scan_host(self, semaphore, host):
+        found = []
+        async with semaphore:
+            for kind in dict.fromkeys(probe.kind for probe in self.probes):
+                for probe in (probe for probe in self.probes if probe.kind == kind):
+                    (reachable, device_id) = await self.__probe(host, probe)
+                    if device_id:
+                        log.debug("Found %s %s at %s.", kind, device_id, host)
+                        found.append(FoundDevice(kind, device_id, host))
+                        break
+                    if not reachable:
+                        # Nothing listens on this port, the other probes of this kind would fail too
+                        break
+        return found
+
+    async def __probe(self, host, probe):
+        """
+        (port reachable, device id or None)
+        """
+        try:
+            (reader, writer) = await asyncio.wait_for(
+                asyncio.open_connection(host, probe.port, ssl=self.ssl_context if probe.use_ssl else None), self.timeout)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            return False, None
+        try:
+            writer.write(probe.get_request(host))
+            response = await asyncio.wait_for(self.__read(reader), self.timeout)
+            return True, self.__parse(response, probe)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            return True, None
+        finally:
+            writer.close()
+
+    async def __read(self, reader):
+        # HTTP/1.0: the answer ends when the device closes the connection
+        response = b""
+        while len(response) < self.max_size:
+            chunk = await reader.read(self.max_size - len(response))
+            if not chunk:
+                break
+            response += chunk
+        return response
+
+    def __parse(self, response, probe):
+        (head, _, body) = response.partition(b"\r\n\r\n")
+        status_line = head.split(b"\r\n", 1)[0].split()
+        if len(status_line) < 2 or status_line[1] != b"200":
+            return None
+        try:
+            return probe.parse(body)
+        except (ValueError, AttributeError):
+            return None
+
+def get_hosts(subnets):
+    hosts = []
+    for subnet in subnets:
+        network = ipaddress.ip_network(subnet, strict=False)
+        hosts += [str(host) for host in network.hosts()] if network.num_addresses > 1 else [str(network.network_address)]
+    return list(dict.fromkeys(hosts))
@@ -0,0 +1,107 @@
+"""
+Tests for finding wallboxes and SENEC appliances in a subnet, with stand-ins on loopback addresses
+"""
+import json
+import time
+import socket
+import logging
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .scanner import Scanner, Probe, FoundDevice, parse_goe, parse_senec
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("Scanner-Tests")
+
+class StandInDevice(BaseHTTPRequestHandler):
+    """
+    Answers with the JSON of answers[path] of the server, 404 for other paths.
+    """
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.answer()
+
+    def answer(self):
+        if self.path not in self.server.answers:
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.answers[self.path]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class TestScanner(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.servers = []
+
+    def tearDown(self) -> None:
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start(self, ip, port, answers):
+        server = ThreadingHTTPServer((ip, port), StandInDevice)
+        server.answers = answers
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+
+    def test_devices_are_identified_by_their_answers(self) -> None:
+        # Arrange: Wallboxes with API v2 and v1, a SENEC appliance and a web server that is none of them
+        (goe_port, senec_port) = (get_free_port(), get_free_port())
+        self.start("127.0.0.5", goe_port, {"/api/status?filter=sse": {"sse": "222222"}})
+        self.start("127.0.0.9", goe_port, {"/status": {"sse": "111111", "car": "1"}})
+        self.start("127.0.0.7", senec_port, {"/lala.cgi": {"FACTORY": {"DEVICE_ID": "st_SENEC42"}}})
+        self.start("127.0.0.11", goe_port, {"/status": {"hello": "world"}})
+        probes = [
+            Probe("goe", goe_port, "/api/status?filter=sse", parse_goe),
+            Probe("goe", goe_port, "/status", parse_goe),
+            # Plain HTTP for the stand-in, the appliance uses HTTPS
+            Probe("senec", senec_port, "/lala.cgi", parse_senec, method="POST", body={"FACTORY": {"DEVICE_ID": ""}})
+        ]
+
+        # Act
+        found = Scanner(probes, concurrency=8, timeout=1.0).scan(["127.0.0.0/28"])
+
+        # Assert
+        self.assertEqual(sorted(found), [
+            FoundDevice("goe", "111111", "127.0.0.9"),
+            FoundDevice("goe", "222222", "127.0.0.5"),
+            FoundDevice("senec", "SENEC42", "127.0.0.7")
+        ])
+
+    def test_silent_hosts_are_probed_concurrently(self) -> None:
+        # Arrange: Every loopback address accepts connections, but nobody answers
+        silent = socket.socket()
+        silent.bind(("0.0.0.0", 0))
+        silent.listen(256)
+        probes = [Probe("goe", silent.getsockname()[1], "/status", parse_goe)]
+
+        # Act
+        started = time.perf_counter()
+        try:
+            found = Scanner(probes, concurrency=64, timeout=0.2).scan(["127.0.1.0/24"])
+        finally:
+            silent.close()
+        duration = time.perf_counter() - started
+
+        # Assert: 254 hosts, 64 at a time, 0.2 s each
+        self.assertEqual(found, [])
+        self.assertLess(duration, 3.0)
+
+if __name__ == '__main__':
+    unittest.main()
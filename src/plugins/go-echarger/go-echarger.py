@@ -2,14 +2,28 @@
 Read and write data of go-eCharger wallbox.
 """
 import os
+import time
 import logging
+import threading
 import requests
+from datetime import datetime
 
 import plugin_collection
+import capture_log
+from circuit_breaker import CircuitBreaker
+from metrics import registry
+from snapshot import SnapshotPublisher
+from event_bus import Measurement, Command
+from .goe_commands import CommandQueue
+from .goe_status import GoeStatus
+from .goe_sessions import SessionDetector
+from .goe_session_db import SessionDB
+from .goe_api import SCOPES, get_api
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
 log = logging.getLogger("GoEcharger")
 
+registry.describe("wallbox_limit_latency_seconds", "gauge", "Seconds from an ampere limit command to the write to the wallbox")
+
 class GoEcharger(plugin_collection.Plugin):
     
     def __init__(self):
@@ -18,9 +32,16 @@ class GoEcharger(plugin_collection.Plugin):
         self.description = "Read and write data of go-eCharger wallbox."
         self.pluginPackage = type(self).__module__.split('.')[1]
         self.type = "consumer"
-        self.has_runtime = False
+        self.has_runtime = True
         self.devices = [] # Will be read from src/config/settings.json
-        self.settings = {} # Will be read from src/config/settings.json
+        self.settings = { # Will be read from src/config/settings.json
+            "plugin_path": "/go-echarger",
+            "devices": [],
+            "min_command_interval": 1.0, # Minimum seconds between writes to the same wallbox
+            "poll_interval": 1.0, # Seconds between status reads of each wallbox
+            "record_sessions": True, # Store charging sessions with energy, user and PV share
+            "db_file": "sessions.sqlite"
+        }
 
     def add_webserver(self, webserver):
         self.webserver = webserver
@@ -28,18 +49,124 @@ class GoEcharger(plugin_collection.Plugin):
     def apply_settings(self, settings):
         if(type(self).__name__ in settings):
             log.info("Found custom config. Applying...")
-            self.settings = settings[type(self).__name__]
-            log.debug(f"Settings: {self.settings}")
-            self.devices = [goeDevice(device['name'], device['ip']) for device in self.settings['devices']]
+            self.settings = {**self.settings, **settings[type(self).__name__]}
+            self.settings['db_path'] = f"{settings['common']['db_base_path']}{self.settings['plugin_path']}"
+            log.debug("Settings: %s", self.settings)
+            capture = capture_log.get_writer(settings)
+            self.devices = [goeDevice(device['name'], device['ip'], self.settings['min_command_interval'], capture, device.get('api_version', "auto"), device.get('serial'))
+                            for device in self.settings['devices']]
 
     def has_runtime(self):
         return self.has_runtime
 
+    def runtime(self, other_plugins):
+        events = other_plugins.events
+        commands = events.subscribe("GoEcharger commands", "command/wallbox/*", Command)
+        # Limits must not wait for polls or the rate limit, they get their own thread
+        limits = events.subscribe("GoEcharger limits", "command/wallbox/*/limit", Command)
+        threading.Thread(target=self.__apply_limits, args=(limits,), name="GoEcharger limits", daemon=True).start()
+        # SENEC data of the same time gives the PV share of the charging sessions
+        house_events = events.subscribe("GoEcharger house", "measurement/house", Measurement, maxlen=5)
+        house = None
+        # Wallboxes found at other addresses, see the DeviceDiscovery plugin
+        discovery = events.subscribe("GoEcharger discovery", "discovery/devices", Measurement, maxlen=2)
+        # The DB connection must be created in the thread using it
+        db = SessionDB(self.__get_db_file()) if self.settings['record_sessions'] and self.devices else None
+        load_manager = other_plugins.get_plugin("LoadManager")
+        if load_manager is None or not load_manager.has_runtime:
+            # Restored limits of a load management that is switched off now, nobody would lift them
+            for device in self.devices:
+                if device.ampere_limit is not None:
+                    log.info("%s (%s): Lifting limit of %s A.", device.name, device.ip, device.ampere_limit)
+                    device.set_ampere_limit(None)
+        last_poll = None
+        while True:
+            for event in commands.get_all(timeout=0.2):
+                self.__process_command(event)
+            # Send writes that were queued because of the rate limit or need to be retried
+            now = time.monotonic()
+            for device in self.devices:
+                if device.commands.has_pending():
+                    device.commands.flush(now)
+            if last_poll is None or now - last_poll >= self.settings['poll_interval']:
+                last_poll = now
+                for event in house_events.get_all(timeout=0):
+                    # Failed polls republish the old values
+                    if event.payload.get_dict().get("connection", {}).get("failures", 0) == 0:
+                        house = event.payload
+                for event in discovery.get_all(timeout=0):
+                    self.__remap(event.payload.data["devices"])
+                for device_no, device in enumerate(self.devices):
+                    # Only the values needed to control charging, the web UI asks for everything itself
+                    device.get_status("control")
+                    snapshot = device.publisher.get()
+                    events.publish(Measurement(f"measurement/wallbox/{device_no}", snapshot, source=type(self).__name__, ts=snapshot.ts))
+                    if device.reachable and not device.breaker.is_closed():
+                        # Maybe it got another IP address
+                        events.publish(Command("command/discovery/scan", f"{device.name} ({device.ip}) not reachable", source=type(self).__name__))
+                    device.reachable = device.breaker.is_closed()
+                    self.__detect_sessions(db, device, snapshot, house)
+
+    def __remap(self, found):
+        for device in self.devices:
+            serial = device.get_serial()
+            for (kind, device_id, ip) in ((d["kind"], d["id"], d["ip"]) for d in found):
+                if kind == "goe" and serial is not None and device_id == serial and ip != device.ip:
+                    device.set_ip(ip)
+
+    def __detect_sessions(self, db, device, snapshot, house):
+        live_data = house.get_dict().get("live_data") if house else None
+        for session in device.sessions.update(snapshot.ts, snapshot.data, live_data, house.ts if house else None):
+            if db:
+                db.insert_session(session)
+
+    def __get_db_file(self):
+        return f"{self.settings['db_path']}/{self.settings['db_file']}"
+
+    def __apply_limits(self, limits):
+        """
+        Topic command/wallbox/<device_no>/limit, payload maximum ampere, 0 (pause) or None (no limit)
+        """
+        while True:
+            event = limits.get()
+            try:
+                device_no = int(event.topic.split("/")[2])
+                self.devices[device_no].set_ampere_limit(event.payload)
+                registry.set("wallbox_limit_latency_seconds", round(time.time() - event.ts, 3), device=str(device_no))
+            except (ValueError, IndexError) as e:
+                log.warning("Invalid limit %s %s: %s", event.topic, event.payload, e)
+            except Exception:
+                # This thread protects the main fuse, it must keep taking limits
+                log.exception("Applying limit %s %s failed.", event.topic, event.payload)
+
+    def __process_command(self, event):
+        """
+        Topic command/wallbox/<device_no>, payload (key, value) with key allow_charging or max_ampere
+        """
+        if event.topic.endswith("/limit"):
+            # See __apply_limits()
+            return
+        try:
+            device_no = int(event.topic.rsplit("/", 1)[1])
+            (key, value) = event.payload
+            self.devices[device_no].change_value(f"{key}={value}")
+        except (ValueError, IndexError) as e:
+            log.warning("Invalid command %s %s: %s", event.topic, event.payload, e)
+
     def endpoint(self, req, resp):
         viewmodel = self.__create_view_model(req)
 
+        if (self.__get_output_format(req) == "sessions"):
+            try:
+                resp.media = self.get_sessions(req.params.get('month'), req.params.get('user'))
+            except ValueError as e:
+                resp.status_code = 400
+                resp.media = {"error": str(e)}
+            return
         if (self.__get_output_format(req) == "json"):
-            resp.media = self.devices[viewmodel['selected_device']].get_status()
+            device = self.devices[viewmodel['selected_device']]
+            device.get_status()
+            device.publisher.get().serve(req, resp)
             return
         change_value = self.__get_change_value(req)
         if (change_value):
@@ -48,15 +175,64 @@ class GoEcharger(plugin_collection.Plugin):
             return
         resp.html = self.webserver.render_template("go-echarger/index.html", viewmodel)
 
-    def get_data(self, device_no):
+    def get_publishers(self):
+        path = self.settings['plugin_path']
+        publishers = {f"{path}?device={n}": device.publisher for n, device in enumerate(self.devices)}
+        if self.devices:
+            publishers[path] = self.devices[0].publisher
+        return publishers
+
+    def get_state(self):
+        return {"devices": [device.get_state() for device in self.devices]}
+
+    def restore_state(self, state):
+        for device, device_state in zip(self.devices, state["devices"]):
+            # Only if the wallbox at this position is still the same
+            if device_state.get("configured_ip", device_state["ip"]) == device.configured_ip:
+                device.restore_state(device_state)
+
+    def get_sources(self):
+        # Named like in the data of the Dashboard
+        return {f"wallbox{n + 1}": device.publisher for n, device in enumerate(self.devices)}
+
+    def get_data(self, device_no, scope="full"):
         """
         get_data can be used by other plugins.
+        scope "control" only refreshes the values needed to control charging (if the wallbox supports API v2).
+        """
+        return self.devices[device_no].get_status(scope).as_dict()
+
+    def get_sessions(self, month=None, user=None):
+        """
+        Charging sessions and totals per user and wallbox of a month ("YYYY-MM", default: this month),
+        plus the sessions still running. Can be used by other plugins.
+        """
+        db = SessionDB(self.__get_db_file())
+        try:
+            month = month or datetime.now(tz=db.timezone).strftime("%Y-%m")
+            (first, last) = db.get_month_range(month)
+            return {
+                "month": month,
+                "totals": db.get_monthly_totals(month),
+                "sessions": db.get_sessions(first, last, user),
+                "running": [device.sessions.session.as_dict() for device in self.devices if device.sessions.session]
+            }
+        finally:
+            db.close()
+
+    def get_charging_power(self):
+        """
+        Sum of the current charging power (W) of all wallboxes, taken from the last known status.
+        Does not query the wallboxes.
         """
-        return self.devices[device_no].get_status()
+        return sum(device.status.current_power for device in self.devices)
 
     def set_charging(self, device_no, on_off):
         self.devices[device_no].change_value(f"allow_charging={on_off}")
 
+    def set_max_ampere(self, device_no, ampere):
+        self.devices[device_no].change_value(f"max_ampere={ampere}")
+
     def __create_view_model(self, req):
         # Path: plugin_path + /
         return {
@@ -232,12 +408,22 @@ class GoEcharger(plugin_collection.Plugin):
 
 class goeDevice():
 
-    def __init__(self, name, ip):
+    def __init__(self, name, ip, min_command_interval=1.0, capture=None, api_version="auto", serial=None):
         self.name = name
         self.ip = ip
-        self.read_api  = f"http://{self.ip}/status"
-        self.write_api = f"http://{self.ip}/mqtt?payload="
-        self.data = {}
+        self.configured_ip = ip
+        self.serial = serial # Serial number (sse) to find the wallbox at another IP address, learned from the status if not set
+        self.reachable = True
+        self.capture = capture # Optional capture_log.CaptureWriter for raw responses
+        self.breaker = CircuitBreaker(f"goe:{self.ip}")
+        self.api_version = api_version # "auto", 1 or 2
+        self.api = None # Created on first access, see __get_api()
+        self.publisher = SnapshotPublisher(f"wallbox:{self.ip}", GoeStatus(self.ip))
+        self.commands = CommandQueue(self.__send_change, min_interval=min_command_interval)
+        self.ampere_limit = None        # Cap for max_ampere set by the load management, 0 pauses charging
+        self.requested_ampere = None    # Last max_ampere requested by others, restored when the cap is lifted
+        self.requested_allow = None     # Last allow_charging requested by others while paused
+        self.sessions = SessionDetector(name)
         self.value_map = {
             "allow_charging": "alw",
             "max_ampere"    : "amp",
@@ -260,146 +446,188 @@ class goeDevice():
         }
 
     def __send_change(self, key, val):
+        if not self.breaker.allow_request():
+            return f"{self.name} ({self.ip}): Wallbox not reachable."
         try:
-            res = requests.get(f"{self.write_api}{key}={val}", timeout=1.5).json()
+            api = self.__get_api()
+            res = api.write(key, val)
+        except KeyError:
+            # Not sent, so it tells nothing about the connection
+            self.breaker.record_skipped()
+            return f"{self.name} ({self.ip}): {key} can not be changed with API v{self.api.version}."
+        except requests.JSONDecodeError:
+            self.breaker.record_failure()
+            return f"{self.name} ({self.ip}): Invalid answer from wallbox."
+        except ValueError as e:
+            # Rejected by the wallbox, which answered
+            self.breaker.record_success()
+            return f"{self.name} ({self.ip}): {e}"
         except requests.Timeout:
-            return {"error": f"{self.name} ({self.ip}): Timeout while accessing wallbox."}
+            self.breaker.record_failure()
+            return f"{self.name} ({self.ip}): Timeout while accessing wallbox."
         except requests.ConnectionError:
-            return {"error": f"{self.name} ({self.ip}): Connection error while accessing wallbox."}
-        self.updateData(res)
-        return {
-            "msg": "success!",
-            key  : val
-            }
+            self.breaker.record_failure()
+            return f"{self.name} ({self.ip}): Connection error while accessing wallbox."
+        self.breaker.record_success()
+        if res:
+            # The wallbox answers with its status, which confirms the write
+            self.updateData(res)
 
     def change_value(self, param):
         key, val = param.split('=')
         try:
             key_name = self.value_map[key]
         except KeyError:
-            log.warning(f"Key {key} not yet supported. Not changing anything!")
+            log.warning("Key %s not yet supported. Not changing anything!", key)
             return
-        return self.__send_change(key_name, val)
+        if key_name == "amp":
+            self.requested_ampere = int(val)
+            if self.ampere_limit:
+                val = str(min(int(val), self.ampere_limit))
+        elif key_name == "alw" and self.ampere_limit == 0:
+            # Paused by the load management, applied when the cap is lifted
+            self.requested_allow = val
+            return {"msg": "success!", "state": "limited", key_name: val}
+        state = self.commands.submit(key_name, val)
+        if state != "unchanged":
+            sent = self.commands.flush(time.monotonic())
+            if sent and sent[0] == key_name:
+                if sent[2]:
+                    return {"error": sent[2]}
+                state = "sent"
+        return {
+            "msg"  : "success!",
+            "state": state,
+            key_name: val
+            }
+
+    def set_ampere_limit(self, limit):
+        """
+        Cap max_ampere, e.g. to protect the main fuse. 0 pauses charging, None lifts the cap.
+        Changes are sent at once, regardless of the rate limit.
+        """
+        previous = self.ampere_limit
+        self.ampere_limit = limit
+        if self.requested_ampere is None and self.status.device_serial is not None:
+            self.requested_ampere = self.status.max_ampere
+        now = time.monotonic()
+        if limit == 0:
+            if previous != 0:
+                self.requested_allow = str(self.status.allow_charging) if self.status.device_serial is not None else "1"
+            self.commands.submit("alw", 0)
+            return [self.commands.flush(now, urgent_key="alw")]
+        sent = []
+        if self.requested_ampere is not None:
+            self.commands.submit("amp", min(self.requested_ampere, limit) if limit else self.requested_ampere)
+            sent.append(self.commands.flush(now, urgent_key="amp"))
+        if previous == 0:
+            self.commands.submit("alw", self.requested_allow or "1")
+            sent.append(self.commands.flush(now, urgent_key="alw"))
+        return sent
+
+    def get_state(self):
+        snapshot = self.publisher.get()
+        return {
+            "configured_ip": self.configured_ip,
+            "ip": self.ip,
+            "serial": self.get_serial(),
+            "ts": snapshot.ts,
+            "status": snapshot.data.get_state(),
+            "session": self.sessions.get_state(),
+            "ampere_limit": self.ampere_limit,
+            "requested_ampere": self.requested_ampere,
+            "requested_allow": self.requested_allow
+        }
+
+    def restore_state(self, state):
+        if state["ip"] != self.ip:
+            self.set_ip(state["ip"])
+        self.serial = self.serial or state.get("serial")
+        self.ampere_limit = state["ampere_limit"]
+        self.requested_ampere = state["requested_ampere"]
+        self.requested_allow = state["requested_allow"]
+        self.sessions.restore_state(state.get("session"))
+        if state["status"]:
+            # Served until the first poll, with its original timestamp
+            self.publisher.publish(GoeStatus.from_state(state["status"], self.ip), state["ts"])
+
+    def get_serial(self):
+        return self.status.device_serial or self.serial
+
+    def set_ip(self, ip):
+        """
+        The wallbox was found at another IP address.
+        """
+        log.warning("%s: Moved from %s to %s.", self.name, self.ip, ip)
+        self.ip = ip
+        # The API is detected again at the new address
+        self.api = None
+        self.breaker.record_success()
+        self.reachable = True
 
-    def get_status(self):
+    def get_status(self, scope="full"):
+        """
+        Poll the wallbox. Returns the published GoeStatus record, as_dict() gives the nested dict.
+        """
+        if not self.breaker.allow_request():
+            # Known to be unreachable, answer from cache
+            return self.__publish_connection()
+        record = None
         try:
-            res = requests.get(self.read_api, timeout=1.5).json()
-            self.updateData(res)
+            api = self.__get_api()
+            (content, status) = api.read(SCOPES[scope])
+            if self.capture:
+                self.capture.append(f"goe:{self.ip}" if api.version == 1 else f"goe-v{api.version}:{self.ip}", content)
+            record = self.__parse(status)
+            self.breaker.record_success()
+            record = self.__publish_status(record)
+        except requests.HTTPError as e:
+            log.warning("%s (%s): %s", self.name, self.ip, e)
+            self.breaker.record_failure()
         except requests.Timeout:
-            log.warning(f"{self.name} ({self.ip}): Timeout while accessing wallbox.")
+            log.warning("%s (%s): Timeout while accessing wallbox.", self.name, self.ip)
+            self.breaker.record_failure()
         except requests.ConnectionError:
-            log.warning(f"{self.name} ({self.ip}): Connection error while accessing wallbox.")
-        finally:
-            return self.data
+            log.warning("%s (%s): Connection error while accessing wallbox.", self.name, self.ip)
+            self.breaker.record_failure()
+        except (ValueError, KeyError) as e:
+            # Not JSON or an incomplete status
+            log.warning("%s (%s): Invalid status: %s", self.name, self.ip, e)
+            self.breaker.record_failure()
+        # One snapshot per poll: the new status, or the last one with the connection state
+        return record if record is not None else self.__publish_connection()
+
+    def __get_api(self):
+        if self.api is None:
+            self.api = get_api(self.ip, self.api_version)
+            log.info("%s (%s): Using API v%s.", self.name, self.ip, self.api.version)
+        return self.api
+
+    def __publish_connection(self):
+        return self.publisher.publish(self.status.with_connection(self.breaker.get_state())).data
+
+    @property
+    def status(self):
+        """
+        Last known status as GoeStatus record.
+        """
+        return self.publisher.get().data
+
+    @property
+    def data(self):
+        return self.status.as_dict()
     
     def updateData(self, status):
-        # This is not the full set of available data available from the wallbox
-        # For a complete documentation see https://github.com/goecharger/go-eCharger-API-v1
-        charging_status_cases = {
-            "1": "Wallbox ready, no car connected",
-            "2": "Car is charging",
-            "3": "Waiting for car",
-            "4": "Charge finished"
-        }
-        error_states = {
-            "0": "No error",
-            "1": "Residual Current Device",
-            "3": "Phase disturbance",
-            "8": "Earthing detection",
-            "10": "Other"
-        }
-        self.data = {
-            "device_serial" : status['sse'],
-            "fw_version"    : status['fwv'],
-            "device_ip"     : self.ip,
-            "access_control": {
-                "access_method"  : int(status['ast']),
-                "allow_charging" : int(status['alw']), # 0/1
-                "unlocked_by"    : int(status['uby']),
-                "rfid_cards"     : {
-                    1 : {
-                        "id"     : status['rca'],
-                        "name"   : status['rna'],
-                        "energy" : int(status['eca']) # in 0.1 kWh
-                    },
-                    2 : {
-                        "id"     : status['rcr'],
-                        "name"   : status['rnm'],
-                        "energy" : int(status['ecr']) # in 0.1 kWh
-                    }
-                }
-            },
-            "charging"      : {
-                "status"        : charging_status_cases.get(status['car'], "Invalid charge status"),
-                "max_ampere"    : int(status['amp']), # 6-32
-                "current_power" : int(status['nrg'][11]) * 10,
-                "pha_available" : self.__get_number_of_available_phases(int(status['pha'])),
-                "pha_used"      : self.__get_number_of_used_phases(status['nrg']),
-                "energy"        : self.__dws_to_kWh(int(status['dws']))
-            },
-            "energy_total"   : int(status['eto']), # in 0.1 kWh
-            "button_levels"  : {
-                    "level1": int(status['al1']),
-                    "level2": int(status['al2']),
-                    "level3": int(status['al3']),
-                    "level4": int(status['al4']),
-                    "level5": int(status['al5'])
-            },
-            "energy_values"  : {
-                "L1_voltage": status['nrg'][0], # in Volts
-                "L2_voltage": status['nrg'][1],
-                "L3_voltage": status['nrg'][2],
-                "N_voltage" : status['nrg'][3],
-                "L1_ampere" : status['nrg'][4], # in 0.1 A
-                "L2_ampere" : status['nrg'][5],
-                "L3_ampere" : status['nrg'][6],
-                "L1_power"  : status['nrg'][7], # in 0.1 kW
-                "L2_power"  : status['nrg'][8],
-                "L3_power"  : status['nrg'][9],
-                "N_power"   : status['nrg'][10],
-                "sum_power" : status['nrg'][11],
-                "L1_powfac" : status['nrg'][12], # in %
-                "L2_powfac" : status['nrg'][13],
-                "L3_powfac" : status['nrg'][14],
-                "N_powfac"  : status['nrg'][15]
-            },
-            "error_state"   : error_states.get(status['err'], "Invalid error state")
-        }
+        return self.__publish_status(self.__parse(status))
 
-    ''' Phases
-        0b00ABCDEF
-        A ... phase 3, in front of the contactor
-        B ... phase 2 in front of the contactor
-        C ... phase 1 in front of the contactor
-        D ... phase 3 after the contactor
-        E ... phase 2 after the contactor
-        F ... phase 1 after the contactor
-        
-        pha | 0b00001000: Phase 1 is available
-        pha | 0b00111000: Phase1-3 is available
-        '''
-    def __get_number_of_available_phases(self, pha):
-        res = 0
-        if pha & 0b00001000:
-            res += 1
-        if pha & 0b00010000:
-            res += 1
-        if pha & 0b00100000:
-            res += 1
-        return res
-    
-    def __get_number_of_used_phases(self, nrg):
-        res = 0
-        if nrg[7] > 5: # If power (in 0.1 kW) on L1 > 5
-            res += 1
-        if nrg[8] > 5: # If power (in 0.1 kW) on L2 > 5
-            res += 1
-        if nrg[9] > 5: # If power (in 0.1 kW) on L3 > 5
-            res += 1
-        return res
-
-    def __dws_to_kWh(self, dws):
-        return round((dws * 10.0 / 60.0 / 60.0 / 1000.0), 3)
+    def __parse(self, status):
+        record = GoeStatus.parse(status, self.ip)
+        self.commands.confirm(status)
+        return record
+
+    def __publish_status(self, record):
+        record.connection = self.breaker.get_state()
+        return self.publisher.publish(record).data
 
 
 '''
@@ -0,0 +1,141 @@
+"""
+HTTP APIs of go-eCharger wallboxes.
+
+Both API versions are mapped to the keys, value types and units of API v1
+(https://github.com/goecharger/go-eCharger-API-v1), so the plugin works the same for both.
+API v2 (https://github.com/goecharger/go-eCharger-API-v2) is asked for the needed keys only.
+"""
+import requests
+
+# v2 keys needed by the automatic charging (and the session detection: trx, wh) and by the web UI
+CONTROL_KEYS = ("car", "alw", "amp", "nrg", "pha", "trx", "wh")
+FULL_KEYS = CONTROL_KEYS + ("sse", "fwv", "acs", "cards", "eto", "err")
+SCOPES = {"control": CONTROL_KEYS, "full": FULL_KEYS}
+
+class GoeApiV1():
+    """
+    /status returns all keys, /mqtt?payload= writes one key and answers with the full status.
+    """
+    version = 1
+
+    def __init__(self, ip, timeout=1.5):
+        self.ip = ip
+        self.timeout = timeout
+        self.read_api  = f"http://{ip}/status"
+        self.write_api = f"http://{ip}/mqtt?payload="
+
+    def read(self, keys=FULL_KEYS):
+        """
+        Returns (raw response, status).
+        """
+        response = requests.get(self.read_api, timeout=self.timeout)
+        return response.content, response.json()
+
+    def write(self, key, val):
+        """
+        Returns the status after the write.
+        """
+        return requests.get(f"{self.write_api}{key}={val}", timeout=self.timeout).json()
+
+class GoeApiV2():
+    """
+    /api/status?filter= returns the given keys, /api/set writes keys and answers with the result per key.
+    Partial answers are merged into the last known status.
+    """
+    version = 2
+
+    def __init__(self, ip, timeout=1.5):
+        self.ip = ip
+        self.timeout = timeout
+        self.read_api  = f"http://{ip}/api/status"
+        self.write_api = f"http://{ip}/api/set"
+        # Not available in v2
+        self.status = {"al1": "0", "al2": "0", "al3": "0", "al4": "0", "al5": "0"}
+        self.complete = False
+
+    def read(self, keys=FULL_KEYS):
+        """
+        Returns (raw response, status). Until the wallbox returned all keys once, all keys are requested.
+        """
+        keys = keys if self.complete else FULL_KEYS
+        response = requests.get(self.read_api, params={"filter": ",".join(keys)}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content, self.merge(response.json())
+
+    def merge(self, status):
+        """
+        Merge a (partial) v2 status into the last known status, returns it in v1 format.
+        """
+        converted = {}
+        for key, value in status.items():
+            if key in V2_TO_V1:
+                converted.update(V2_TO_V1[key](value))
+        self.status = {**self.status, **converted}
+        self.complete = self.complete or all(key in status for key in FULL_KEYS)
+        return self.status
+
+    def write(self, key, val):
+        """
+        Write a v1 key. Raises KeyError for keys that can not be written with v2.
+        Returns None: the new value shows in the next status.
+        """
+        (v2_key, v2_val) = V1_TO_V2_WRITE[key](str(val))
+        result = requests.get(self.write_api, params={v2_key: v2_val}, timeout=self.timeout).json()
+        if result.get(v2_key) is not True:
+            raise ValueError(f"Wallbox rejected {v2_key}={v2_val}: {result.get(v2_key)}")
+
+def detect_api(ip, timeout=1.5):
+    """
+    API of the wallbox: v2 if it answers on /api/status, otherwise v1.
+    """
+    try:
+        response = requests.get(f"http://{ip}/api/status", params={"filter": "sse"}, timeout=timeout)
+        if response.status_code == 200 and "sse" in response.json():
+            return GoeApiV2(ip, timeout)
+    except ValueError:
+        pass
+    return GoeApiV1(ip, timeout)
+
+def get_api(ip, version="auto", timeout=1.5):
+    if version == "auto":
+        return detect_api(ip, timeout)
+    return GoeApiV2(ip, timeout) if int(version) == 2 else GoeApiV1(ip, timeout)
+
+def nrg_to_v1(nrg):
+    """
+    v2: volts, amperes, watts, percent. v1: volts, 0.1 A, 0.1 kW (total: 0.01 kW), percent.
+    """
+    nrg = [value or 0 for value in nrg]
+    return [round(value) for value in nrg[0:4]] \
+         + [round(value * 10) for value in nrg[4:7]] \
+         + [round(value / 100) for value in nrg[7:11]] \
+         + [round(nrg[11] / 10)] \
+         + [round(value) for value in nrg[12:16]]
+
+def cards_to_v1(cards):
+    cards = list(cards) + [{}, {}]
+    return {
+        "rca": "1" if cards[0].get("cardId") else "", "rna": cards[0].get("name", ""), "eca": str(round((cards[0].get("energy") or 0) / 100)),
+        "rcr": "1" if cards[1].get("cardId") else "", "rnm": cards[1].get("name", ""), "ecr": str(round((cards[1].get("energy") or 0) / 100))
+    }
+
+V2_TO_V1 = {
+    "car"  : lambda value: {"car": str(value)},
+    "alw"  : lambda value: {"alw": str(int(bool(value)))},
+    "amp"  : lambda value: {"amp": str(value)},
+    "nrg"  : lambda value: {"nrg": nrg_to_v1(value)},
+    "pha"  : lambda value: {"pha": str(sum(1 << i for i, available in enumerate(value) if available))}, # L1-L3 after, L1-L3 before contactor
+    "sse"  : lambda value: {"sse": str(value)},
+    "fwv"  : lambda value: {"fwv": str(value)},
+    "acs"  : lambda value: {"ast": str(value)},
+    "trx"  : lambda value: {"uby": str(value or 0)},
+    "cards": cards_to_v1,
+    "wh"   : lambda value: {"dws": str(round((value or 0) * 360))}, # Wh to deca-watt-seconds
+    "eto"  : lambda value: {"eto": str(round((value or 0) / 100))}, # Wh to 0.1 kWh
+    "err"  : lambda value: {"err": str(value or 0)}
+}
+# alw can not be written with v2, it is the result of the force state frc (0 neutral, 1 off, 2 on)
+V1_TO_V2_WRITE = {
+    "alw": lambda val: ("frc", "0" if val == "1" else "1"),
+    "amp": lambda val: ("amp", val)
+}
@@ -0,0 +1,99 @@
+"""
+Coalesce, deduplicate and rate limit writes to a go-eCharger wallbox.
+"""
+import logging
+import threading
+
+log = logging.getLogger("GoEcharger")
+
+class CommandQueue():
+    """
+    Pending writes of one wallbox.
+
+    - Writes to the same key that have not been sent yet are coalesced, only the latest value is sent.
+    - Writes of the value the wallbox already confirmed are skipped.
+    - At most one write is sent every `min_interval` seconds, except for urgent ones (see flush()).
+    - A sent write is only considered done once a status read shows the new value.
+      Otherwise it is sent again, at most `max_retries` times.
+    """
+
+    def __init__(self, send, min_interval=1.0, max_retries=3):
+        self.send = send                # Callable(key, val), returns None on success or an error message
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.pending = {}               # key -> value, not yet sent
+        self.unconfirmed = {}           # key -> (value, tries), sent but not yet seen in a status
+        self.confirmed = {}             # key -> value, as reported by the last status
+        self.last_sent = None
+
+    def submit(self, key, val):
+        """
+        Queue a write. Returns "unchanged", "coalesced" or "queued".
+        """
+        val = str(val)
+        with self.lock:
+            if self.__current_value(key) == val:
+                # Cancels a pending write that would undo the current state
+                self.pending.pop(key, None)
+                return "unchanged"
+            state = "coalesced" if key in self.pending else "queued"
+            self.pending[key] = val
+            return state
+
+    def flush(self, now, urgent_key=None):
+        """
+        Send the oldest pending write, if the rate limit allows.
+        A pending write of urgent_key is sent first and regardless of the rate limit.
+        Returns (key, val, error) of the write that was sent or None.
+        """
+        with self.lock:
+            if urgent_key in self.pending:
+                key = urgent_key
+            elif not self.pending or (self.last_sent is not None and now - self.last_sent < self.min_interval):
+                return None
+            else:
+                key = next(iter(self.pending))
+            val = self.pending.pop(key)
+            tries = self.unconfirmed[key][1] + 1 if key in self.unconfirmed and self.unconfirmed[key][0] == val else 1
+            self.unconfirmed[key] = (val, tries)
+            self.last_sent = now
+        error = self.send(key, val)
+        if error:
+            log.warning("Sending %s=%s failed (try %s/%s): %s", key, val, tries, self.max_retries, error)
+            with self.lock:
+                self.__retry(key, val, tries)
+        return key, val, error
+
+    def confirm(self, status):
+        """
+        Update the confirmed state from a status read of the wallbox and
+        requeue writes that did not take effect.
+        """
+        with self.lock:
+            self.confirmed = {key: str(status[key]) for key in status if not isinstance(status[key], (list, dict))}
+            for key, (val, tries) in list(self.unconfirmed.items()):
+                if key not in self.confirmed:
+                    continue
+                if self.confirmed[key] == val:
+                    del self.unconfirmed[key]
+                else:
+                    self.__retry(key, val, tries)
+
+    def has_pending(self):
+        return bool(self.pending)
+
+    def __current_value(self, key):
+        if key in self.unconfirmed:
+            return self.unconfirmed[key][0]
+        return self.confirmed.get(key)
+
+    def __retry(self, key, val, tries):
+        # Newer writes of the same key win over retries
+        if key in self.pending:
+            return
+        if tries < self.max_retries:
+            self.pending[key] = val
+        else:
+            log.warning("Giving up on %s=%s after %s tries.", key, val, tries)
+            self.unconfirmed.pop(key, None)
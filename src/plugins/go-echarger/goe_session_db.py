@@ -0,0 +1,124 @@
+"""
+Persistency layer for charging sessions from goe_sessions.py
+
+Besides the sessions, monthly totals per user and per wallbox are kept up to date with every
+session stored, so billing reads a few rows instead of summing up all sessions.
+"""
+import os
+import sqlite3
+import logging
+from datetime import datetime, timedelta, timezone
+import pytz
+
+log = logging.getLogger("SessionDB")
+
+class SessionDB():
+
+    def __init__(self, db_file, tz="Europe/Berlin"):
+        self.db_path = os.path.dirname(db_file)
+        self.db_full_path = db_file
+        self.db_version = "0.0.1"
+        self.timezone = pytz.timezone(tz)
+
+        # Ensure directories exist
+        if self.db_path:
+            os.makedirs(self.db_path, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.db_full_path)
+        self.cursor = self.connection.cursor()
+        try:
+            version = self.cursor.execute("SELECT version FROM db_info").fetchone()[0]
+            if version != self.db_version:
+                log.error("Session DB has version %s, expected %s.", version, self.db_version)
+        except sqlite3.OperationalError:
+            log.debug("No session DB found. Creating...")
+            self.__init_tables_v0_0_1()
+
+    def __init_tables_v0_0_1(self):
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS db_info (version TEXT)")
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                                    id INTEGER PRIMARY KEY,
+                                                    wallbox TEXT,
+                                                    user TEXT,
+                                                    start TIMESTAMP,
+                                                    end TIMESTAMP,
+                                                    energy FLOAT,
+                                                    pv_energy FLOAT)""")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS sessions_start ON sessions (start)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS sessions_user_start ON sessions (user, start)")
+        # kind is "user" or "wallbox", month is local time of the session start
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS monthly_totals (
+                                                    month TEXT,
+                                                    kind TEXT,
+                                                    name TEXT,
+                                                    sessions INTEGER,
+                                                    energy FLOAT,
+                                                    pv_energy FLOAT,
+                                                    PRIMARY KEY (month, kind, name))""")
+        self.cursor.execute("INSERT INTO db_info VALUES ('0.0.1')")
+        self.connection.commit()
+
+    def close(self):
+        self.cursor.close()
+        self.connection.close()
+
+    def insert_session(self, session):
+        """
+        Store a finished ChargingSession and add it to the monthly totals, in one transaction.
+        """
+        month = datetime.fromtimestamp(session.start, tz=self.timezone).strftime("%Y-%m")
+        pv_energy = session.pv_energy
+        with self.connection:
+            self.cursor.execute("INSERT INTO sessions (wallbox, user, start, end, energy, pv_energy) VALUES (?, ?, ?, ?, ?, ?)",
+                                (session.wallbox, session.user, to_db_ts(session.start), to_db_ts(session.end), session.energy, pv_energy))
+            self.cursor.executemany("""INSERT INTO monthly_totals VALUES (?, ?, ?, 1, ?, ?)
+                                       ON CONFLICT (month, kind, name) DO UPDATE SET
+                                           sessions = sessions + 1,
+                                           energy = energy + excluded.energy,
+                                           pv_energy = pv_energy + excluded.pv_energy""",
+                                    [(month, "user", session.user, session.energy, pv_energy or 0.0),
+                                     (month, "wallbox", session.wallbox, session.energy, pv_energy or 0.0)])
+
+    def get_sessions(self, ts1, ts2, user=None):
+        """
+        Sessions started between the datetimes ts1 and ts2 (UTC), of one user if given, ordered by start.
+        """
+        query = "SELECT wallbox, user, start, end, energy, pv_energy FROM sessions WHERE start BETWEEN ? AND ?"
+        params = [ts1.isoformat(sep=' '), ts2.isoformat(sep=' ')]
+        if user is not None:
+            query += " AND user = ?"
+            params.append(user)
+        rows = self.cursor.execute(query + " ORDER BY start ASC", params).fetchall()
+        return [{
+            "wallbox": wallbox,
+            "user": user,
+            "start": start,
+            "end": end,
+            "energy": round(energy, 3),
+            "pv_energy": round(pv_energy, 3) if pv_energy is not None else None
+        } for (wallbox, user, start, end, energy, pv_energy) in rows]
+
+    def get_month_range(self, month):
+        """
+        (first, last) datetime (UTC) of the local month "YYYY-MM", for get_sessions().
+        """
+        first = datetime.strptime(month, "%Y-%m")
+        following = first.replace(year=first.year + 1, month=1) if first.month == 12 else first.replace(month=first.month + 1)
+        (start, end) = (self.timezone.localize(day).astimezone(timezone.utc).replace(tzinfo=None) for day in (first, following))
+        return start, end - timedelta(seconds=1)
+
+    def get_monthly_totals(self, month):
+        """
+        Totals of the month ("YYYY-MM") as {"user": {name: {...}}, "wallbox": {name: {...}}}.
+        """
+        totals = {"user": {}, "wallbox": {}}
+        for (kind, name, sessions, energy, pv_energy) in self.cursor.execute(
+                "SELECT kind, name, sessions, energy, pv_energy FROM monthly_totals WHERE month = ?", (month,)):
+            totals[kind][name] = {"sessions": sessions, "energy": round(energy, 3), "pv_energy": round(pv_energy, 3)}
+        return totals
+
+def to_db_ts(ts):
+    """
+    Unix timestamp to the UTC format of CURRENT_TIMESTAMP, like the SENEC DB.
+    """
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,155 @@
+"""
+Detect charging sessions in the status stream of a go-eCharger wallbox.
+
+A session lasts from plugging in a car (car leaves "1") until it is unplugged (car "1" again).
+Its energy is the last dws of the session (energy since the car was connected), the user is
+the RFID card it was unlocked with (uby). The share of PV is integrated from the charging power
+and the SENEC data of the same time: energy not drawn from the grid (directly from PV or from the
+battery) counts as PV.
+"""
+import logging
+
+log = logging.getLogger("GoeSessions")
+
+CAR_IDLE = "1"
+# dws is in deca-watt-seconds
+DWS_PER_KWH = 360000.0
+# dws lower than the session energy by more than this (kWh) starts a new session
+DWS_RESET = 0.1
+
+class ChargingSession():
+    """
+    One charging session. end is None while the car is still connected.
+    """
+
+    def __init__(self, wallbox, start):
+        self.wallbox = wallbox
+        self.start = start          # Unix timestamp the car was connected
+        self.end = None             # Unix timestamp the car was disconnected
+        self.last_seen = start      # Unix timestamp of the last status with the car connected
+        self.user_id = None         # Card that unlocked the wallbox (uby), None if unlocked without a card
+        self.user_name = None
+        self.energy = 0.0           # Charged energy (kWh), from dws
+        self.metered = 0.0          # Integrated charging energy with known grid power (kWh)
+        self.metered_pv = 0.0       # Of which not drawn from the grid (kWh)
+
+    @property
+    def user(self):
+        return self.user_name or self.user_id or ""
+
+    @property
+    def pv_share(self):
+        """
+        Share of PV in the charged energy (0..1), None if unknown.
+        """
+        return self.metered_pv / self.metered if self.metered > 0 else None
+
+    @property
+    def pv_energy(self):
+        share = self.pv_share
+        return self.energy * share if share is not None else None
+
+    def get_state(self):
+        return {name: getattr(self, name) for name in ("start", "end", "last_seen", "user_id", "user_name", "energy", "metered", "metered_pv")}
+
+    @classmethod
+    def from_state(cls, wallbox, state):
+        session = cls(wallbox, state["start"])
+        for name, value in state.items():
+            setattr(session, name, value)
+        return session
+
+    def as_dict(self):
+        return {
+            "wallbox": self.wallbox,
+            "start": self.start,
+            "end": self.end,
+            "user": self.user,
+            "energy": round(self.energy, 3),
+            "pv_energy": round(self.pv_energy, 3) if self.pv_energy is not None else None,
+            "pv_share": round(self.pv_share, 3) if self.pv_share is not None else None
+        }
+
+class SessionDetector():
+    """
+    Feed every polled status with update(), finished sessions are returned once.
+
+    max_gap:        Intervals between two polls longer than this (s) are not integrated for the PV share
+    max_house_age:  SENEC data older than this (s) is not used
+    """
+
+    def __init__(self, wallbox, max_gap=60, max_house_age=30):
+        self.wallbox = wallbox
+        self.max_gap = max_gap
+        self.max_house_age = max_house_age
+        self.session = None
+        self.last_ts = None
+        self.last_power = None
+        self.last_fraction = None
+
+    def update(self, ts, status, house=None, house_ts=None):
+        """
+        status:   GoeStatus of unix timestamp ts
+        house:    live_data of the SENEC plugin measured at house_ts, optional
+        Returns the sessions finished with this status.
+        """
+        if status.device_serial is None:
+            # No data, the session goes on
+            return []
+        finished = []
+        connected = status.car != CAR_IDLE
+        session = self.session
+        if session is not None and (not connected or session.energy - status.dws / DWS_PER_KWH > DWS_RESET):
+            # Unplugged, or dws started over, i.e. another car was connected while we did not look
+            finished.append(self.__finish(session))
+            session = None
+        if not connected:
+            return finished
+        if session is None:
+            session = self.session = ChargingSession(self.wallbox, ts)
+            self.last_ts = None
+            log.info("%s: Car connected.", self.wallbox)
+        self.__integrate(ts, status.current_power, self.__get_fraction(ts, house, house_ts))
+        session.last_seen = ts
+        session.energy = max(session.energy, status.dws / DWS_PER_KWH)
+        if status.unlocked_by > 0:
+            session.user_id = str(status.unlocked_by)
+            if status.unlocked_by <= len(status.rfid_cards):
+                session.user_name = status.rfid_cards[status.unlocked_by - 1][1] or None
+        return finished
+
+    def __get_fraction(self, ts, house, house_ts):
+        """
+        Share of the consumption that is not drawn from the grid, None if unknown.
+        """
+        if house is None or house_ts is None or abs(ts - house_ts) > self.max_house_age:
+            return None
+        consumption = house["house_power"]
+        if consumption <= 0:
+            return None
+        return min(max(1.0 - max(house["grid_power"], 0.0) / consumption, 0.0), 1.0)
+
+    def __integrate(self, ts, power, fraction):
+        if self.last_ts is not None and 0 < ts - self.last_ts <= self.max_gap \
+           and fraction is not None and self.last_fraction is not None:
+            # Trapezoidal rule, like the energy counters of the SENEC plugin
+            hours = (ts - self.last_ts) / 3600.0
+            self.session.metered += (self.last_power + power) / 2.0 * hours / 1000.0
+            self.session.metered_pv += (self.last_power * self.last_fraction + power * fraction) / 2.0 * hours / 1000.0
+        self.last_ts = ts
+        self.last_power = power
+        self.last_fraction = fraction
+
+    def __finish(self, session):
+        session.end = session.last_seen
+        self.session = None
+        log.info("%s: Session of %s finished: %.3f kWh, PV share %s.", self.wallbox, session.user or "unknown user",
+                 session.energy, f"{session.pv_share:.0%}" if session.pv_share is not None else "unknown")
+        return session
+
+    def get_state(self):
+        return self.session.get_state() if self.session else None
+
+    def restore_state(self, state):
+        if state:
+            self.session = ChargingSession.from_state(self.wallbox, state)
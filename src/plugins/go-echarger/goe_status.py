@@ -0,0 +1,198 @@
+"""
+Compact status record of a go-eCharger wallbox.
+
+The status is parsed once per poll into a record with __slots__ and a fixed array
+for the energy values. The nested dict used for the JSON output and by other plugins
+is only created when it is asked for, and then kept with the record.
+"""
+from array import array
+
+# This is not the full set of available data available from the wallbox
+# For a complete documentation see https://github.com/goecharger/go-eCharger-API-v1
+CHARGING_STATUS = {
+    "1": "Wallbox ready, no car connected",
+    "2": "Car is charging",
+    "3": "Waiting for car",
+    "4": "Charge finished"
+}
+ERROR_STATES = {
+    "0": "No error",
+    "1": "Residual Current Device",
+    "3": "Phase disturbance",
+    "8": "Earthing detection",
+    "10": "Other"
+}
+# Names of the 16 values of 'nrg'
+NRG_KEYS = (
+    "L1_voltage", "L2_voltage", "L3_voltage", "N_voltage", # in Volts
+    "L1_ampere", "L2_ampere", "L3_ampere",                 # in 0.1 A
+    "L1_power", "L2_power", "L3_power", "N_power",         # in 0.1 kW
+    "sum_power",                                           # in 0.01 kW
+    "L1_powfac", "L2_powfac", "L3_powfac", "N_powfac"      # in %
+)
+BUTTON_LEVEL_KEYS = ("al1", "al2", "al3", "al4", "al5")
+
+''' Phases
+    0b00ABCDEF
+    A ... phase 3, in front of the contactor
+    B ... phase 2 in front of the contactor
+    C ... phase 1 in front of the contactor
+    D ... phase 3 after the contactor
+    E ... phase 2 after the contactor
+    F ... phase 1 after the contactor
+
+    pha | 0b00001000: Phase 1 is available
+    pha | 0b00111000: Phase1-3 is available
+    '''
+PHASES_AVAILABLE = tuple(bin(pha & 0b00111000).count("1") for pha in range(64))
+
+class GoeStatus():
+    """
+    Status of one wallbox. An instance without serial (e.g. before the first successful poll)
+    stands for "no data yet". Published records must not be changed, see with_connection().
+    """
+    __slots__ = ("device_ip", "device_serial", "fw_version", "access_method", "allow_charging", "unlocked_by",
+                 "rfid_cards", "car", "max_ampere", "pha", "nrg", "dws", "energy_total", "button_levels", "err",
+                 "connection", "_dict")
+
+    def __init__(self, device_ip):
+        self.device_ip = device_ip
+        self.device_serial = None
+        self.connection = None
+        self._dict = None
+
+    @classmethod
+    def parse(cls, status, device_ip):
+        """
+        Parse the JSON status of the v1 API. Raises KeyError or ValueError for incomplete data.
+        """
+        record = cls(device_ip)
+        record.device_serial = status['sse']
+        record.fw_version = status['fwv']
+        record.access_method = int(status['ast'])
+        record.allow_charging = int(status['alw']) # 0/1
+        record.unlocked_by = int(status['uby'])
+        record.rfid_cards = (
+            (status['rca'], status['rna'], int(status['eca'])), # energy in 0.1 kWh
+            (status['rcr'], status['rnm'], int(status['ecr']))
+        )
+        record.car = status['car']
+        record.max_ampere = int(status['amp']) # 6-32
+        record.pha = int(status['pha'])
+        record.nrg = array('i', status['nrg'])
+        record.dws = int(status['dws'])
+        record.energy_total = int(status['eto']) # in 0.1 kWh
+        record.button_levels = tuple(int(status[key]) for key in BUTTON_LEVEL_KEYS)
+        record.err = status['err']
+        return record
+
+    def get_state(self):
+        """
+        The parsed values as JSON serializable dict, see from_state(). None if there is no data.
+        """
+        if self.device_serial is None:
+            return None
+        state = {name: getattr(self, name) for name in STATE_SLOTS}
+        state["nrg"] = list(self.nrg)
+        return state
+
+    @classmethod
+    def from_state(cls, state, device_ip):
+        """
+        Record from the dict of get_state(), e.g. after a restart.
+        """
+        record = cls(device_ip)
+        for name in STATE_SLOTS:
+            setattr(record, name, state[name])
+        record.rfid_cards = tuple(tuple(card) for card in record.rfid_cards)
+        record.nrg = array('i', record.nrg)
+        record.button_levels = tuple(record.button_levels)
+        return record
+
+    def with_connection(self, connection):
+        """
+        Copy of this record with another connection state.
+        """
+        record = GoeStatus.__new__(GoeStatus)
+        for name in GoeStatus.__slots__:
+            if hasattr(self, name):
+                setattr(record, name, getattr(self, name))
+        record.connection = connection
+        record._dict = None
+        return record
+
+    @property
+    def current_power(self):
+        """
+        Current charging power (W).
+        """
+        return self.nrg[11] * 10 if self.device_serial is not None else 0
+
+    @property
+    def pha_available(self):
+        return PHASES_AVAILABLE[self.pha & 0b00111111]
+
+    @property
+    def pha_used(self):
+        # Phases with power (in 0.1 kW) > 5
+        nrg = self.nrg
+        return (nrg[7] > 5) + (nrg[8] > 5) + (nrg[9] > 5)
+
+    @property
+    def charged_energy(self):
+        """
+        Energy (kWh) charged since the car was connected.
+        """
+        return round((self.dws * 10.0 / 60.0 / 60.0 / 1000.0), 3)
+
+    def as_dict(self):
+        """
+        The status as nested dict, created on first use.
+        """
+        if self._dict is None:
+            self._dict = self.__create_dict()
+        return self._dict
+
+    def __create_dict(self):
+        data = {}
+        if self.device_serial is not None:
+            (rfid_1, rfid_2) = self.rfid_cards
+            levels = self.button_levels
+            data = {
+                "device_serial" : self.device_serial,
+                "fw_version"    : self.fw_version,
+                "device_ip"     : self.device_ip,
+                "access_control": {
+                    "access_method"  : self.access_method,
+                    "allow_charging" : self.allow_charging,
+                    "unlocked_by"    : self.unlocked_by,
+                    "rfid_cards"     : {
+                        1 : {"id": rfid_1[0], "name": rfid_1[1], "energy": rfid_1[2]},
+                        2 : {"id": rfid_2[0], "name": rfid_2[1], "energy": rfid_2[2]}
+                    }
+                },
+                "charging"      : {
+                    "status"        : CHARGING_STATUS.get(self.car, "Invalid charge status"),
+                    "max_ampere"    : self.max_ampere,
+                    "current_power" : self.current_power,
+                    "pha_available" : self.pha_available,
+                    "pha_used"      : self.pha_used,
+                    "energy"        : self.charged_energy
+                },
+                "energy_total"   : self.energy_total,
+                "button_levels"  : {
+                    "level1": levels[0],
+                    "level2": levels[1],
+                    "level3": levels[2],
+                    "level4": levels[3],
+                    "level5": levels[4]
+                },
+                "energy_values"  : dict(zip(NRG_KEYS, self.nrg)),
+                "error_state"    : ERROR_STATES.get(self.err, "Invalid error state")
+            }
+        if self.connection is not None:
+            data["connection"] = self.connection
+        return data
+
+# Values kept by get_state(), the rest is given or derived
+STATE_SLOTS = tuple(name for name in GoeStatus.__slots__ if name not in ("device_ip", "connection", "_dict"))
@@ -0,0 +1,125 @@
+"""
+Tests for the mapping of go-eCharger API v2 to API v1
+"""
+import json
+import logging
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .goe_api import GoeApiV1, GoeApiV2, CONTROL_KEYS, detect_api
+from .goe_status import GoeStatus
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("GoEcharger-Tests")
+
+STATUS_V2 = {
+    "car": 2, "alw": True, "amp": 16, "pha": [True, True, True, True, True, True],
+    "nrg": [230, 231, 229, 0, 16.0, 16.1, 15.9, 3680, 3700, 3650, 0, 11030, 99, 99, 99, 0],
+    "sse": "012345", "fwv": "055.5", "acs": 0, "trx": None, "err": 0, "wh": 1000, "eto": 123400,
+    "cards": [{"name": "Alice", "energy": 1000, "cardId": True}, {"name": "Bob", "energy": 0, "cardId": False}]
+}
+
+class StandInWallbox(BaseHTTPRequestHandler):
+    """
+    Answers like a wallbox with API v2 and records the requested filters.
+    """
+    filters = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/api/status":
+            self.send_error(404)
+            return
+        keys = parse_qs(url.query)["filter"][0].split(",")
+        StandInWallbox.filters.append(keys)
+        body = json.dumps({key: STATUS_V2[key] for key in keys if key in STATUS_V2}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInWallboxV1(BaseHTTPRequestHandler):
+    """
+    Knows /status only.
+    """
+
+    def do_GET(self):
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestGoeApi(unittest.TestCase):
+
+    def test_v2_status_maps_to_v1(self) -> None:
+        # Act
+        status = GoeStatus.parse(GoeApiV2("10.0.0.5").merge(STATUS_V2), "10.0.0.5").as_dict()
+
+        # Assert
+        self.assertEqual(status["charging"], {"status": "Car is charging", "max_ampere": 16, "current_power": 11030,
+                                              "pha_available": 3, "pha_used": 3, "energy": 1.0})
+        self.assertEqual(status["access_control"]["allow_charging"], 1)
+        self.assertEqual(status["access_control"]["rfid_cards"][1], {"id": "1", "name": "Alice", "energy": 10})
+        self.assertEqual(status["energy_total"], 1234)
+        self.assertEqual(status["energy_values"]["L2_ampere"], 161)
+
+    def test_partial_status_keeps_other_values(self) -> None:
+        # Arrange
+        api = GoeApiV2("10.0.0.5")
+        api.merge(STATUS_V2)
+
+        # Act
+        status = api.merge({"car": 4, "alw": False, "amp": 6, "nrg": [0] * 16, "pha": [False] * 3 + [True] * 3})
+
+        # Assert
+        self.assertEqual(status["car"], "4")
+        self.assertEqual(status["alw"], "0")
+        self.assertEqual(status["pha"], "56")
+        self.assertEqual(status["sse"], "012345")
+        self.assertTrue(api.complete)
+
+    def test_detects_v2_and_filters(self) -> None:
+        # Arrange
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInWallbox)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ip = f"127.0.0.1:{server.server_address[1]}"
+        StandInWallbox.filters = []
+
+        try:
+            # Act
+            api = detect_api(ip)
+            api.read(CONTROL_KEYS)
+            api.read(CONTROL_KEYS)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Assert
+        self.assertIsInstance(api, GoeApiV2)
+        self.assertEqual(StandInWallbox.filters[0], ["sse"])
+        # The first read gets all keys, afterwards only the requested ones
+        self.assertIn("cards", StandInWallbox.filters[1])
+        self.assertEqual(StandInWallbox.filters[2], list(CONTROL_KEYS))
+
+    def test_v1_has_no_v2_endpoint(self) -> None:
+        # Arrange
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInWallboxV1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            # Act
+            api = detect_api(f"127.0.0.1:{server.server_address[1]}")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Assert
+        self.assertIsInstance(api, GoeApiV1)
+
+if __name__ == '__main__':
+    unittest.main()
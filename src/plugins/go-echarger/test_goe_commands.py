@@ -0,0 +1,75 @@
+"""
+Tests for coalescing and deduplicating writes to go-eCharger wallboxes
+"""
+import logging
+import unittest
+
+from .goe_commands import CommandQueue
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("GoEcharger-Tests")
+
+class TestCommandQueue(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.sent = []
+        self.queue = CommandQueue(self.send, min_interval=1.0, max_retries=2)
+        self.queue.confirm({"alw": "0", "amp": "16", "nrg": [0] * 16})
+
+    def send(self, key, val):
+        self.sent.append((key, val))
+
+    def test_writes_matching_confirmed_state_are_skipped(self) -> None:
+        # Act
+        state = self.queue.submit("amp", 16)
+        self.queue.flush(0.0)
+
+        # Assert
+        self.assertEqual(state, "unchanged")
+        self.assertEqual(self.sent, [])
+
+    def test_pending_writes_are_coalesced_and_rate_limited(self) -> None:
+        # Act
+        self.queue.submit("amp", 6)
+        self.queue.flush(0.0)
+        self.queue.submit("alw", 1)
+        self.queue.submit("alw", 0)    # Undoes the pending write
+        self.queue.submit("amp", 10)
+        self.queue.submit("amp", 12)
+        self.queue.flush(0.5)
+        self.queue.flush(1.0)
+        self.queue.flush(2.0)
+
+        # Assert
+        self.assertEqual(self.sent, [("amp", "6"), ("amp", "12")])
+
+    def test_urgent_write_skips_rate_limit(self) -> None:
+        # Act
+        self.queue.submit("alw", 1)
+        self.queue.flush(0.0)
+        self.queue.submit("al1", 10)
+        self.queue.submit("amp", 6)
+        self.queue.flush(0.1, urgent_key="amp")
+        self.queue.flush(0.2)
+
+        # Assert
+        self.assertEqual(self.sent, [("alw", "1"), ("amp", "6")])
+        self.assertTrue(self.queue.has_pending())
+
+    def test_writes_are_retried_until_confirmed(self) -> None:
+        # Arrange
+        self.queue.submit("alw", 1)
+        self.queue.flush(0.0)
+
+        # Act: Wallbox did not apply the write, then it did
+        self.queue.confirm({"alw": "0"})
+        self.queue.flush(1.0)
+        self.queue.confirm({"alw": "1"})
+        self.queue.flush(2.0)
+
+        # Assert
+        self.assertEqual(self.sent, [("alw", "1"), ("alw", "1")])
+        self.assertFalse(self.queue.has_pending())
+
+if __name__ == '__main__':
+    unittest.main()
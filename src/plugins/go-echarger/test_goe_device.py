@@ -0,0 +1,87 @@
+"""
+Tests for polling and writing go-eCharger wallboxes through the circuit breaker
+"""
+import time
+import logging
+import unittest
+import importlib
+
+from circuit_breaker import CircuitBreaker
+from .test_goe_status import get_status_v1
+
+goe = importlib.import_module(".go-echarger", __package__)
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("GoEcharger-Tests")
+
+class FakeApi():
+    """
+    Answers reads with the given status or raises it, writes raise write_error.
+    """
+    version = 1
+
+    def __init__(self, status, write_error=None):
+        self.status = status
+        self.write_error = write_error
+
+    def read(self, keys):
+        if isinstance(self.status, Exception):
+            raise self.status
+        return b"", self.status
+
+    def write(self, key, val):
+        raise self.write_error
+
+class TestGoeDevice(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.device = goe.goeDevice("Garage", "10.0.0.5", min_command_interval=0.0)
+        self.device.breaker = CircuitBreaker("goe:test", failure_threshold=1, base_backoff=0.01, max_backoff=0.02, jitter=0.0)
+        # Open, the next request is a probe
+        self.device.breaker.record_failure()
+        time.sleep(0.02)
+
+    def test_invalid_status_fails_the_probe(self) -> None:
+        # Arrange
+        self.device.api = FakeApi({"sse": "012345"})
+
+        # Act
+        status = self.device.get_status()
+        time.sleep(0.03)
+
+        # Assert: Open again, with another probe after the backoff
+        self.assertEqual(status.connection["state"], "open")
+        self.assertTrue(self.device.breaker.allow_request())
+
+    def test_valid_status_closes_the_circuit(self) -> None:
+        # Arrange
+        self.device.api = FakeApi(get_status_v1())
+
+        # Act
+        status = self.device.get_status()
+
+        # Assert
+        self.assertEqual(status.connection["state"], "closed")
+        self.assertEqual(self.device.publisher.get().data.current_power, 11040)
+
+    def test_programming_errors_are_not_swallowed(self) -> None:
+        # Arrange
+        self.device.api = FakeApi(TypeError("bug"))
+
+        # Act & Assert
+        with self.assertRaises(TypeError):
+            self.device.get_status()
+
+    def test_write_that_is_not_sent_releases_the_probe(self) -> None:
+        # Arrange
+        self.device.api = FakeApi(get_status_v1(), write_error=KeyError("alw"))
+
+        # Act
+        self.device.change_value("allow_charging=1")
+
+        # Assert
+        self.assertEqual(self.device.breaker.get_state()["state"], "open")
+        self.assertTrue(self.device.breaker.allow_request())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Tests for detecting and storing charging sessions of go-eCharger wallboxes
+"""
+import os
+import logging
+import tempfile
+import unittest
+from datetime import datetime
+
+from .goe_status import GoeStatus
+from .goe_sessions import SessionDetector
+from .goe_session_db import SessionDB
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("GoeSessions-Tests")
+
+def get_status(car, dws, uby="0", power_kw10=0):
+    """
+    Status v1 with power_kw10 (0.1 kW) on each of three phases.
+    """
+    nrg = [230, 230, 230, 0, 0, 0, 0, power_kw10, power_kw10, power_kw10, 0, 3 * power_kw10 * 10, 0, 0, 0, 0]
+    return GoeStatus.parse({
+        "sse": "012345", "fwv": "040.0", "ast": "1", "alw": "1", "uby": uby, "car": car, "amp": "16", "pha": "63",
+        "nrg": nrg, "dws": str(dws), "eto": "1234", "err": "0", "rca": "card1", "rna": "Alice", "eca": "10",
+        "rcr": "card2", "rnm": "Bob", "ecr": "20", "al1": "6", "al2": "10", "al3": "16", "al4": "20", "al5": "32"
+    }, "10.0.0.5")
+
+# 2 kW PV for 4 kW house consumption (incl. wallbox): half of it from the grid
+HALF_PV = {"house_power": 4000.0, "grid_power": 2000.0}
+ALL_PV = {"house_power": 4000.0, "grid_power": -500.0}
+
+class TestSessionDetector(unittest.TestCase):
+
+    def test_session_from_plug_in_to_unplug(self) -> None:
+        # Arrange
+        detector = SessionDetector("Garage")
+        statuses = [(0, get_status("1", 0), ALL_PV), (10, get_status("3", 0), ALL_PV)] \
+                 + [(10 + 60 * n, get_status("2", 60 * n * 1100, uby="2", power_kw10=37), ALL_PV if n <= 30 else HALF_PV) for n in range(1, 61)] \
+                 + [(3700, get_status("4", 3600 * 1100, uby="2"), HALF_PV), (3800, get_status("1", 0), HALF_PV)]
+
+        # Act
+        finished = []
+        for (ts, status, house) in statuses:
+            finished += detector.update(ts, status, house, ts)
+
+        # Assert: 11 kWh, about the first half of it from PV
+        self.assertEqual(len(finished), 1)
+        session = finished[0]
+        self.assertEqual((session.start, session.end, session.user), (10, 3700, "Bob"))
+        self.assertAlmostEqual(session.energy, 11.0)
+        self.assertAlmostEqual(session.pv_share, 0.75, delta=0.02)
+        self.assertIsNone(detector.session)
+
+    def test_dws_reset_starts_new_session(self) -> None:
+        # Arrange
+        detector = SessionDetector("Garage")
+        detector.update(0, get_status("2", 360000), ALL_PV, 0)
+        detector.update(5, GoeStatus("10.0.0.5"))
+
+        # Act: Unplugged and plugged in again while the wallbox was not reachable
+        finished = detector.update(7200, get_status("2", 1000), ALL_PV, 7200)
+
+        # Assert
+        self.assertEqual(len(finished), 1)
+        self.assertEqual((finished[0].start, finished[0].end, finished[0].energy), (0, 0, 1.0))
+        self.assertIsNone(finished[0].pv_share)
+        self.assertEqual(detector.session.start, 7200)
+
+class TestSessionDB(unittest.TestCase):
+
+    def test_monthly_totals_per_user_and_wallbox(self) -> None:
+        # Arrange
+        detector = SessionDetector("Garage")
+        with tempfile.TemporaryDirectory() as directory:
+            db = SessionDB(os.path.join(directory, "sessions.sqlite"))
+            # 2024-05-31 23:30 and 2024-06-01 00:30 local time
+            for (start, uby) in ((1717191000, "1"), (1717194600, "1"), (1717194600, "2")):
+                detector.update(start, get_status("2", 360000 * 2, uby=uby, power_kw10=37), ALL_PV, start)
+                detector.update(start + 60, get_status("2", 360000 * 2, uby=uby, power_kw10=37), ALL_PV, start + 60)
+                for session in detector.update(start + 120, get_status("1", 0)):
+                    db.insert_session(session)
+
+            # Act
+            may = db.get_monthly_totals("2024-05")
+            june = db.get_monthly_totals("2024-06")
+            sessions = db.get_sessions(*db.get_month_range("2024-06"), user="Alice")
+            db.close()
+
+        # Assert
+        self.assertEqual(may, {"user": {"Alice": {"sessions": 1, "energy": 2.0, "pv_energy": 2.0}},
+                               "wallbox": {"Garage": {"sessions": 1, "energy": 2.0, "pv_energy": 2.0}}})
+        self.assertEqual(june["user"]["Bob"]["sessions"], 1)
+        self.assertEqual(june["wallbox"]["Garage"], {"sessions": 2, "energy": 4.0, "pv_energy": 4.0})
+        self.assertEqual(sessions, [{"wallbox": "Garage", "user": "Alice", "start": "2024-05-31 22:30:00",
+                                     "end": "2024-05-31 22:31:00", "energy": 2.0, "pv_energy": 2.0}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Tests for the compact status record of go-eCharger wallboxes
+"""
+import json
+import logging
+import unittest
+
+from .goe_status import GoeStatus
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("GoEcharger-Tests")
+
+def get_status_v1(**values):
+    status = {
+        "sse": "012345", "fwv": "040.0", "ast": "0", "alw": "1", "uby": "1", "car": "2", "amp": "10", "pha": "56",
+        "nrg": [230, 231, 229, 0, 160, 160, 160, 37, 37, 37, 0, 1104, 99, 99, 99, 0], "dws": "36000", "eto": "1234",
+        "err": "0", "rca": "card1", "rna": "Alice", "eca": "10", "rcr": "card2", "rnm": "Bob", "ecr": "20",
+        "al1": "6", "al2": "10", "al3": "16", "al4": "20", "al5": "32"
+    }
+    return {**status, **values}
+
+class TestGoeStatus(unittest.TestCase):
+
+    def test_parse_creates_dict_on_demand(self) -> None:
+        # Act
+        status = GoeStatus.parse(get_status_v1(), "10.0.0.5")
+        data = status.as_dict()
+
+        # Assert
+        self.assertEqual(status.current_power, 11040)
+        self.assertIs(status.as_dict(), data)
+        self.assertEqual(data["device_ip"], "10.0.0.5")
+        self.assertEqual(data["charging"], {"status": "Car is charging", "max_ampere": 10, "current_power": 11040,
+                                            "pha_available": 3, "pha_used": 3, "energy": 0.1})
+        self.assertEqual(data["access_control"]["rfid_cards"][2], {"id": "card2", "name": "Bob", "energy": 20})
+        self.assertEqual(data["energy_values"]["L2_ampere"], 160)
+        self.assertEqual(data["button_levels"]["level5"], 32)
+        self.assertEqual(data["error_state"], "No error")
+
+    def test_with_connection_keeps_original(self) -> None:
+        # Arrange
+        status = GoeStatus.parse(get_status_v1(err="42"), "10.0.0.5")
+
+        # Act
+        connected = status.with_connection({"state": "closed"})
+
+        # Assert
+        self.assertNotIn("connection", status.as_dict())
+        self.assertEqual(connected.as_dict()["connection"], {"state": "closed"})
+        self.assertEqual(connected.as_dict()["error_state"], "Invalid error state")
+
+    def test_empty_status(self) -> None:
+        # Act
+        status = GoeStatus("10.0.0.5").with_connection({"state": "open"})
+
+        # Assert
+        self.assertEqual(status.current_power, 0)
+        self.assertEqual(status.as_dict(), {"connection": {"state": "open"}})
+
+    def test_state_restores_record(self) -> None:
+        # Arrange
+        status = GoeStatus.parse(get_status_v1(), "10.0.0.5")
+        state = json.loads(json.dumps(status.get_state()))
+
+        # Act
+        restored = GoeStatus.from_state(state, "10.0.0.5")
+
+        # Assert
+        self.assertIsNone(GoeStatus("10.0.0.5").get_state())
+        self.assertEqual(restored.as_dict(), status.as_dict())
+        self.assertEqual(restored.current_power, 11040)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+Keep the current on every phase of the house connection below the main fuse.
+
+The current per phase is estimated from the wallbox currents (nrg[4..6]) and the grid
+power of the SENEC appliance: the grid import that is not used by the wallboxes is put
+on house_load_phases phases (1 is the worst case, all of it on every phase).
+"""
+import math
+import logging
+
+log = logging.getLogger("FuseLimiter")
+
+PHASES = ("L1", "L2", "L3")
+
+class WallboxLoad():
+
+    def __init__(self, device_no, priority):
+        self.device_no = device_no
+        self.priority = priority    # Lower value is served first, so reduced last
+        self.currents = (0.0, 0.0, 0.0) # Measured current per phase (A)
+        self.power = 0.0            # Measured charging power (W)
+        self.ts = None              # Unix timestamp of the measurement
+        self.limit = None           # Ampere limit sent, 0 is paused, None is no limit
+        self.limit_ts = None        # Unix timestamp the limit was sent
+        self.expected = None        # Currents per phase expected with the new limit
+
+    def set_limit(self, now, limit):
+        if limit is None:
+            self.expected = self.currents
+        elif limit < max(self.currents):
+            self.expected = tuple(min(current, limit) for current in self.currents)
+        else:
+            # Assume the car takes everything on the phases it uses
+            self.expected = tuple(float(limit) if current >= 1 else 0.0 for current in self.currents)
+        self.limit = limit
+        self.limit_ts = now
+
+    def is_settling(self, now, settle_time):
+        return self.limit_ts is not None and now - self.limit_ts <= settle_time
+
+    def get_currents(self, now, settle_time):
+        """
+        Currents to expect: a new limit is assumed to be effective until the wallbox had time to report it.
+        """
+        return self.expected if self.is_settling(now, settle_time) else self.currents
+
+    def get_power(self):
+        """
+        Charging power (W) that is part of the grid power.
+        """
+        # Even a grid power measured after a new limit was sent includes what the car really draws,
+        # and that is the measured power until a measurement of the wallbox shows the new limit
+        return self.power
+
+class FuseLimiter():
+    """
+    fuse_limit:        Rated current of the main fuse per phase (A)
+    safety_margin:     Reduce wallboxes when a phase is above fuse_limit - safety_margin (A)
+    release_margin:    Raise limits again while all phases are below fuse_limit - release_margin (A)
+    release_seconds:   Seconds between two steps of raising limits
+    max_data_age:      Older data is not trusted, charging wallboxes are limited to min_ampere then
+    settle_time:       Seconds a wallbox may take to follow a new limit
+    """
+
+    def __init__(self, fuse_limit=35, safety_margin=2, release_margin=4, release_seconds=30, voltage=230,
+                 house_load_phases=1, min_ampere=6, max_ampere=32, max_data_age=5, settle_time=5):
+        self.fuse_limit = fuse_limit
+        self.safety_margin = safety_margin
+        self.release_margin = max(release_margin, safety_margin)
+        self.release_seconds = release_seconds
+        self.voltage = voltage
+        self.house_load_phases = house_load_phases
+        self.min_ampere = min_ampere
+        self.max_ampere = max_ampere
+        self.max_data_age = max_data_age
+        self.settle_time = settle_time
+        self.wallboxes = {}
+        self.grid_power = None
+        self.house_ts = None
+        self.release_since = None
+        self.stale = False
+        self.fresh_requested = None # When fresh data was requested, see request_fresh_data()
+
+    def add_wallbox(self, device_no, priority):
+        self.wallboxes[device_no] = WallboxLoad(device_no, priority)
+
+    def restore_limits(self, limits):
+        """
+        Limits {device_no: limit} sent before a restart. They are released step by step as usual.
+        """
+        for device_no, limit in limits.items():
+            if device_no in self.wallboxes:
+                self.wallboxes[device_no].limit = limit
+
+    def update_house(self, ts, grid_power):
+        self.house_ts = ts
+        self.grid_power = grid_power
+
+    def update_wallbox(self, device_no, ts, currents, power):
+        if device_no not in self.wallboxes:
+            return
+        wallbox = self.wallboxes[device_no]
+        wallbox.ts = ts
+        wallbox.currents = tuple(currents)
+        wallbox.power = power
+
+    def needs_fresh_data(self):
+        """
+        True while a wallbox charges or is limited, i.e. the limiter has to act or may release.
+        """
+        return any(max(wallbox.currents) > 0 or wallbox.limit is not None for wallbox in self.wallboxes.values())
+
+    def request_fresh_data(self, now, requested=True):
+        """
+        Fresh house data was requested (e.g. fast sampling of the SENEC plugin), or is not needed anymore.
+        Data of the slow polling before is not stale until the fresh data had max_data_age to arrive.
+        """
+        self.fresh_requested = now if requested else None
+
+    def get_phase_currents(self, now):
+        """
+        Estimated current (A) per phase.
+        """
+        currents = [0.0, 0.0, 0.0]
+        wallbox_power = 0.0
+        for wallbox in self.wallboxes.values():
+            for phase, current in enumerate(wallbox.get_currents(now, self.settle_time)):
+                currents[phase] += current
+            wallbox_power += wallbox.get_power()
+        house_current = max((self.grid_power or 0.0) - wallbox_power, 0.0) / (self.voltage * self.house_load_phases)
+        return [current + house_current for current in currents]
+
+    def check(self, now):
+        """
+        One run of the load management with the data received so far.
+        Returns the changed limits [(device_no, limit)], limit 0 pauses, None lifts the limit.
+        """
+        changes = []
+        if self.__is_stale(now):
+            self.release_since = None
+            for wallbox in self.wallboxes.values():
+                if max(wallbox.currents) > 0 and (wallbox.limit is None or wallbox.limit > self.min_ampere):
+                    self.__set_limit(now, wallbox, self.min_ampere, changes)
+            return changes
+        currents = self.get_phase_currents(now)
+        phase = max(range(3), key=lambda p: currents[p])
+        overload = currents[phase] - (self.fuse_limit - self.safety_margin)
+        if overload > 0:
+            self.release_since = None
+            log.warning("%s at %.1f A, reducing wallboxes by %.1f A.", PHASES[phase], currents[phase], overload)
+            self.__reduce(now, phase, overload, changes)
+        elif currents[phase] < self.fuse_limit - self.release_margin:
+            if self.release_since is None:
+                self.release_since = now
+            elif now - self.release_since >= self.release_seconds:
+                self.release_since = now
+                self.__release(now, self.fuse_limit - self.release_margin - currents[phase], changes)
+        else:
+            self.release_since = None
+        return changes
+
+    def __is_stale(self, now):
+        stale = self.__is_house_stale(now) \
+            or any(wallbox.ts is None or now - wallbox.ts > self.max_data_age for wallbox in self.wallboxes.values())
+        if stale != self.stale:
+            if stale:
+                log.warning("No current data. Limiting charging wallboxes to %s A.", self.min_ampere)
+            else:
+                log.info("Data is current again.")
+            self.stale = stale
+        return stale
+
+    def __is_house_stale(self, now):
+        if self.house_ts is None:
+            return True
+        if now - self.house_ts <= self.max_data_age:
+            return False
+        # Older while the house was polled slowly, unless fresh data should have arrived by now
+        # or the data was stale already
+        return self.stale or self.fresh_requested is None or now - self.fresh_requested > self.max_data_age
+
+    def __reduce(self, now, phase, overload, changes):
+        # Lower the current of all wallboxes before pausing any, lowest priority first
+        by_priority = sorted(self.wallboxes.values(), key=lambda wallbox: wallbox.priority, reverse=True)
+        for pause in (False, True):
+            for wallbox in by_priority:
+                if overload <= 0:
+                    return
+                drawn = wallbox.get_currents(now, self.settle_time)[phase]
+                if drawn < 1:
+                    # Not charging on this phase
+                    continue
+                target = 0 if pause else max(self.min_ampere, math.floor(drawn - overload))
+                if target >= drawn:
+                    continue
+                overload -= drawn - target
+                self.__set_limit(now, wallbox, target, changes)
+
+    def __release(self, now, headroom, changes):
+        # One step at a time, highest priority first
+        for wallbox in sorted(self.wallboxes.values(), key=lambda wallbox: wallbox.priority):
+            if wallbox.limit is None:
+                continue
+            if wallbox.limit == 0:
+                if headroom >= self.min_ampere:
+                    self.__set_limit(now, wallbox, self.min_ampere, changes)
+                return
+            if headroom < 1:
+                return
+            target = wallbox.limit + math.floor(headroom)
+            self.__set_limit(now, wallbox, None if target >= self.max_ampere else target, changes)
+            return
+
+    def __set_limit(self, now, wallbox, limit, changes):
+        log.info("Wallbox %s: Limit %s A.", wallbox.device_no, limit)
+        wallbox.set_limit(now, limit)
+        changes.append((wallbox.device_no, limit))
+
+    def get_state(self, now):
+        return {
+            "phase_currents": {name: round(current, 1) for name, current in zip(PHASES, self.get_phase_currents(now))},
+            "stale": self.stale,
+            "limits": {wallbox.device_no: wallbox.limit for wallbox in self.wallboxes.values()}
+        }
@@ -0,0 +1,149 @@
+"""
+Protect the main fuse: reduce the charging current of the wallboxes before the house connection is overloaded.
+"""
+import time
+import logging
+
+import plugin_collection
+from metrics import registry
+from event_bus import Measurement, Command
+from .fuse_limiter import FuseLimiter, PHASES
+
+log = logging.getLogger("LoadManagement")
+
+registry.describe("load_management_phase_current_amperes", "gauge", "Estimated current per phase of the house connection")
+registry.describe("load_management_limit_amperes", "gauge", "Ampere limit per wallbox (max_ampere if not limited, 0 if paused)")
+registry.describe("load_management_reductions_total", "counter", "Limits lowered per wallbox")
+registry.describe("load_management_reaction_seconds", "gauge", "Age of the measurement that caused the last reduction when the limit was sent")
+registry.describe("load_management_check_seconds", "gauge", "Duration of the last check")
+
+class LoadManager(plugin_collection.Plugin):
+
+    def __init__(self):
+        super().__init__()
+        self.title = "Load Management"
+        self.description = "Keep the current of house and wallboxes below the main fuse."
+        self.pluginPackage = type(self).__module__.split('.')[1]
+        self.type = "sink"
+        self.has_runtime = False # Only if enabled, see apply_settings()
+        self.settings = { # Will be read from src/config/settings.json
+            "plugin_path": "/load-management",
+            "enabled": False,
+            "fuse_limit": 35, # Rated current of the main fuse per phase (A)
+            "safety_margin": 2, # Reduce wallboxes above fuse_limit - safety_margin (A)
+            "release_margin": 4, # Raise limits again below fuse_limit - release_margin (A)
+            "release_seconds": 30, # Seconds between two steps of raising limits
+            "voltage": 230, # Voltage per phase (V)
+            "house_load_phases": 1, # Phases the house load is spread over, 1 assumes the worst case
+            "min_ampere": 6, # Lowest charging current of the wallboxes (A)
+            "max_ampere": 32, # Highest charging current of the wallboxes (A)
+            "max_data_age": 5, # Seconds without new data before charging wallboxes are limited to min_ampere
+            "check_interval": 0.2, # Seconds between checks if no new data arrives
+            "max_reaction_seconds": 3, # Warn if a reduction is sent later than this after the measurement
+            "wallbox_priorities": [0, 1] # Priority per wallbox (device_no), lower is reduced last
+        }
+        self.fast_sampling = False
+        self.__create_limiter()
+
+    def add_webserver(self, webserver):
+        self.webserver = webserver
+
+    def apply_settings(self, settings):
+        if(type(self).__name__ in settings):
+            log.info("Found custom config. Applying...")
+            self.settings = {**self.settings, **settings[type(self).__name__]}
+            self.has_runtime = self.settings['enabled']
+            self.__create_limiter()
+
+    def __create_limiter(self):
+        self.limiter = FuseLimiter(
+            fuse_limit=self.settings['fuse_limit'],
+            safety_margin=self.settings['safety_margin'],
+            release_margin=self.settings['release_margin'],
+            release_seconds=self.settings['release_seconds'],
+            voltage=self.settings['voltage'],
+            house_load_phases=self.settings['house_load_phases'],
+            min_ampere=self.settings['min_ampere'],
+            max_ampere=self.settings['max_ampere'],
+            max_data_age=self.settings['max_data_age'])
+
+    def runtime(self, other_plugins):
+        """
+        Runs in its own thread with its own subscription, so neither the Dashboard nor
+        web requests or DB writes delay it. Limits go to the wallboxes on their own
+        command topic, which the GoEcharger plugin applies without waiting (see __apply_limits()).
+        """
+        events = other_plugins.events
+        measurements = events.subscribe(type(self).__name__, ["measurement/house", "measurement/wallbox/*"], Measurement, maxlen=20)
+        for device_no, wallbox in self.limiter.wallboxes.items():
+            if wallbox.limit is not None:
+                # Limits of the last run (see restore_state()), the GoEcharger plugin keeps them too
+                events.publish(Command(f"command/wallbox/{device_no}/limit", wallbox.limit, source=type(self).__name__))
+        while True:
+            received = {}
+            for event in measurements.get_all(timeout=self.settings['check_interval']):
+                self.__update(event)
+                received[event.topic] = event.ts
+            started = time.perf_counter()
+            now = time.time()
+            if self.limiter.needs_fresh_data() != self.fast_sampling:
+                # The SENEC plugin polls slowly while the values are steady, which would be older than max_data_age.
+                # Asked before the check, so a car that starts charging is not limited for the slow data.
+                self.fast_sampling = not self.fast_sampling
+                events.publish(Command("command/senec/sample_fast", self.fast_sampling, source=type(self).__name__))
+                self.limiter.request_fresh_data(now, self.fast_sampling)
+            previous = {device_no: wallbox.limit for device_no, wallbox in self.limiter.wallboxes.items()}
+            for (device_no, limit) in self.limiter.check(now):
+                events.publish(Command(f"command/wallbox/{device_no}/limit", limit, source=type(self).__name__))
+                self.__record_change(device_no, previous[device_no], limit, received)
+            registry.set("load_management_check_seconds", round(time.perf_counter() - started, 6))
+            for phase, current in zip(PHASES, self.limiter.get_phase_currents(now)):
+                registry.set("load_management_phase_current_amperes", round(current, 1), phase=phase)
+
+    def __update(self, event):
+        data = event.payload.data
+        if event.topic == "measurement/house":
+            # Data of failed polls is republished with the old values
+            if data.get("connection", {}).get("failures", 0) == 0 and "live_data" in data:
+                self.limiter.update_house(event.ts, data["live_data"]["grid_power"])
+            return
+        device_no = int(event.topic.rsplit("/", 1)[1])
+        if data.device_serial is None or (data.connection and data.connection["failures"]):
+            return
+        if device_no not in self.limiter.wallboxes:
+            self.__add_wallbox(device_no)
+        # nrg[4..6] in 0.1 A
+        self.limiter.update_wallbox(device_no, event.ts, (data.nrg[4] / 10, data.nrg[5] / 10, data.nrg[6] / 10), data.current_power)
+
+    def __add_wallbox(self, device_no):
+        priorities = self.settings['wallbox_priorities']
+        self.limiter.add_wallbox(device_no, priorities[device_no] if device_no < len(priorities) else device_no)
+
+    def __record_change(self, device_no, previous, limit, received):
+        registry.set("load_management_limit_amperes", self.settings['max_ampere'] if limit is None else limit, device=str(device_no))
+        if limit is None or (previous is not None and limit >= previous):
+            return
+        registry.inc("load_management_reductions_total", device=str(device_no))
+        if received:
+            # From the measurement that showed the overload until the limit was published
+            reaction = time.time() - max(received.values())
+            registry.set("load_management_reaction_seconds", round(reaction, 3))
+            if reaction > self.settings['max_reaction_seconds']:
+                log.warning("Reduction sent %.1f s after the measurement.", reaction)
+
+    def get_state(self):
+        if not self.has_runtime:
+            return None
+        return {"limits": {device_no: wallbox.limit for device_no, wallbox in self.limiter.wallboxes.items()}}
+
+    def restore_state(self, state):
+        limits = {int(device_no): limit for device_no, limit in state["limits"].items()}
+        for device_no in limits:
+            self.__add_wallbox(device_no)
+        self.limiter.restore_limits(limits)
+
+    def endpoint(self, req, resp):
+        resp.media = {
+            "enabled": self.has_runtime,
+            **self.limiter.get_state(time.time())
+        }
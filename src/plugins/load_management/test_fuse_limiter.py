@@ -0,0 +1,117 @@
+"""
+Tests for keeping the current of house and wallboxes below the main fuse
+"""
+import logging
+import unittest
+
+from .fuse_limiter import FuseLimiter
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("FuseLimiter-Tests")
+
+# 16 A on three phases
+CHARGING = ((16.0, 16.0, 16.0), 11040.0)
+
+class TestFuseLimiter(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.limiter = FuseLimiter(fuse_limit=35, safety_margin=2, release_margin=4, release_seconds=30,
+                                   voltage=230, house_load_phases=1, min_ampere=6, max_ampere=32, max_data_age=5)
+        self.limiter.add_wallbox(0, 0)
+        self.limiter.add_wallbox(1, 1)
+
+    def update(self, now, grid_power, wallbox0, wallbox1):
+        self.limiter.update_house(now, grid_power)
+        self.limiter.update_wallbox(0, now, *wallbox0)
+        self.limiter.update_wallbox(1, now, *wallbox1)
+
+    def test_lowest_priority_is_reduced_first(self) -> None:
+        # Arrange: 2 x 16 A plus 1150 W (5 A) house load on one phase
+        self.update(100.0, 2 * 11040.0 + 1150.0, CHARGING, CHARGING)
+
+        # Act
+        changes = self.limiter.check(100.0)
+        again = self.limiter.check(100.5)
+
+        # Assert
+        self.assertEqual(changes, [(1, 12)])
+        self.assertEqual(again, [])
+        self.assertEqual(self.limiter.get_phase_currents(100.5), [33.0, 33.0, 33.0])
+
+    def test_wallboxes_are_paused_if_min_ampere_is_not_enough(self) -> None:
+        # Arrange: 2 x 16 A plus 4600 W (20 A) house load
+        self.update(100.0, 2 * 11040.0 + 4600.0, CHARGING, CHARGING)
+
+        # Act
+        changes = self.limiter.check(100.0)
+
+        # Assert
+        # 52 A: wallbox 1 to 6 A (-10 A), wallbox 0 to 7 A (-9 A)
+        self.assertEqual(changes, [(1, 6), (0, 7)])
+        self.assertLessEqual(max(self.limiter.get_phase_currents(100.0)), 33.0)
+
+        # Arrange: house load rises to 25 A
+        self.update(101.0, 5750.0 + 4830.0 + 4140.0, ((7.0, 7.0, 7.0), 4830.0), ((6.0, 6.0, 6.0), 4140.0))
+
+        # Act
+        changes = self.limiter.check(101.0)
+
+        # Assert
+        # 38 A: wallbox 0 to 6 A, then wallbox 1 paused
+        self.assertEqual(changes, [(0, 6), (1, 0)])
+
+    def test_stale_data_limits_and_limits_are_released_stepwise(self) -> None:
+        # Arrange
+        self.update(100.0, 11040.0, CHARGING, ((0.0, 0.0, 0.0), 0.0))
+
+        # Act: No data for 10 s
+        stale = self.limiter.check(110.0)
+        self.update(111.0, 4140.0, ((6.0, 6.0, 6.0), 4140.0), ((0.0, 0.0, 0.0), 0.0))
+        waiting = self.limiter.check(111.0)
+        self.update(141.0, 4140.0, ((6.0, 6.0, 6.0), 4140.0), ((0.0, 0.0, 0.0), 0.0))
+        released = self.limiter.check(141.0)
+
+        # Assert
+        self.assertEqual(stale, [(0, 6)])
+        self.assertEqual(waiting, [])
+        # 31 A allowed, 6 A used
+        self.assertEqual(released, [(0, 31)])
+
+    def test_grid_power_after_new_limit_includes_measured_wallbox_power(self) -> None:
+        # Arrange: Overload of 4 A, wallbox 1 is set to 12 A
+        self.update(100.0, 2 * 11040.0 + 1150.0, CHARGING, CHARGING)
+        self.assertEqual(self.limiter.check(100.0), [(1, 12)])
+
+        # Act: The next SENEC poll, before the wallbox followed and reported
+        self.limiter.update_house(100.5, 2 * 11040.0 + 1150.0)
+        changes = self.limiter.check(100.5)
+
+        # Assert
+        self.assertEqual(changes, [])
+        self.assertEqual(self.limiter.get_phase_currents(100.5), [33.0, 33.0, 33.0])
+
+    def test_slow_house_data_is_not_stale_while_fresh_data_is_requested(self) -> None:
+        # Arrange: Steady values, the house is polled every 10 s
+        self.update(100.0, 1150.0, ((0.0, 0.0, 0.0), 0.0), ((0.0, 0.0, 0.0), 0.0))
+        self.limiter.check(100.0)
+
+        # Act: A car starts charging, fresh data is requested and arrives 1 s later
+        self.limiter.update_wallbox(0, 107.0, *CHARGING)
+        self.limiter.update_wallbox(1, 107.0, (0.0, 0.0, 0.0), 0.0)
+        self.limiter.request_fresh_data(107.0)
+        starting = self.limiter.check(107.0)
+        self.limiter.update_house(108.0, 11040.0 + 1150.0)
+        self.limiter.update_wallbox(0, 108.0, *CHARGING)
+        self.limiter.update_wallbox(1, 108.0, (0.0, 0.0, 0.0), 0.0)
+        fresh = self.limiter.check(108.0)
+        # No fresh data within max_data_age
+        self.limiter.update_wallbox(0, 113.5, *CHARGING)
+        self.limiter.update_wallbox(1, 113.5, (0.0, 0.0, 0.0), 0.0)
+        missing = self.limiter.check(113.5)
+
+        # Assert
+        self.assertEqual((starting, fresh), ([], []))
+        self.assertEqual(missing, [(0, 6)])
+
+if __name__ == '__main__':
+    unittest.main()
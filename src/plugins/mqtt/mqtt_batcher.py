@@ -0,0 +1,73 @@
+"""
+Decide which MQTT topics to publish: one topic per metric, only changed values,
+at most once per publish interval of the topic.
+"""
+import json
+from fnmatch import fnmatchcase
+
+def flatten(prefix, data):
+    """
+    Nested dicts and lists to {topic: value}, e.g. {"house/live_data/pv_production": 1200.0}.
+    """
+    topics = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            topics.update(flatten(f"{prefix}/{key}", value))
+    elif isinstance(data, (list, tuple)):
+        for index, value in enumerate(data):
+            topics.update(flatten(f"{prefix}/{index}", value))
+    elif data is not None:
+        topics[prefix] = data
+    return topics
+
+def to_payload(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+class TopicBatcher():
+    """
+    Keeps the latest value per topic until it is due. Values that did not change since
+    they were last sent are not sent again. Several updates within one interval are
+    coalesced into the latest value.
+    """
+
+    def __init__(self, interval=5.0, topic_intervals=None):
+        self.interval = interval
+        self.topic_intervals = list((topic_intervals or {}).items()) # (fnmatch pattern, seconds), first match wins
+        self.interval_cache = {}
+        self.pending = {}   # topic -> payload
+        self.sent = {}      # topic -> (payload, time sent)
+
+    def update(self, values):
+        for topic, value in values.items():
+            payload = to_payload(value)
+            if topic in self.sent and self.sent[topic][0] == payload:
+                # Changed back within the interval
+                self.pending.pop(topic, None)
+            else:
+                self.pending[topic] = payload
+
+    def due(self, now):
+        """
+        (topic, payload) to publish now. They are considered sent.
+        """
+        batch = []
+        for topic, payload in list(self.pending.items()):
+            if topic in self.sent and now - self.sent[topic][1] < self.get_interval(topic):
+                continue
+            batch.append((topic, payload))
+            self.sent[topic] = (payload, now)
+            del self.pending[topic]
+        return batch
+
+    def get_interval(self, topic):
+        if topic not in self.interval_cache:
+            self.interval_cache[topic] = next((seconds for pattern, seconds in self.topic_intervals if fnmatchcase(topic, pattern)), self.interval)
+        return self.interval_cache[topic]
+
+    def forget(self):
+        """
+        Send everything again with the next update, e.g. after reconnecting to a broker without persistence.
+        """
+        self.sent.clear()
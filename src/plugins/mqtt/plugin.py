@@ -0,0 +1,112 @@
+"""
+Publish live data of all sources to an MQTT broker.
+
+Every metric gets its own retained topic, e.g. solar/house/live_data/pv_production
+or solar/wallbox/0/charging/current_power. Requires paho-mqtt (pip install paho-mqtt),
+the plugin stays inactive without it.
+"""
+import time
+import logging
+
+import plugin_collection
+from event_bus import Measurement
+from .mqtt_batcher import TopicBatcher, flatten
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+log = logging.getLogger("MQTT")
+
+class MqttPublisher(plugin_collection.Plugin):
+
+    def __init__(self):
+        super().__init__()
+        self.title = "MQTT"
+        self.description = "Publish live energy data to an MQTT broker."
+        self.pluginPackage = type(self).__module__.split('.')[1]
+        self.type = "sink"
+        self.has_runtime = False # Only if enabled, see apply_settings()
+        self.settings = { # Will be read from src/config/settings.json
+            "plugin_path": "/mqtt",
+            "enabled": False,
+            "host": "localhost",
+            "port": 1883,
+            "client_id": "solar-wallbox",
+            "username": "",
+            "password": "",
+            "topic_prefix": "solar",
+            "qos": 0,
+            "publish_interval": 5.0, # Minimum seconds between two messages on the same topic
+            "topic_intervals": {} # Other intervals per topic, e.g. {"solar/house/live_data/*": 1.0}
+        }
+        self.batcher = TopicBatcher()
+        self.connected = False
+        self.published = 0
+
+    def add_webserver(self, webserver):
+        self.webserver = webserver
+
+    def apply_settings(self, settings):
+        if(type(self).__name__ in settings):
+            log.info("Found custom config. Applying...")
+            self.settings = {**self.settings, **settings[type(self).__name__]}
+            self.batcher = TopicBatcher(self.settings['publish_interval'], self.settings['topic_intervals'])
+            if self.settings['enabled'] and mqtt is None:
+                log.warning("paho-mqtt is not installed. Not publishing to MQTT.")
+            self.has_runtime = self.settings['enabled'] and mqtt is not None
+
+    def runtime(self, other_plugins):
+        measurements = other_plugins.events.subscribe(type(self).__name__, "measurement/*", Measurement, maxlen=50)
+        client = self.create_client()
+        # Wake up at least once per interval to send values that were held back
+        tick = min([self.settings['publish_interval'], *self.settings['topic_intervals'].values()])
+        while True:
+            for event in measurements.get_all(timeout=tick):
+                # measurement/house -> solar/house
+                topic = f"{self.settings['topic_prefix']}/{event.topic.split('/', 1)[1]}"
+                self.batcher.update(flatten(topic, event.payload.get_dict()))
+            if not self.connected:
+                continue
+            for (topic, payload) in self.batcher.due(time.monotonic()):
+                client.publish(topic, payload, qos=self.settings['qos'], retain=True)
+                self.published += 1
+
+    def create_client(self):
+        """
+        Connected paho client. The network loop runs in its own thread and reconnects on its own.
+        """
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            # paho-mqtt >= 2.0
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=self.settings['client_id'])
+        else:
+            client = mqtt.Client(client_id=self.settings['client_id'])
+        if self.settings['username']:
+            client.username_pw_set(self.settings['username'], self.settings['password'])
+        client.on_connect = self.__on_connect
+        client.on_disconnect = self.__on_disconnect
+        client.connect_async(self.settings['host'], self.settings['port'])
+        client.loop_start()
+        return client
+
+    def __on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            log.info("Connected to %s:%s.", self.settings['host'], self.settings['port'])
+            # Retained messages may be lost if the broker restarted, send everything again
+            self.batcher.forget()
+            self.connected = True
+        else:
+            log.warning("Connection to %s:%s refused (%s).", self.settings['host'], self.settings['port'], rc)
+
+    def __on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        log.warning("Disconnected from %s:%s (%s).", self.settings['host'], self.settings['port'], rc)
+
+    def endpoint(self, req, resp):
+        resp.media = {
+            "enabled": self.has_runtime,
+            "connected": self.connected,
+            "published": self.published,
+            "pending": len(self.batcher.pending)
+        }
@@ -0,0 +1,90 @@
+"""
+Tests for batching of MQTT messages
+"""
+import time
+import logging
+import threading
+import unittest
+
+from event_bus import EventBus, Measurement
+from snapshot import SnapshotPublisher
+from .mqtt_batcher import TopicBatcher, flatten
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("MQTT-Tests")
+
+class StandInClient():
+    """
+    Records messages instead of sending them to a broker.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload, retain))
+
+class StandInPluginCollection():
+
+    def __init__(self):
+        self.events = EventBus()
+
+class TestTopicBatcher(unittest.TestCase):
+
+    def test_flatten(self) -> None:
+        # Act
+        topics = flatten("solar/house", {"live_data": {"pv_production": 1200.5, "force_charging_state": False},
+                                         "battery_information": {"cycles": [10, 11]}, "missing": None})
+
+        # Assert
+        self.assertEqual(topics, {
+            "solar/house/live_data/pv_production": 1200.5,
+            "solar/house/live_data/force_charging_state": False,
+            "solar/house/battery_information/cycles/0": 10,
+            "solar/house/battery_information/cycles/1": 11
+        })
+
+    def test_only_changed_values_at_most_once_per_interval(self) -> None:
+        # Arrange
+        batcher = TopicBatcher(interval=5.0, topic_intervals={"solar/fast/*": 1.0})
+
+        # Act
+        batcher.update({"solar/slow/a": 1, "solar/fast/b": "x"})
+        first = batcher.due(100.0)
+        batcher.update({"solar/slow/a": 2, "solar/fast/b": "y"})
+        batcher.update({"solar/slow/a": 3, "solar/fast/b": "y"})
+        second = batcher.due(101.0)
+        batcher.update({"solar/slow/a": 3, "solar/fast/b": "y"})
+        third = batcher.due(105.0)
+        batcher.update({"solar/slow/a": 3, "solar/fast/b": "y"})
+        fourth = batcher.due(110.0)
+
+        # Assert
+        self.assertEqual(first, [("solar/slow/a", "1"), ("solar/fast/b", "x")])
+        self.assertEqual(second, [("solar/fast/b", "y")])
+        self.assertEqual(third, [("solar/slow/a", "3")])
+        self.assertEqual(fourth, [])
+
+    def test_plugin_publishes_retained_metrics(self) -> None:
+        # Arrange
+        from .plugin import MqttPublisher
+        plugin = MqttPublisher()
+        plugin.apply_settings({"MqttPublisher": {"publish_interval": 0.05}})
+        client = StandInClient()
+        plugin.create_client = lambda: client
+        plugin.connected = True
+        plugins = StandInPluginCollection()
+        threading.Thread(target=plugin.runtime, args=(plugins,), daemon=True).start()
+        time.sleep(0.1)
+        house = SnapshotPublisher("house")
+
+        # Act
+        plugins.events.publish(Measurement("measurement/house", house.publish({"live_data": {"pv_production": 900}})))
+        plugins.events.publish(Measurement("measurement/house", house.publish({"live_data": {"pv_production": 900}})))
+        time.sleep(0.3)
+
+        # Assert
+        self.assertEqual(client.messages, [("solar/house/live_data/pv_production", "900", True)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,12 +5,18 @@ import os
 import schedule
 import time
 import logging
+import threading
+from datetime import datetime, timedelta, timezone
 
 import plugin_collection
+import capture_log
+from snapshot import SnapshotPublisher
+from event_bus import Measurement, Command
 from .senec import Senec
-from .senec_db import SenecDB
+from .senec_db import SenecDB, SenecReadPool, TodayStats
+from .senec_energy import EnergyCounters
+from .senec_sampler import AdaptiveSampler
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
 log = logging.getLogger("Senec")
 
 class SenecHomeV3Hybrid(plugin_collection.Plugin):
@@ -22,14 +28,36 @@ class SenecHomeV3Hybrid(plugin_collection.Plugin):
         self.pluginPackage = type(self).__module__.split('.')[1]
         self.type = "source"
         self.has_runtime = True
-        self.current_data = {}
+        self.publisher = SnapshotPublisher("house")
         self.force_charging_state = False
         self.settings = { # Will be read from src/config/settings.json
             "plugin_path": "/senec",
             "device_ip": "IP_OF_YOUR_SENEC_DEVICE",
+            "device_id": "", # FACTORY.DEVICE_ID to find the appliance at another IP address, any SENEC appliance found if empty
             "batteryCapacity": 10,
-            "db_file": "path_to_db_file"
+            "db_file": "path_to_db_file",
+            "energy_checkpoint_interval": 60, # Seconds between persisting energy totals
+            "energy_max_gap": 60, # Intervals between samples longer than this (s) are not integrated
+            "record_measurements": True, # Store every sample of live data in the DB
+            "db_readers": 4, # Read-only DB connections for queries besides the recording
+            "db_mmap_size": 64 * 1024 * 1024, # Bytes of the DB file mapped into memory per reader
+            "db_cache_size": 8 * 1024, # Page cache per reader (KiB)
+            "min_interval": 0.5, # Seconds between polls while values change quickly or a control decision is pending
+            "max_interval": 10, # Seconds between polls while values are steady
+            "volatility_scale": 50, # Rate of change (W/s) that halves the interval
+            "volatility_deadband": 50, # Changes between two polls up to this power (W) are ignored
+            "volatility_time_constant": 30, # Seconds until the interval grows again after a change
+            "request_budget": 90, # Polls per minute on average
+            "request_burst": 20, # Polls that may exceed the budget for a short time
+            "boost_seconds": 30 # Poll at min_interval for this long after a wallbox command
         }
+        self.energy = EnergyCounters()
+        self.sampler = AdaptiveSampler("senec")
+        self.capture = None
+        self.api = None # Created with the IP address of the settings, see apply_settings()
+        self.reader = None # Created on first use, see get_reader()
+        self.today_stats = TodayStats() # Updated by the recording, read through the reader
+        self.reader_lock = threading.Lock()
 
     def add_webserver(self, webserver):
         self.webserver = webserver
@@ -37,33 +65,146 @@ class SenecHomeV3Hybrid(plugin_collection.Plugin):
     def apply_settings(self, settings):
         if(type(self).__name__ in settings):
             log.info("Found custom config. Applying...")
-            self.settings = settings[type(self).__name__]
+            self.settings = {**self.settings, **settings[type(self).__name__]}
             self.settings['db_path'] = f"{settings['common']['db_base_path']}{self.settings['plugin_path']}"
-            log.debug(f"Settings: {self.settings}")
+            log.debug("Settings: %s", self.settings)
             # Connect to SENEC appliance now that we have the IP address
-            self.api = Senec(self.settings['device_ip'])
+            self.capture = capture_log.get_writer(settings)
+            self.api = Senec(self.settings['device_ip'], self.capture)
+            if self.settings['energy_max_gap'] <= self.settings['max_interval']:
+                # Otherwise nothing would be integrated while the values are steady
+                log.warning("energy_max_gap must be longer than max_interval. Using %s s.", 2 * self.settings['max_interval'])
+                self.settings['energy_max_gap'] = 2 * self.settings['max_interval']
+            self.energy = EnergyCounters(max_gap=self.settings['energy_max_gap'])
+            self.sampler = AdaptiveSampler(
+                f"senec:{self.settings['device_ip']}",
+                min_interval=self.settings['min_interval'],
+                max_interval=self.settings['max_interval'],
+                volatility_scale=self.settings['volatility_scale'],
+                deadband=self.settings['volatility_deadband'],
+                time_constant=self.settings['volatility_time_constant'],
+                budget=self.settings['request_budget'],
+                burst=self.settings['request_burst'])
 
     def runtime(self, other_plugins):
+        self.events = other_plugins.events
+        # The charging power of the wallboxes is part of the house consumption, see EnergyCounters.split_powers()
+        wallbox_events = self.events.subscribe("Senec wallboxes", "measurement/wallbox/*", Measurement, maxlen=10)
+        # Wallbox commands change the consumption, they are watched more closely
+        commands = self.events.subscribe("Senec commands", ["command/senec/*", "command/wallbox/*"], Command)
+        # The appliance found at another address, see the DeviceDiscovery plugin
+        discovery = self.events.subscribe("Senec discovery", "discovery/devices", Measurement, maxlen=2)
+        reachable = True
+        wallbox_powers = {}
+        # The DB connection must be created in the thread using it
+        db = SenecDB(f"{self.settings['db_path']}/{self.settings['db_file']}", self.today_stats)
+        self.energy.restore(time.time(), db.get_energy_totals())
+        last_checkpoint = time.monotonic()
         # This is run permanently in the background
         while True:
+            # Commands are handled while waiting for the next poll, they may make it due earlier
+            for event in commands.get_all(timeout=self.sampler.get_wait(time.monotonic())):
+                self.__process_command(event)
+            now = time.monotonic()
+            if self.sampler.get_wait(now) > 0:
+                continue
+            for event in discovery.get_all(timeout=0):
+                self.__remap(event.payload.data["devices"])
+            for event in wallbox_events.get_all(timeout=0):
+                wallbox_powers[event.topic] = event.payload.get_dict().get("charging", {}).get("current_power", 0)
+            self.sampler.take(now)
             tmp = self.__get_data_from_appliance()
-            if not "error" in tmp:
-                self.current_data = tmp
-            #db = SenecDB(f"{self.settings['db_path']}/{self.settings['db_file']}")
-            #db.insert_measurement(self.current_data)
-            #db.close()
-            time.sleep(1)
+            if tmp and not "error" in tmp:
+                self.sampler.add_sample(now, tmp["live_data"]["pv_production"], tmp["live_data"]["house_power"])
+                self.energy.add_sample(time.time(), EnergyCounters.split_powers(tmp["live_data"], sum(wallbox_powers.values())))
+                tmp["energy"] = self.energy.get_totals()
+                tmp["connection"] = self.api.breaker.get_state()
+                self.__publish(tmp)
+                if self.settings['record_measurements']:
+                    db.insert_measurement(tmp)
+            elif self.current_data:
+                # Keep the last data, but show that it is outdated
+                self.__publish({**self.current_data, "connection": self.api.breaker.get_state()})
+            if reachable and not self.api.breaker.is_closed():
+                # Maybe it got another IP address
+                self.events.publish(Command("command/discovery/scan", f"SENEC ({self.api.device_ip}) not reachable", source=type(self).__name__))
+            reachable = self.api.breaker.is_closed()
+            if time.monotonic() - last_checkpoint >= self.settings['energy_checkpoint_interval']:
+                db.save_energy_totals(self.energy.get_checkpoint())
+                last_checkpoint = time.monotonic()
+
+    def __remap(self, found):
+        appliances = [device for device in found if device["kind"] == "senec"]
+        if self.settings['device_id']:
+            appliances = [device for device in appliances if device["id"] == self.settings['device_id']]
+        if len(appliances) != 1:
+            if len(appliances) > 1:
+                log.warning("Found %s SENEC appliances. Set device_id to choose one.", len(appliances))
+            return
+        if appliances[0]["ip"] != self.api.device_ip:
+            self.__set_ip(appliances[0]["ip"])
+
+    def __set_ip(self, ip):
+        log.warning("SENEC appliance moved from %s to %s.", self.api.device_ip, ip)
+        self.api = Senec(ip, self.capture)
+
+    def __publish(self, data):
+        snapshot = self.publisher.publish(data)
+        self.events.publish(Measurement("measurement/house", snapshot, source=type(self).__name__, ts=snapshot.ts))
+
+    def __process_command(self, event):
+        if event.topic == "command/senec/force_charge":
+            self.__set_force_charging(bool(event.payload))
+        elif event.topic == "command/senec/sample_fast":
+            self.sampler.set_urgent(bool(event.payload), event.source)
+        elif event.topic.startswith("command/wallbox/"):
+            self.sampler.boost(time.monotonic(), self.settings['boost_seconds'])
+        else:
+            log.warning("Unknown command %s. Ignoring it.", event.topic)
+
+    def __set_force_charging(self, state):
+        self.force_charging_state = state
+        self.api.set_force_charge_battery(state)
+
+    @property
+    def current_data(self):
+        return self.publisher.get().data
+
+    def get_publishers(self):
+        return {self.settings['plugin_path']: self.publisher}
+
+    def get_state(self):
+        snapshot = self.publisher.get()
+        return {
+            "configured_ip": self.settings['device_ip'],
+            "ip": self.api.device_ip if self.api else None,
+            "ts": snapshot.ts,
+            "data": snapshot.data,
+            # More recent than the last checkpoint in the DB, see runtime()
+            "energy": self.energy.get_checkpoint(),
+            "force_charging_state": self.force_charging_state
+        }
+
+    def restore_state(self, state):
+        if self.api and state.get("configured_ip") == self.settings['device_ip'] and state["ip"] != self.api.device_ip:
+            self.__set_ip(state["ip"])
+        self.force_charging_state = state["force_charging_state"]
+        self.energy.restore(time.time(), state["energy"])
+        if state["data"]:
+            # Served until the first poll, with its original timestamp
+            self.publisher.publish(state["data"], state["ts"])
+
+    def get_sources(self):
+        return {"house": self.publisher}
 
     def endpoint(self, req, resp):
         viewmodel = self.__create_view_model(req)
         if (self.__get_output_format(req) == "json"):
-            res = self.current_data
-            resp.media = res
+            self.publisher.get().serve(req, resp)
             return
         try:
             force_charge = req.params["forceCharge"]
-            self.force_charging_state = (force_charge == "true")
-            self.api.set_force_charge_battery(self.force_charging_state)
+            self.__set_force_charging(force_charge == "true")
             return
         except KeyError:
             pass
@@ -77,6 +218,41 @@ class SenecHomeV3Hybrid(plugin_collection.Plugin):
         """
         return self.current_data
 
+    def get_energy_totals(self):
+        """
+        Energy totals (kWh) for today, this month and this year, integrated from live data.
+        """
+        return self.energy.get_totals()
+
+    def get_history(self, minutes):
+        """
+        Recorded live data of the last minutes as rows of
+        (unix timestamp, pv_production, house_power, grid_power, battery_charge_power).
+        """
+        now = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+        rows = self.get_reader().get_live_values_between_tss(now - timedelta(minutes=minutes), now)
+        return [(datetime.fromisoformat(row[0]).replace(tzinfo=timezone.utc).timestamp(), *row[1:]) for row in rows]
+
+    def get_reader(self):
+        """
+        SenecReadPool for queries from any thread, while the runtime records.
+        """
+        with self.reader_lock:
+            if self.reader is None:
+                db_file = f"{self.settings['db_path']}/{self.settings['db_file']}"
+                # Creates or migrates the DB if needed, the readers only open it
+                SenecDB(db_file).close()
+                self.reader = SenecReadPool(db_file, self.settings['db_readers'], self.settings['db_mmap_size'], self.settings['db_cache_size'],
+                                            self.today_stats)
+            return self.reader
+
+    def get_today(self, metric, aggregation):
+        """
+        Aggregation ("min", "max", "avg", "diff", ...) of a recorded metric today, e.g. ("live_pv_production", "max").
+        Cached and updated with every recorded sample, see TodayStats.
+        """
+        return self.today_stats.get(self.get_reader(), metric, aggregation)
+
     def __create_view_model(self, req):
         # Path: plugin_path + /
         return {
@@ -88,46 +264,51 @@ class SenecHomeV3Hybrid(plugin_collection.Plugin):
     def __get_data_from_appliance(self):
         appliance_values = self.api.send_request()
         if not "error" in appliance_values:
-            # Transform senec data structure to our data structure
-            try:
-                return {
-                    "general": {
-                        #"current_state"         : appliance_values["STATISTIC"]["CURRENT_STATE"],                   # Current state of the system
-                        "hours_of_operation"    : appliance_values["ENERGY"]["STAT_HOURS_OF_OPERATION"]             # Appliance hours of operation
-                    },
-                    "live_data": {
-                        "house_power"           : appliance_values["ENERGY"]["GUI_HOUSE_POW"],                      # House power consumption (W)
-                        "pv_production"         : appliance_values["ENERGY"]["GUI_INVERTER_POWER"],                 # PV production (W)
-                        "grid_power"            : appliance_values["ENERGY"]["GUI_GRID_POW"],                       # Grid power: negative if exporting, positiv if importing (W)
-                        "battery_charge_power"  : appliance_values["ENERGY"]["GUI_BAT_DATA_POWER"],                 # Battery charge power: negative if discharging, positiv if charging (W)
-                        "battery_charge_current": appliance_values["ENERGY"]["GUI_BAT_DATA_CURRENT"],               # Battery charge current: negative if discharging, positiv if charging (A)
-                        "battery_voltage"       : appliance_values["ENERGY"]["GUI_BAT_DATA_VOLTAGE"],               # Battery voltage (V)
-                        "battery_percentage"    : appliance_values["ENERGY"]["GUI_BAT_DATA_FUEL_CHARGE"],           # Remaining battery (percent)
-                        "force_charging_state"  : self.force_charging_state
-                    },
-                    "battery_information": {
-                        "design_capacity"       : appliance_values["FACTORY"]["DESIGN_CAPACITY"],                   # Battery design capacity (Wh)
-                        "max_charge_power"      : appliance_values["FACTORY"]["MAX_CHARGE_POWER_DC"],               # Battery max charging power (W)
-                        "max_discharge_power"   : appliance_values["FACTORY"]["MAX_DISCHARGE_POWER_DC"],            # Battery max discharging power (W)
-                        "cycles"                : appliance_values["BMS"]["CYCLES"],                                # List: Cycles per battery
-                        "charged_energy"        : appliance_values["BMS"]["CHARGED_ENERGY"],                        # List: Charged energy per battery
-                        "discharged_energy"     : appliance_values["BMS"]["DISCHARGED_ENERGY"]                      # List: Discharged energy per battery
-                    },
-                    #"statistics": {
-                    #    "timestamp"                 : appliance_values["STATISTIC"]["MEASURE_TIME"],                # Unix timestamp for above values (ms)
-                    #    "battery_charged_energy"    : appliance_values["STATISTIC"]["LIVE_BAT_CHARGE_MASTER"],      # Battery charge amount since installation (kWh)
-                    #    "battery_discharged_energy" : appliance_values["STATISTIC"]["LIVE_BAT_DISCHARGE_MASTER"],   # Battery discharge amount since installation (kWh)
-                    #    "grid_export"               : appliance_values["STATISTIC"]["LIVE_GRID_EXPORT"],            # Grid export amount since installation (kWh)
-                    #    "grid_import"               : appliance_values["STATISTIC"]["LIVE_GRID_IMPORT"],            # Grid import amount since installation (kWh)
-                    #    "house_consumption"         : appliance_values["STATISTIC"]["LIVE_HOUSE_CONS"],             # House consumption since installation (kWh)
-                    #    "pv_production"             : appliance_values["STATISTIC"]["LIVE_PV_GEN"]                  # PV generated power since installation (kWh)
-                    #}
-                }
-            except KeyError as e:
-                log.error(f"Failed parsing data from SENEC API: {e}")
+            return self.transform_appliance_values(appliance_values)
         else:
             return appliance_values
 
+    def transform_appliance_values(self, appliance_values):
+        """
+        Transform decoded senec data structure to our data structure. Returns None if values are missing.
+        """
+        try:
+            return {
+                "general": {
+                    #"current_state"         : appliance_values["STATISTIC"]["CURRENT_STATE"],                   # Current state of the system
+                    "hours_of_operation"    : appliance_values["ENERGY"]["STAT_HOURS_OF_OPERATION"]             # Appliance hours of operation
+                },
+                "live_data": {
+                    "house_power"           : appliance_values["ENERGY"]["GUI_HOUSE_POW"],                      # House power consumption (W)
+                    "pv_production"         : appliance_values["ENERGY"]["GUI_INVERTER_POWER"],                 # PV production (W)
+                    "grid_power"            : appliance_values["ENERGY"]["GUI_GRID_POW"],                       # Grid power: negative if exporting, positiv if importing (W)
+                    "battery_charge_power"  : appliance_values["ENERGY"]["GUI_BAT_DATA_POWER"],                 # Battery charge power: negative if discharging, positiv if charging (W)
+                    "battery_charge_current": appliance_values["ENERGY"]["GUI_BAT_DATA_CURRENT"],               # Battery charge current: negative if discharging, positiv if charging (A)
+                    "battery_voltage"       : appliance_values["ENERGY"]["GUI_BAT_DATA_VOLTAGE"],               # Battery voltage (V)
+                    "battery_percentage"    : appliance_values["ENERGY"]["GUI_BAT_DATA_FUEL_CHARGE"],           # Remaining battery (percent)
+                    "force_charging_state"  : self.force_charging_state
+                },
+                "battery_information": {
+                    "design_capacity"       : appliance_values["FACTORY"]["DESIGN_CAPACITY"],                   # Battery design capacity (Wh)
+                    "max_charge_power"      : appliance_values["FACTORY"]["MAX_CHARGE_POWER_DC"],               # Battery max charging power (W)
+                    "max_discharge_power"   : appliance_values["FACTORY"]["MAX_DISCHARGE_POWER_DC"],            # Battery max discharging power (W)
+                    "cycles"                : appliance_values["BMS"]["CYCLES"],                                # List: Cycles per battery
+                    "charged_energy"        : appliance_values["BMS"]["CHARGED_ENERGY"],                        # List: Charged energy per battery
+                    "discharged_energy"     : appliance_values["BMS"]["DISCHARGED_ENERGY"]                      # List: Discharged energy per battery
+                },
+                #"statistics": {
+                #    "timestamp"                 : appliance_values["STATISTIC"]["MEASURE_TIME"],                # Unix timestamp for above values (ms)
+                #    "battery_charged_energy"    : appliance_values["STATISTIC"]["LIVE_BAT_CHARGE_MASTER"],      # Battery charge amount since installation (kWh)
+                #    "battery_discharged_energy" : appliance_values["STATISTIC"]["LIVE_BAT_DISCHARGE_MASTER"],   # Battery discharge amount since installation (kWh)
+                #    "grid_export"               : appliance_values["STATISTIC"]["LIVE_GRID_EXPORT"],            # Grid export amount since installation (kWh)
+                #    "grid_import"               : appliance_values["STATISTIC"]["LIVE_GRID_IMPORT"],            # Grid import amount since installation (kWh)
+                #    "house_consumption"         : appliance_values["STATISTIC"]["LIVE_HOUSE_CONS"],             # House consumption since installation (kWh)
+                #    "pv_production"             : appliance_values["STATISTIC"]["LIVE_PV_GEN"]                  # PV generated power since installation (kWh)
+                #}
+            }
+        except KeyError as e:
+            log.error("Failed parsing data from SENEC API: %s", e)
+
     def __get_output_format(self, req):
         try:
             output_format = req.params['format']
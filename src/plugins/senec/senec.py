@@ -15,6 +15,8 @@ import struct
 import logging
 import json
 import urllib3
+
+from circuit_breaker import CircuitBreaker
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 __author__ = "Nicolas Inden"
@@ -26,24 +28,38 @@ __maintainer__ = "Nicolas Inden"
 __email__ = "nico@smashnet.de"
 __status__ = "Production"
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
 log = logging.getLogger("Senec")
 
 class Senec():
 
-    def __init__(self, device_ip):
+    def __init__(self, device_ip, capture=None):
         self.device_ip = device_ip
         self.read_api  = f"https://{device_ip}/lala.cgi"
+        self.capture   = capture # Optional capture_log.CaptureWriter for raw responses
+        self.timeout   = 5
+        self.breaker   = CircuitBreaker(f"senec:{device_ip}")
 
     def send_request(self, request_json = {}):
         if not request_json: request_json = BASIC_REQUEST
+        if not self.breaker.allow_request():
+            return {"error": f"{self.device_ip}: Senec box not reachable. Retrying in {self.breaker.get_state()['retry_in']} s."}
+        res = self.__send_request(request_json)
+        if "error" in res:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return res
+
+    def __send_request(self, request_json):
         try:
-            response = requests.post(self.read_api, json=request_json, verify=False)
+            response = requests.post(self.read_api, json=request_json, verify=False, timeout=self.timeout)
             if response.status_code == 200:
-                return self.__decode_data(response.json())
+                if self.capture:
+                    self.capture.append(f"senec:{self.device_ip}", response.content)
+                return self.decode_data(response.json())
                 #return self.__substitute_system_state(res)
             else:
-                log.warning(f"Status code {response.status_code}")
+                log.warning("Status code %s", response.status_code)
                 return {"error": f"Status code {response.status_code}"}
         except requests.Timeout:
             errmsg = f"{self.device_ip}: Timeout while accessing Senec box."
@@ -73,7 +89,7 @@ class Senec():
             request_json = {"ENERGY":{"SAFE_CHARGE_FORCE":"","SAFE_CHARGE_PROHIBIT":"u8_01","SAFE_CHARGE_RUNNING":"","LI_STORAGE_MODE_START":"","LI_STORAGE_MODE_STOP":"","LI_STORAGE_MODE_RUNNING":""}}
         return self.send_request(request_json)
 
-    def __decode_data(self, data):
+    def decode_data(self, data):
         return { k: self.__decode_data_helper(v) for k, v in data.items() }
 
     def __decode_data_helper(self, data):
@@ -102,7 +118,7 @@ class Senec():
         try:
             data['STATISTIC']['CURRENT_STATE'] = SYSTEM_STATE_NAME[system_state]
         except KeyError as e:
-            log.error(f"Failed substituting system state: {e}")
+            log.error("Failed substituting system state: %s", e)
             data['STATISTIC']['CURRENT_STATE'] = f"unknown ({system_state})"
         finally:
             return data
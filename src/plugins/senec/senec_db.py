@@ -3,14 +3,27 @@
 
 """
 Persistency layer for data from senec.py
+
+SenecDB is the one connection that writes, used by the runtime of the SENEC plugin.
+Queries from other threads (history for the Dashboard, endpoints) use the read-only
+connections of a SenecReadPool instead. The DB is in WAL mode, so readers neither
+block the recording nor wait for it.
+
+Today's statistics (get_todays...) are kept in a TodayStats shared by both: loaded by a
+query once per metric and day, then updated with every measurement SenecDB inserts.
 """
 
 import os
+import queue
 import sqlite3
 import logging
-from datetime import datetime, timedelta, timezone, date
+import pathlib
+import threading
+from datetime import datetime, timedelta, timezone, date, time
 import pytz
 
+from metrics import registry
+
 __author__ = "Nicolas Inden"
 __copyright__ = "Copyright 2021, Nicolas Inden"
 __credits__ = ["Nicolas Inden"]
@@ -20,18 +33,100 @@ __maintainer__ = "Nicolas Inden"
 __email__ = "nico@smashnet.de"
 __status__ = "Alpha"
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
 log = logging.getLogger("SenecDB")
 log.setLevel(logging.INFO)
 
-class SenecDB():
+registry.describe("senec_today_stats_requests_total", "counter", "Requests for today's statistics by result (hit or miss of the cache)")
+
+# Columns of the senec table that may be queried by name
+COLUMNS = ("stats_current_state", "stats_battery_charged_energy", "stats_battery_discharged_energy", "stats_grid_export",
+           "stats_grid_import", "stats_house_consumption", "stats_pv_production", "live_house_power", "live_pv_production",
+           "live_grid_power", "live_battery_charge_power", "live_battery_charge_current", "live_battery_voltage",
+           "live_battery_percentage")
+
+class SenecQueries():
+    """
+    Read queries of SenecDB and SenecReadPool. The SQL of every query is constant, only values
+    are parameters, so each connection prepares a statement once and keeps it in its cache.
+    """
+
+    def _query(self, sql, params=()):
+        """
+        All rows of the query.
+        """
+        raise NotImplementedError
+
+    def get_live_values_between_tss(self, ts1, ts2):
+        """
+        Rows of (ts, live_pv_production, live_house_power, live_grid_power, live_battery_charge_power) ordered by ts.
+        """
+        return self._query("""SELECT ts, live_pv_production, live_house_power, live_grid_power, live_battery_charge_power FROM senec 
+                              WHERE ts BETWEEN ? AND ? ORDER BY ts ASC""", (to_db_ts(ts1), to_db_ts(ts2)))
+
+    def get_max_val_between_tss(self, column, ts1, ts2):
+        return self.__get_aggregate("MAX", column, ts1, ts2)
+
+    def get_min_val_between_tss(self, column, ts1, ts2):
+        return self.__get_aggregate("MIN", column, ts1, ts2)
+
+    def get_avg_val_between_tss(self, column, ts1, ts2):
+        return self.__get_aggregate("AVG", column, ts1, ts2)
+
+    def __get_aggregate(self, function, column, ts1, ts2):
+        log.debug("SELECT %s(%s) FROM senec WHERE ts BETWEEN '%s' AND '%s'", function, column, ts1, ts2)
+        return self._query(f"SELECT {function}({check_column(column)}) FROM senec WHERE ts BETWEEN ? AND ?",
+                           (to_db_ts(ts1), to_db_ts(ts2)))[0][0]
 
-    def __init__(self, db_file):
+    def get_diff_val_between_tss(self, column, ts1, ts2):
+        """
+        Last minus first value of the column between ts1 and ts2, None if there are no values.
+        """
+        log.debug("%s, %s, %s", column, ts1, ts2)
+        column = check_column(column)
+        params = (to_db_ts(ts1), to_db_ts(ts2))
+        first = self._query(f"SELECT {column} FROM senec WHERE ts BETWEEN ? AND ? ORDER BY ts ASC LIMIT 1", params)
+        last = self._query(f"SELECT {column} FROM senec WHERE ts BETWEEN ? AND ? ORDER BY ts DESC LIMIT 1", params)
+        if not first or first[0][0] is None or last[0][0] is None:
+            return None
+        return last[0][0] - first[0][0]
+
+    def get_todays(self, metric, now=None):
+        """
+        Last minus first value of the metric today, e.g. energy from a counter.
+        """
+        return self.__get_today(metric, "diff", now)
+
+    def get_todays_max(self, metric, now=None):
+        return self.__get_today(metric, "max", now)
+
+    def get_todays_min(self, metric, now=None):
+        return self.__get_today(metric, "min", now)
+
+    def get_todays_avg(self, metric, now=None):
+        return self.__get_today(metric, "avg", now)
+
+    def __get_today(self, metric, aggregation, now):
+        if self.today_stats is not None:
+            return self.today_stats.get(self, metric, aggregation, now)
+        day = get_local_day(self.timezone, now or datetime.now(tz=timezone.utc))
+        return DayAggregate.load(self, metric, *get_day_range(self.timezone, day)).get(aggregation)
+
+    def get_energy_totals(self):
+        rows = self._query("""SELECT period, period_start, pv_production, house_consumption, grid_import, grid_export, 
+                              battery_charged, battery_discharged, wallbox FROM energy_totals""")
+        metrics = ("pv_production", "house_consumption", "grid_import", "grid_export", "battery_charged", "battery_discharged", "wallbox")
+        return [(row[0], row[1], dict(zip(metrics, row[2:]))) for row in rows]
+
+class SenecDB(SenecQueries):
+
+    def __init__(self, db_file, today_stats=None):
         self.db_path = os.path.dirname(db_file)
         self.db_filename = os.path.basename(db_file)
         self.db_full_path = db_file
-        self.db_version = "0.0.1"
+        self.db_version = "0.0.2"
         self.timezone = pytz.timezone("Europe/Berlin")
+        # Updated with every insert, see TodayStats
+        self.today_stats = today_stats
         
         # Ensure directories exist
         try:
@@ -42,19 +137,24 @@ class SenecDB():
         # Establish connection
         self.connection = sqlite3.connect(self.db_full_path)
         self.cursor = self.connection.cursor()
+        # Readers of a SenecReadPool neither block the recording nor wait for it. Kept in the DB file.
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, this loses at most the last commits on power loss, but never corrupts the DB
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
 
         # Check if DB exists and is correct version
         try:
             version = self.cursor.execute("SELECT version FROM db_info").fetchone()[0]
             if version == self.db_version:
-                log.debug(f"DB found and has correct version {version}. No migration needed :)")
+                log.debug("DB found and has correct version %s. No migration needed :)", version)
             else:
-                log.debug(f"Found DB, has version {version}. Target version is {self.db_version} ... migrating...")
+                log.debug("Found DB, has version %s. Target version is %s ... migrating...", version, self.db_version)
                 self.__migrate(version)
         except sqlite3.OperationalError:
             # db_info does not exist -> wrong or empty db_file
             log.debug("No not a valid DB file. Creating...")
             self.__init_tables_v0_0_1()
+            self.__migrate("0.0.1")
 
     def __init_tables_v0_0_1(self):
         self.cursor.execute("CREATE TABLE IF NOT EXISTS db_info (version TEXT)")
@@ -74,88 +174,276 @@ class SenecDB():
                                                     live_battery_charge_current FLOAT, 
                                                     live_battery_voltage FLOAT, 
                                                     live_battery_percentage FLOAT)""")
-        self.cursor.execute(f"INSERT INTO db_info VALUES ('{self.db_version}')")
+        self.cursor.execute("INSERT INTO db_info VALUES ('0.0.1')")
+        self.connection.commit()
+
+    def __init_tables_v0_0_2(self):
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS energy_totals (
+                                                    period TEXT PRIMARY KEY, 
+                                                    period_start TEXT, 
+                                                    updated TIMESTAMP, 
+                                                    pv_production FLOAT, 
+                                                    house_consumption FLOAT, 
+                                                    grid_import FLOAT, 
+                                                    grid_export FLOAT, 
+                                                    battery_charged FLOAT, 
+                                                    battery_discharged FLOAT, 
+                                                    wallbox FLOAT)""")
+        self.cursor.execute("UPDATE db_info SET version = '0.0.2'")
         self.connection.commit()
 
     def __migrate(self, from_version):
-        # TODO
-        log.error(f"Migration from DB version {from_version} to DB version {self.db_version} not yet implemented.")
+        migrations = {
+            "0.0.1": self.__init_tables_v0_0_2
+        }
+        version = from_version
+        while version != self.db_version:
+            try:
+                migrations[version]()
+            except KeyError:
+                log.error("Migration from DB version %s to DB version %s not yet implemented.", version, self.db_version)
+                return
+            version = self.cursor.execute("SELECT version FROM db_info").fetchone()[0]
+            log.debug("Migrated DB to version %s.", version)
 
     def close(self):
         self.cursor.close()
         self.connection.close()
 
     def insert_measurement(self, json):
-        self.cursor.execute("INSERT INTO senec VALUES (CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                                                        (json['general']['current_state'], 
-                                                        json['statistics']['battery_charged_energy'], 
-                                                        json['statistics']['battery_discharged_energy'], 
-                                                        json['statistics']['grid_export'], 
-                                                        json['statistics']['grid_import'], 
-                                                        json['statistics']['house_consumption'], 
-                                                        json['statistics']['pv_production'], 
-                                                        json['live_data']['house_power'], 
-                                                        json['live_data']['pv_production'], 
-                                                        json['live_data']['grid_power'], 
-                                                        json['live_data']['battery_charge_power'], 
-                                                        json['live_data']['battery_charge_current'], 
-                                                        json['live_data']['battery_voltage'], 
-                                                        json['live_data']['battery_percentage']))
-        self.connection.commit()
+        # Like CURRENT_TIMESTAMP, but today_stats needs to know it
+        self.insert_measurement_with_custom_ts(json, datetime.now(tz=timezone.utc).replace(tzinfo=None, microsecond=0))
 
     def insert_measurement_with_custom_ts(self, json, datetime_ts):
+        """
+        datetime_ts: UTC, naive or aware
+        """
+        values = self.__get_measurement_values(json)
         self.cursor.execute("INSERT INTO senec VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                                                        (datetime_ts,
-                                                        json['general']['current_state'], 
-                                                        json['statistics']['battery_charged_energy'], 
-                                                        json['statistics']['battery_discharged_energy'], 
-                                                        json['statistics']['grid_export'], 
-                                                        json['statistics']['grid_import'], 
-                                                        json['statistics']['house_consumption'], 
-                                                        json['statistics']['pv_production'], 
-                                                        json['live_data']['house_power'], 
-                                                        json['live_data']['pv_production'], 
-                                                        json['live_data']['grid_power'], 
-                                                        json['live_data']['battery_charge_power'], 
-                                                        json['live_data']['battery_charge_current'], 
-                                                        json['live_data']['battery_voltage'], 
-                                                        json['live_data']['battery_percentage']))
+                                                        (to_db_ts(datetime_ts), *values))
         self.connection.commit()
+        if self.today_stats is not None:
+            # After the commit, see TodayStats.get()
+            self.today_stats.add(self.cursor.lastrowid, datetime_ts, dict(zip(COLUMNS, values)))
 
-    def get_max_val_between_tss(self, column, ts1, ts2):
-        log.debug(f"SELECT MAX({column}) FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}'")
-        return self.cursor.execute(f"SELECT MAX({column}) FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}'").fetchone()[0]
+    def __get_measurement_values(self, json):
+        # Current state and statistics are not requested from the appliance at the moment
+        general = json.get('general', {})
+        statistics = json.get('statistics', {})
+        return (general.get('current_state'), 
+                statistics.get('battery_charged_energy'), 
+                statistics.get('battery_discharged_energy'), 
+                statistics.get('grid_export'), 
+                statistics.get('grid_import'), 
+                statistics.get('house_consumption'), 
+                statistics.get('pv_production'), 
+                json['live_data']['house_power'], 
+                json['live_data']['pv_production'], 
+                json['live_data']['grid_power'], 
+                json['live_data']['battery_charge_power'], 
+                json['live_data']['battery_charge_current'], 
+                json['live_data']['battery_voltage'], 
+                json['live_data']['battery_percentage'])
 
-    def get_min_val_between_tss(self, column, ts1, ts2):
-        log.debug(f"SELECT MIN({column}) FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}'")
-        return self.cursor.execute(f"SELECT MIN({column}) FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}'").fetchone()[0]
+    def _query(self, sql, params=()):
+        return self.cursor.execute(sql, params).fetchall()
 
-    def get_avg_val_between_tss(self, column, ts1, ts2):
-        log.debug(f"SELECT AVERAGE({column}) FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}'")
-        return self.cursor.execute(f"SELECT AVERAGE({column}) FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}'").fetchone()[0]
+    def save_energy_totals(self, checkpoint):
+        self.cursor.executemany("INSERT OR REPLACE INTO energy_totals VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?)",
+                                                        [(period, 
+                                                        period_start, 
+                                                        totals['pv_production'], 
+                                                        totals['house_consumption'], 
+                                                        totals['grid_import'], 
+                                                        totals['grid_export'], 
+                                                        totals['battery_charged'], 
+                                                        totals['battery_discharged'], 
+                                                        totals['wallbox']) for (period, period_start, totals) in checkpoint])
+        self.connection.commit()
 
-    def get_diff_val_between_tss(self, column, ts1, ts2):
-        log.debug(f"{column}, {ts1}, {ts2}")
-        val1 = self.cursor.execute(f"SELECT {column} FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}' ORDER BY ts ASC LIMIT 1").fetchone()[0]
-        val2 = self.cursor.execute(f"SELECT {column} FROM senec WHERE ts BETWEEN '{ts1.isoformat(sep=' ')}' AND '{ts2.isoformat(sep=' ')}' ORDER BY ts DESC LIMIT 1").fetchone()[0]
-        return val2-val1
-
-    def get_todays(self, metric):
-        today_zero = datetime.now(tz=self.timezone).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(tz=timezone.utc)
-        today_now = datetime.utcnow()
-        return self.get_diff_val_between_tss(metric, today_zero, today_now)
-
-    def get_todays_max(self, metric):
-        today_zero = datetime.now(tz=self.timezone).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(tz=timezone.utc)
-        today_now = datetime.utcnow()
-        return self.get_max_val_between_tss(metric, today_zero, today_now)
-
-    def get_todays_min(self, metric):
-        today_zero = datetime.now(tz=self.timezone).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(tz=timezone.utc)
-        today_now = datetime.utcnow()
-        return self.get_min_val_between_tss(metric, today_zero, today_now)
-
-    def get_todays_avg(self, metric):
-        today_zero = datetime.now(tz=self.timezone).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(tz=timezone.utc)
-        today_now = datetime.utcnow()
-        return self.get_avg_val_between_tss(metric, today_zero, today_now)
+class SenecReadPool(SenecQueries):
+    """
+    Read-only connections to the DB of a SenecDB, for queries from any thread.
+
+    size:       Connections at most, further queries wait for one to be free
+    mmap_size:  Bytes of the DB file each connection maps into memory
+    cache_size: Page cache of each connection (KiB)
+    """
+
+    def __init__(self, db_file, size=4, mmap_size=64 * 1024 * 1024, cache_size=8 * 1024, today_stats=None):
+        self.db_full_path = db_file
+        self.timezone = pytz.timezone("Europe/Berlin")
+        # Shared with the SenecDB that records, see TodayStats
+        self.today_stats = today_stats
+        self.mmap_size = int(mmap_size)
+        self.cache_size = int(cache_size)
+        self.slots = threading.BoundedSemaphore(size)
+        # Last used first, its cache is warm
+        self.idle = queue.LifoQueue()
+
+    def _query(self, sql, params=()):
+        with self.slots:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self.__connect()
+            try:
+                return connection.execute(sql, params).fetchall()
+            finally:
+                self.idle.put(connection)
+
+    def __connect(self):
+        # The DB must exist, it is created by SenecDB
+        uri = f"{pathlib.Path(self.db_full_path).absolute().as_uri()}?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        connection.execute(f"PRAGMA cache_size = {-self.cache_size}")
+        log.debug("Opened read-only connection to %s.", self.db_full_path)
+        return connection
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class DayAggregate():
+    """
+    Aggregations of the values of one metric on one day. rowid is the last row included.
+    """
+    __slots__ = ("rowid", "first", "last", "min", "max", "count", "sum")
+
+    def __init__(self, rowid=0, first=None, last=None, minimum=None, maximum=None, count=0, total=0.0):
+        self.rowid = rowid
+        self.first = first
+        self.last = last
+        self.min = minimum
+        self.max = maximum
+        self.count = count
+        self.sum = total
+
+    @classmethod
+    def load(cls, queries, column, start, end):
+        """
+        Aggregate of the rows from start (incl.) to end (excl.), with the queries of a SenecDB or SenecReadPool.
+        """
+        column = check_column(column)
+        params = (to_db_ts(start), to_db_ts(end))
+        # rowid first: rows inserted during the other queries are added again, which does not change first and last
+        ((rowid, minimum, maximum, count, total),) = queries._query(
+            f"SELECT MAX(rowid), MIN({column}), MAX({column}), COUNT({column}), TOTAL({column}) FROM senec WHERE ts >= ? AND ts < ?", params)
+        first = queries._query(
+            f"SELECT {column} FROM senec WHERE ts >= ? AND ts < ? AND {column} IS NOT NULL ORDER BY ts ASC, rowid ASC LIMIT 1", params)
+        last = queries._query(
+            f"SELECT {column} FROM senec WHERE ts >= ? AND ts < ? AND {column} IS NOT NULL ORDER BY ts DESC, rowid DESC LIMIT 1", params)
+        return cls(rowid or 0, first[0][0] if first else None, last[0][0] if last else None, minimum, maximum, count, total)
+
+    def add(self, rowid, value):
+        if rowid <= self.rowid:
+            # Already loaded with the rows of the DB
+            return
+        self.rowid = rowid
+        if value is None:
+            return
+        if self.count == 0:
+            (self.first, self.min, self.max) = (value, value, value)
+        self.last = value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.count += 1
+        self.sum += value
+
+    def get(self, aggregation):
+        """
+        "first", "last", "min", "max", "count", "sum", "avg" or "diff" (last - first), None without values.
+        """
+        if aggregation == "avg":
+            return self.sum / self.count if self.count else None
+        if aggregation == "diff":
+            return self.last - self.first if self.count else None
+        if aggregation not in self.__slots__ or aggregation == "rowid":
+            raise ValueError(f"Unknown aggregation {aggregation}")
+        return getattr(self, aggregation)
+
+class TodayStats():
+    """
+    Cache of today's aggregations per metric, for tiles that refresh every few seconds.
+
+    An entry is loaded by a query on first use and then updated by SenecDB.insert_measurement(),
+    so no request ranges over the rows of the day again. Days are local days of the timezone,
+    with 23 or 25 hours when the daylight saving time changes. Entries of past days are dropped.
+    """
+
+    def __init__(self, tz="Europe/Berlin"):
+        self.timezone = pytz.timezone(tz)
+        self.lock = threading.Lock()
+        self.entries = {} # (metric, day) -> DayAggregate
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, queries, metric, aggregation, now=None):
+        """
+        Aggregation of the metric today, see DayAggregate.get(). queries load missing entries.
+        """
+        day = get_local_day(self.timezone, now or datetime.now(tz=timezone.utc))
+        key = (check_column(metric), day)
+        # Loading under the lock: an insert committed meanwhile is either part of the loaded
+        # rows or added afterwards (see DayAggregate.add()), but never both or none
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                registry.inc("senec_today_stats_requests_total", result="miss")
+                self.entries = {entry_key: entry for entry_key, entry in self.entries.items() if entry_key[1] >= day}
+                entry = self.entries[key] = DayAggregate.load(queries, metric, *get_day_range(self.timezone, day))
+            else:
+                self.hits += 1
+                registry.inc("senec_today_stats_requests_total", result="hit")
+            return entry.get(aggregation)
+
+    def add(self, rowid, ts, values):
+        """
+        Row inserted at ts (UTC, naive or aware) with values by column, after it was committed.
+        """
+        day = get_local_day(self.timezone, ts)
+        with self.lock:
+            for (metric, entry_day), entry in self.entries.items():
+                if entry_day == day:
+                    entry.add(rowid, values.get(metric))
+
+    def get_hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else None
+
+def get_local_day(tz, ts):
+    """
+    Local date of ts (UTC, naive or aware).
+    """
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(tz).date()
+
+def get_day_range(tz, day):
+    """
+    (start, end) of the local day as aware datetimes in UTC.
+    """
+    start = tz.localize(datetime.combine(day, time()))
+    end = tz.localize(datetime.combine(day + timedelta(days=1), time()))
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+def check_column(column):
+    """
+    The column if it may be queried, column names can not be parameters.
+    """
+    if column not in COLUMNS:
+        raise ValueError(f"Unknown column {column}")
+    return column
+
+def to_db_ts(ts):
+    """
+    datetime (naive in UTC, or aware) to the UTC format of CURRENT_TIMESTAMP in the DB.
+    """
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts.isoformat(sep=' ')
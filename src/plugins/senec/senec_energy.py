@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Incremental energy counters for live power values from senec.py
+"""
+
+import logging
+from datetime import datetime
+import pytz
+
+__author__ = "Nicolas Inden"
+__copyright__ = "Copyright 2023, Nicolas Inden"
+__credits__ = ["Nicolas Inden"]
+__license__ = "Apache-2.0 License"
+__version__ = "1.0.0"
+__maintainer__ = "Nicolas Inden"
+__email__ = "nico@smashnet.de"
+__status__ = "Alpha"
+
+log = logging.getLogger("SenecEnergy")
+
+ENERGY_METRICS = (
+    "pv_production",        # PV production (Wh)
+    "house_consumption",    # House consumption incl. wallboxes (Wh)
+    "grid_import",          # Energy drawn from the grid (Wh)
+    "grid_export",          # Energy fed into the grid (Wh)
+    "battery_charged",      # Energy charged into the battery (Wh)
+    "battery_discharged",   # Energy discharged from the battery (Wh)
+    "wallbox"               # Energy charged by all wallboxes (Wh)
+)
+
+PERIODS = ("today", "month", "year")
+
+class EnergyCounters():
+    """
+    Integrates power samples (W) over time into energy totals (Wh) for the
+    current day, month and year using the trapezoidal rule.
+
+    Intervals longer than max_gap seconds (e.g. appliance unreachable) are
+    not integrated, as we cannot know what happened in between.
+    """
+
+    def __init__(self, max_gap=60, tz="Europe/Berlin"):
+        self.max_gap = max_gap
+        self.timezone = pytz.timezone(tz)
+        self.last_ts = None
+        self.last_powers = {}
+        self.period_keys = dict.fromkeys(PERIODS)
+        self.totals = {period: dict.fromkeys(ENERGY_METRICS, 0.0) for period in PERIODS}
+
+    @staticmethod
+    def split_powers(live_data, wallbox_power=0):
+        """
+        Map the live_data structure of the SENEC plugin to one non-negative power value per energy metric.
+        """
+        grid_power = live_data["grid_power"]
+        battery_power = live_data["battery_charge_power"]
+        return {
+            "pv_production"     : max(live_data["pv_production"], 0.0),
+            "house_consumption" : max(live_data["house_power"], 0.0),
+            "grid_import"       : max(grid_power, 0.0),
+            "grid_export"       : max(-grid_power, 0.0),
+            "battery_charged"   : max(battery_power, 0.0),
+            "battery_discharged": max(-battery_power, 0.0),
+            "wallbox"           : max(wallbox_power, 0.0)
+        }
+
+    def add_sample(self, ts, powers):
+        """
+        Add power values (W) measured at unix timestamp ts (s).
+        An interval that crosses local midnight is split there, each part is accounted to its own day,
+        with the power at midnight interpolated linearly.
+        """
+        if self.last_ts is not None and 0 < ts - self.last_ts <= self.max_gap:
+            midnight = self.__get_day_start(ts)
+            if self.last_ts < midnight:
+                share = (midnight - self.last_ts) / (ts - self.last_ts)
+                at_midnight = {metric: self.last_powers.get(metric, power) + (power - self.last_powers.get(metric, power)) * share
+                               for metric, power in powers.items()}
+                # Still the periods of the previous sample
+                self.__integrate(midnight, at_midnight)
+            self.__roll_periods(ts)
+            self.__integrate(ts, powers)
+        else:
+            self.__roll_periods(ts)
+            if self.last_ts is not None and ts - self.last_ts > self.max_gap:
+                log.debug("Gap of %.1f s between samples. Not integrating this interval.", ts - self.last_ts)
+            self.last_ts = ts
+            self.last_powers = powers
+
+    def __integrate(self, ts, powers):
+        hours = (ts - self.last_ts) / 3600.0
+        for metric, power in powers.items():
+            energy = (self.last_powers.get(metric, power) + power) / 2.0 * hours
+            for period in PERIODS:
+                self.totals[period][metric] += energy
+        self.last_ts = ts
+        self.last_powers = powers
+
+    def get_totals(self):
+        """
+        Current totals per period in kWh.
+        """
+        return {
+            period: {
+                "start": self.period_keys[period],
+                **{metric: round(energy / 1000.0, 3) for metric, energy in self.totals[period].items()}
+            } for period in PERIODS
+        }
+
+    def get_checkpoint(self):
+        """
+        Rows of (period, period_key, totals in Wh) to be persisted.
+        """
+        return [(period, self.period_keys[period], dict(self.totals[period])) for period in PERIODS if self.period_keys[period]]
+
+    def restore(self, ts, rows):
+        """
+        Restore totals from persisted rows of (period, period_key, totals in Wh).
+        Rows of periods that have already ended at unix timestamp ts are ignored.
+        Totals only grow within a period, so of several restored rows the highest value is kept.
+        """
+        self.__roll_periods(ts)
+        for period, period_key, totals in rows:
+            if period in self.period_keys and self.period_keys[period] == period_key:
+                current = self.totals[period]
+                current.update({metric: max(current[metric], totals[metric]) for metric in ENERGY_METRICS if totals.get(metric) is not None})
+                log.debug("Restored energy totals for %s (%s).", period, period_key)
+
+    def __get_day_start(self, ts):
+        local = datetime.fromtimestamp(ts, tz=self.timezone)
+        return self.timezone.localize(datetime(local.year, local.month, local.day)).timestamp()
+
+    def __roll_periods(self, ts):
+        local = datetime.fromtimestamp(ts, tz=self.timezone)
+        current_keys = {
+            "today": local.strftime("%Y-%m-%d"),
+            "month": local.strftime("%Y-%m"),
+            "year" : local.strftime("%Y")
+        }
+        for period, key in current_keys.items():
+            if self.period_keys[period] != key:
+                if self.period_keys[period] is not None:
+                    log.info("New period %s started. Resetting energy totals for %s.", key, period)
+                self.period_keys[period] = key
+                self.totals[period] = dict.fromkeys(ENERGY_METRICS, 0.0)
@@ -0,0 +1,130 @@
+"""
+Decide when to poll the SENEC appliance next.
+
+Polls fast while PV production or house consumption change quickly, or while a control
+decision depends on fresh data, and slowly while both are steady (e.g. at night).
+A token bucket limits the average number of requests to the appliance.
+"""
+import math
+import logging
+
+from metrics import registry
+
+log = logging.getLogger("SenecSampler")
+
+registry.describe("senec_sample_interval_seconds", "gauge", "Current target interval between two polls")
+registry.describe("senec_volatility_watts_per_second", "gauge", "Smoothed rate of change of PV production and house consumption")
+registry.describe("senec_requests_total", "counter", "Polls sent to the appliance")
+registry.describe("senec_request_budget_remaining", "gauge", "Requests that may still be sent without waiting (token bucket)")
+registry.describe("senec_requests_delayed_total", "counter", "Polls delayed because the request budget was used up")
+
+class TokenBucket():
+    """
+    rate tokens per second, at most capacity tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = None
+
+    def __refill(self, now):
+        if self.last is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def get_wait(self, now):
+        """
+        Seconds until a token is available.
+        """
+        self.__refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.__refill(now)
+        self.tokens -= 1
+
+class AdaptiveSampler():
+    """
+    min_interval:      Shortest interval between polls (s), what the appliance sustains
+    max_interval:      Longest interval between polls (s) while nothing changes
+    volatility_scale:  Rate of change (W/s) at which the interval is half of max_interval
+    deadband:          Changes up to this power (W) between two samples are noise
+    time_constant:     How long (s) a change keeps the rate up while the signal calms down again
+    budget:            Requests per minute on average
+    burst:             Requests that may be sent at min_interval before the budget applies
+    """
+
+    def __init__(self, name, min_interval=0.5, max_interval=10.0, volatility_scale=50.0, deadband=50.0, time_constant=30.0, budget=90, burst=20):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.volatility_scale = volatility_scale
+        self.deadband = deadband
+        self.time_constant = time_constant
+        self.bucket = TokenBucket(budget / 60.0, burst)
+        self.volatility = 0.0
+        self.last_sample = None   # (monotonic timestamp, pv_production, house_power)
+        self.last_request = None
+        self.urgent = set()       # Sources that need fresh data, see set_urgent()
+        self.boost_until = None
+        self.budget_limited = False
+
+    def add_sample(self, now, pv_production, house_power):
+        if self.last_sample is not None:
+            (last, last_pv, last_house) = self.last_sample
+            dt = now - last
+            if dt > 0:
+                change = max(abs(pv_production - last_pv), abs(house_power - last_house), self.deadband) - self.deadband
+                change /= dt
+                # Speed up at once, slow down gradually
+                alpha = 1 - math.exp(-dt / self.time_constant)
+                self.volatility = max(change, self.volatility + alpha * (change - self.volatility))
+        self.last_sample = (now, pv_production, house_power)
+        registry.set("senec_volatility_watts_per_second", round(self.volatility, 1), device=self.name)
+
+    def set_urgent(self, urgent, source=None):
+        """
+        Poll at min_interval until every source that asked for it called set_urgent(False).
+        """
+        if urgent != (source in self.urgent):
+            log.debug("%s: Urgent sampling %s for %s.", self.name, "on" if urgent else "off", source)
+        if urgent:
+            self.urgent.add(source)
+        else:
+            self.urgent.discard(source)
+
+    def boost(self, now, seconds):
+        """
+        Poll at min_interval for some seconds, e.g. after a command changed the consumption.
+        """
+        self.boost_until = max(self.boost_until or now, now + seconds)
+
+    def get_interval(self, now):
+        if self.urgent or (self.boost_until is not None and now < self.boost_until):
+            return self.min_interval
+        interval = self.max_interval / (1 + self.volatility / self.volatility_scale)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def get_wait(self, now):
+        """
+        Seconds to wait before the next poll, 0 if it is due.
+        """
+        interval = self.get_interval(now)
+        registry.set("senec_sample_interval_seconds", round(interval, 3), device=self.name)
+        wait = 0.0 if self.last_request is None else self.last_request + interval - now
+        budget_wait = self.bucket.get_wait(now)
+        self.budget_limited = budget_wait > 0 and budget_wait > wait
+        return max(wait, budget_wait, 0.0)
+
+    def take(self, now):
+        """
+        Call right before polling.
+        """
+        self.bucket.take(now)
+        self.last_request = now
+        registry.inc("senec_requests_total", device=self.name)
+        if self.budget_limited:
+            registry.inc("senec_requests_delayed_total", device=self.name)
+        registry.set("senec_request_budget_remaining", round(self.bucket.tokens, 1), device=self.name)
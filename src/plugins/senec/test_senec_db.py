@@ -6,11 +6,13 @@ Tests for persistency layer for data from senec.py
 """
 
 import os
+import sqlite3
 import logging
+import threading
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-from .senec_db import SenecDB
+from .senec_db import SenecDB, SenecReadPool, TodayStats
 
 logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
 log = logging.getLogger("SenecDB-Tests")
@@ -45,6 +47,124 @@ class TestSenecDBMethods(unittest.TestCase):
             300.0,
             'Max val between tss not as expected')
 
+    def test_energy_totals_are_persisted(self) -> None:
+        # Arrange
+        checkpoint = [("today", "2021-04-22", {"pv_production": 1200.0, "house_consumption": 800.0, "grid_import": 0.0,
+                                               "grid_export": 400.0, "battery_charged": 0.0, "battery_discharged": 0.0, "wallbox": 0.0})]
+
+        # Act
+        self.db.save_energy_totals(checkpoint)
+        self.db.save_energy_totals(checkpoint)
+
+        # Assert
+        self.assertEqual(self.db.get_energy_totals(), checkpoint, 'Energy totals not as expected')
+
+class TestSenecReadPool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = SenecDB(db_file)
+        self.pool = SenecReadPool(db_file, size=2)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.db.close()
+        os.remove(db_file)
+
+    def test_readers_query_while_recording(self) -> None:
+        # Arrange
+        start = datetime.fromisoformat("2021-04-22 12:00:00")
+        (begin, end) = (start - timedelta(minutes=1), start + timedelta(hours=1))
+        m = Measurement()
+        results = []
+
+        def read():
+            for _ in range(50):
+                results.append(self.pool.get_max_val_between_tss("live_pv_production", begin, end))
+
+        # Act: Recording in this thread, querying in four others with two connections
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for n in range(200):
+            m.setLivePVProduction(float(n))
+            self.db.insert_measurement_with_custom_ts(m.getData(), start + timedelta(seconds=n))
+        for reader in readers:
+            reader.join()
+
+        # Assert
+        self.assertEqual(len(results), 200)
+        self.assertTrue(all(result is None or 0.0 <= result <= 199.0 for result in results))
+        self.assertEqual(self.pool.get_max_val_between_tss("live_pv_production", begin, end), 199.0)
+        self.assertEqual(self.pool.get_avg_val_between_tss("live_pv_production", begin, end), 99.5)
+        self.assertEqual(self.pool.get_diff_val_between_tss("live_pv_production", begin, end), 199.0)
+        self.assertLessEqual(self.pool.idle.qsize(), 2)
+        with self.assertRaises(sqlite3.OperationalError):
+            self.pool._query("DELETE FROM senec")
+
+    def test_only_known_columns_can_be_queried(self) -> None:
+        # Arrange
+        ts = datetime.fromisoformat("2021-04-22 12:00:00")
+
+        # Act / Assert
+        with self.assertRaises(ValueError):
+            self.pool.get_max_val_between_tss("live_pv_production) FROM senec; --", ts, ts)
+        self.assertIsNone(self.pool.get_diff_val_between_tss("live_pv_production", ts, ts))
+
+class TestTodayStats(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.stats = TodayStats()
+        self.db = SenecDB(db_file, self.stats)
+        self.pool = SenecReadPool(db_file, size=1, today_stats=self.stats)
+        self.m = Measurement()
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.db.close()
+        os.remove(db_file)
+
+    def insert(self, ts, pv_production):
+        self.m.setLivePVProduction(pv_production)
+        self.db.insert_measurement_with_custom_ts(self.m.getData(), datetime.fromisoformat(ts))
+
+    def test_cache_is_updated_with_inserts(self) -> None:
+        # Arrange
+        now = datetime(2021, 4, 22, 12, 0, tzinfo=timezone.utc)
+        self.insert("2021-04-22 08:00:00", 100.0)
+        self.insert("2021-04-22 09:00:00", 300.0)
+        self.assertEqual(self.pool.get_todays_max("live_pv_production", now), 300.0)
+
+        # Act
+        self.insert("2021-04-22 10:00:00", 500.0)
+        self.insert("2021-04-22 11:00:00", 50.0)
+        self.insert("2021-04-21 12:00:00", 900.0)
+
+        # Assert: One query, answered from the cache since
+        self.assertEqual(self.pool.get_todays_max("live_pv_production", now), 500.0)
+        self.assertEqual(self.pool.get_todays_min("live_pv_production", now), 50.0)
+        self.assertEqual(self.pool.get_todays_avg("live_pv_production", now), 237.5)
+        self.assertEqual(self.pool.get_todays("live_pv_production", now), -50.0)
+        self.assertEqual((self.stats.hits, self.stats.misses), (4, 1))
+        self.assertEqual(self.stats.get_hit_rate(), 0.8)
+        self.assertIsNone(self.pool.get_todays_max("live_pv_production", now + timedelta(days=1)))
+
+    def test_days_are_local_days_with_daylight_saving_time(self) -> None:
+        # Arrange: 2021-03-28 has 23 hours in Berlin, from 23:00 to 22:00 UTC
+        self.insert("2021-03-27 22:59:59", 1.0)
+        self.insert("2021-03-27 23:00:00", 2.0)
+        self.insert("2021-03-28 21:59:59", 3.0)
+        self.insert("2021-03-28 22:00:00", 4.0)
+
+        # Act
+        day = self.pool.get_todays_avg("live_pv_production", datetime(2021, 3, 28, 12, 0, tzinfo=timezone.utc))
+        self.insert("2021-03-28 22:30:00", 6.0)
+        next_day = self.pool.get_todays_avg("live_pv_production", datetime(2021, 3, 28, 23, 0, tzinfo=timezone.utc))
+
+        # Assert: The entry of the past day is dropped on rollover
+        self.assertEqual((day, next_day), (2.5, 5.0))
+        self.assertEqual([key[1].isoformat() for key in self.stats.entries], ["2021-03-29"])
+        self.assertEqual(self.db.get_todays_avg("live_pv_production", datetime(2021, 3, 28, 12, 0, tzinfo=timezone.utc)), 2.5)
+
 class Measurement():
 
     def __init__(self) -> None:
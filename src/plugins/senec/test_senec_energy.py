@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for incremental energy counters
+"""
+
+import logging
+import unittest
+from datetime import datetime
+import pytz
+
+from .senec_energy import EnergyCounters
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("SenecEnergy-Tests")
+berlin = pytz.timezone("Europe/Berlin")
+
+def ts(iso):
+    return berlin.localize(datetime.fromisoformat(iso)).timestamp()
+
+class TestEnergyCounters(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.counters = EnergyCounters(max_gap=60)
+
+    def test_trapezoidal_integration(self) -> None:
+        # Arrange
+        start = ts("2023-06-01 12:00:00")
+
+        # Act: 1000 W -> 3000 W over one hour in 30 s steps
+        for i in range(121):
+            self.counters.add_sample(start + i * 30, {"pv_production": 1000.0 + i * (2000.0 / 120)})
+
+        # Assert: (1000 W + 3000 W) / 2 * 1 h = 2 kWh
+        self.assertAlmostEqual(self.counters.get_totals()["today"]["pv_production"], 2.0, places=3)
+
+    def test_gaps_are_not_integrated(self) -> None:
+        # Arrange
+        start = ts("2023-06-01 12:00:00")
+
+        # Act
+        self.counters.add_sample(start, {"pv_production": 3600.0})
+        self.counters.add_sample(start + 10, {"pv_production": 3600.0})
+        self.counters.add_sample(start + 610, {"pv_production": 3600.0})
+
+        # Assert: only the first 10 s are counted
+        self.assertAlmostEqual(self.counters.get_totals()["today"]["pv_production"], 0.01, places=3)
+
+    def test_day_rollover_keeps_month_and_year(self) -> None:
+        # Arrange
+        powers = EnergyCounters.split_powers({"pv_production": 0.0, "house_power": 3600.0, "grid_power": -3600.0, "battery_charge_power": 0.0})
+
+        # Act
+        self.counters.add_sample(ts("2023-06-01 23:59:30"), powers)
+        self.counters.add_sample(ts("2023-06-01 23:59:50"), powers)
+        self.counters.add_sample(ts("2023-06-02 00:00:10"), powers)
+        totals = self.counters.get_totals()
+
+        # Assert: The 10 s after midnight count for the new day
+        self.assertEqual(totals["today"]["start"], "2023-06-02")
+        self.assertAlmostEqual(totals["today"]["grid_export"], 0.01, places=3)
+        self.assertAlmostEqual(totals["month"]["grid_export"], 0.04, places=3)
+        self.assertAlmostEqual(totals["year"]["house_consumption"], 0.04, places=3)
+        self.assertEqual(totals["year"]["grid_import"], 0.0)
+
+    def test_interval_is_split_at_new_year(self) -> None:
+        # Arrange: 1000 W before, 3000 W after midnight
+        self.counters.add_sample(ts("2023-12-31 23:59:30"), {"pv_production": 1000.0})
+        self.counters.add_sample(ts("2023-12-31 23:59:45"), {"pv_production": 1000.0})
+
+        # Act
+        self.counters.add_sample(ts("2024-01-01 00:00:15"), {"pv_production": 3000.0})
+        totals = self.counters.get_totals()
+
+        # Assert: 2000 W at midnight, only the 15 s at 2000-3000 W after it count for the new year
+        self.assertEqual(totals["year"]["start"], "2024")
+        self.assertAlmostEqual(self.counters.totals["year"]["pv_production"], 2500.0 * 15 / 3600)
+        self.assertAlmostEqual(self.counters.totals["month"]["pv_production"], 2500.0 * 15 / 3600)
+
+    def test_restore_ignores_finished_periods(self) -> None:
+        # Arrange
+        rows = [("today", "2023-06-01", {"pv_production": 5000.0}), ("month", "2023-06", {"pv_production": 90000.0})]
+
+        # Act
+        self.counters.restore(ts("2023-06-02 08:00:00"), rows)
+        totals = self.counters.get_totals()
+
+        # Assert
+        self.assertEqual(totals["today"]["pv_production"], 0.0)
+        self.assertEqual(totals["month"]["pv_production"], 90.0)
+
+if __name__ == '__main__':
+    unittest.main()
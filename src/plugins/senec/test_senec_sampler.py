@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the adaptive polling interval of the SENEC appliance
+"""
+
+import logging
+import unittest
+
+from .senec_sampler import AdaptiveSampler
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("SenecSampler-Tests")
+
+class TestAdaptiveSampler(unittest.TestCase):
+
+    def poll(self, sampler, now, pv_production, house_power):
+        """
+        Wait as told, then poll. Returns the time of the poll.
+        """
+        now += sampler.get_wait(now)
+        sampler.take(now)
+        sampler.add_sample(now, pv_production, house_power)
+        return now
+
+    def test_interval_follows_volatility(self) -> None:
+        # Arrange
+        sampler = AdaptiveSampler("test", min_interval=0.5, max_interval=10, volatility_scale=50, deadband=50, time_constant=30, budget=600, burst=100)
+        now = 0.0
+
+        # Act
+        for _ in range(5):
+            now = self.poll(sampler, now, 0, 400 + 20 * (_ % 2))
+        steady = sampler.get_interval(now)
+        now = self.poll(sampler, now, 4000, 400)
+        cloud = sampler.get_interval(now)
+        for _ in range(60):
+            now = self.poll(sampler, now, 4000, 400)
+        calm = sampler.get_interval(now)
+
+        # Assert
+        self.assertEqual(steady, 10)
+        self.assertLess(cloud, 2)
+        self.assertGreater(calm, 5)
+
+    def test_urgent_and_boost_use_min_interval(self) -> None:
+        # Arrange
+        sampler = AdaptiveSampler("test", min_interval=0.5, max_interval=10)
+        self.poll(sampler, 0.0, 0, 400)
+
+        # Act
+        sampler.boost(1.0, 30)
+        boosted = sampler.get_interval(10.0)
+        after_boost = sampler.get_interval(31.0)
+        sampler.set_urgent(True)
+        urgent = sampler.get_interval(100.0)
+
+        # Assert
+        self.assertEqual(boosted, 0.5)
+        self.assertEqual(after_boost, 10)
+        self.assertEqual(urgent, 0.5)
+
+    def test_budget_limits_requests(self) -> None:
+        # Arrange
+        sampler = AdaptiveSampler("test", min_interval=0.5, max_interval=10, budget=60, burst=5)
+        sampler.set_urgent(True)
+        now = 0.0
+
+        # Act
+        polls = []
+        while now < 60:
+            now = self.poll(sampler, now, 0, 400)
+            polls.append(now)
+
+        # Assert
+        # 5 at once (every 0.5 s), then one per second
+        self.assertEqual(polls[4] - polls[0], 2.0)
+        self.assertAlmostEqual(polls[20] - polls[19], 1.0, places=6)
+        self.assertLessEqual(len(polls), 5 + 60 + 1)
+
+if __name__ == '__main__':
+    unittest.main()
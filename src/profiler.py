@@ -0,0 +1,131 @@
+"""
+Sampling profiler for the running server.
+
+Samples the stacks of all threads (plugin runtimes, request handlers) in regular
+intervals for a limited time. Nothing runs unless a session is started, so there is
+no overhead otherwise. Results:
+    collapsed ... One line per stack "thread;outer;...;inner count", input for flame graph tools
+    top       ... Functions by samples on top of the stack (self) and anywhere in the stack (total)
+    memory    ... Lines with the most memory allocated during the session (tracemalloc)
+"""
+import os
+import sys
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+log = logging.getLogger("Profiler")
+
+class ProfilerBusy(Exception):
+    pass
+
+class SamplingProfiler():
+
+    def __init__(self, max_duration=60.0):
+        self.max_duration = max_duration
+        self.lock = threading.Lock()
+
+    def profile(self, duration=10.0, interval=0.01, trace_memory=True):
+        """
+        Sample for duration seconds, blocks until done. Raises ProfilerBusy if another session is running.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy("Another profiling session is running.")
+        try:
+            duration = min(max(duration, interval), self.max_duration)
+            log.info("Profiling for %.1f s.", duration)
+            started_tracing = trace_memory and not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            try:
+                memory_before = tracemalloc.take_snapshot() if trace_memory else None
+                (stacks, samples) = self.__sample(duration, interval)
+                memory = None
+                if trace_memory:
+                    memory = tracemalloc.take_snapshot().compare_to(memory_before, "lineno")
+            finally:
+                # Tracing slows down every allocation, it must not outlive the session
+                if started_tracing:
+                    tracemalloc.stop()
+            return ProfileResult(stacks, samples, duration, interval, memory)
+        finally:
+            self.lock.release()
+
+    def __sample(self, duration, interval):
+        stacks = Counter()
+        samples = 0
+        own_ident = threading.get_ident()
+        labels = {}
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    if code not in labels:
+                        labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+                    stack.append(labels[code])
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)).replace(";", ":"))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples
+
+class ProfileResult():
+
+    def __init__(self, stacks, samples, duration, interval, memory):
+        self.stacks = stacks    # (thread, outermost, ..., innermost) -> samples
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+        self.memory = memory    # List of tracemalloc.StatisticDiff or None
+
+    def get_collapsed(self):
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def get_top(self, limit=30):
+        """
+        [(function, self samples, total samples)], by self samples.
+        """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack[1:]):
+                total[function] += count
+        return [(function, count, total[function]) for function, count in own.most_common(limit)]
+
+    def get_memory(self, limit=20):
+        """
+        [(file:line, size difference in bytes, count difference)], by size difference.
+        """
+        if self.memory is None:
+            return []
+        return [(str(stat.traceback[0]), stat.size_diff, stat.count_diff) for stat in self.memory[:limit]]
+
+    def get_report(self):
+        lines = [f"Profiled {self.duration:.1f} s, {self.samples} samples every {self.interval * 1000:.0f} ms", "",
+                 f"{'self':>8} {'total':>8}  function"]
+        for (function, own, total) in self.get_top():
+            lines.append(f"{own:>8} {total:>8}  {function}")
+        if self.memory is not None:
+            lines += ["", f"{'bytes':>10} {'blocks':>8}  allocated at"]
+            for (where, size, count) in self.get_memory():
+                lines.append(f"{size:>10} {count:>8}  {where}")
+        return "\n".join(lines) + "\n"
+
+    def get_dict(self):
+        return {
+            "duration": self.duration,
+            "samples": self.samples,
+            "interval": self.interval,
+            "top": [{"function": function, "self": own, "total": total} for (function, own, total) in self.get_top()],
+            "collapsed": {";".join(stack): count for stack, count in self.stacks.most_common()},
+            "memory": [{"where": where, "size_diff": size, "count_diff": count} for (where, size, count) in self.get_memory()]
+        }
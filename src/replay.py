@@ -0,0 +1,260 @@
+"""
+Replay recorded data through the automatic charging of the Dashboard plugin,
+as fast as possible instead of in real time.
+
+Data can be taken from SenecDB, from capture logs of raw device responses (see
+capture_log.py) or from files with Dashboard JSON snapshots.
+
+Recorded PV production and house consumption are taken as they were. The wallboxes
+are simulated: they charge with the current the Dashboard commands, as long as a car
+is connected. So the effect of other settings or charging logic on the same days can
+be compared.
+
+Usage (from src/):
+    python3 replay.py --db data/senec/senec.sqlite --day 2023-06-01 --day 2023-06-02
+    python3 replay.py --capture data/capture.log --settings config/settings.json --workers 4 --events
+    python3 replay.py --capture dashboard.jsonl
+"""
+import sys
+import json
+import argparse
+import logging
+import importlib
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import pytz
+
+import log_config
+import capture_log
+from capture_log import CaptureReader
+from plugins.senec.senec import Senec
+from plugins.senec.senec_db import SenecDB
+from plugins.senec.plugin import SenecHomeV3Hybrid
+from plugins.dashboard.plugin import Dashboard
+
+log = logging.getLogger("Replay")
+
+NO_CAR_CONNECTED = "Wallbox ready, no car connected"
+
+class SimulatedWallbox():
+
+    def __init__(self, voltage=230):
+        self.voltage = voltage
+        self.allow_charging = 0
+        self.max_ampere = 6
+        self.connected = True
+        self.phases = 3
+
+    def get_power(self):
+        if self.allow_charging and self.connected:
+            return self.max_ampere * self.voltage * self.phases
+        return 0
+
+    def get_data(self):
+        power = self.get_power()
+        return {
+            "charging": {
+                "current_power": power,
+                "pha_used"     : self.phases if power else 0,
+                "pha_available": self.phases
+            }
+        }
+
+def replay_day(samples, settings, automation):
+    """
+    Replay the samples of one day.
+
+    samples:    List of (unix timestamp, pv_production, base_load, wallboxes) where base_load
+                is the house consumption without wallboxes and wallboxes is a tuple of
+                (car connected, phases) per wallbox.
+    settings:   Settings of the Dashboard plugin
+    automation: Dict of the Dashboard flags, e.g. {"sunChargingParking": True}
+
+    Returns a dict with energy figures (Wh) and the list of switching events.
+    """
+    dashboard = Dashboard()
+    dashboard.apply_settings({"Dashboard": settings})
+    for flag, value in automation.items():
+        setattr(dashboard, flag, value)
+    wallboxes = [SimulatedWallbox(dashboard.settings['voltage']), SimulatedWallbox(dashboard.settings['voltage'])]
+    result = {"samples": 0, "pv_energy": 0.0, "export_energy": 0.0, "import_energy": 0.0,
+              "wallbox_energy": 0.0, "wallbox_pv_energy": 0.0, "switches": 0, "events": []}
+    last_ts = None
+    for (ts, pv_production, base_load, cars) in samples:
+        for wallbox, (connected, phases) in zip(wallboxes, cars):
+            wallbox.connected = connected
+            wallbox.phases = phases
+        wallbox_power = sum(wallbox.get_power() for wallbox in wallboxes)
+        data = {
+            "house": {"live_data": {"pv_production": pv_production, "house_power": base_load + wallbox_power}},
+            "wallbox1": wallboxes[0].get_data(),
+            "wallbox2": wallboxes[1].get_data()
+        }
+        for (device_no, key, value) in dashboard.control(ts, data):
+            if key == "allow_charging" and value != wallboxes[device_no].allow_charging:
+                result["switches"] += 1
+            setattr(wallboxes[device_no], key, value)
+            result["events"].append((ts, device_no, key, value))
+        if last_ts is not None:
+            hours = (ts - last_ts) / 3600.0
+            balance = pv_production - base_load - wallbox_power
+            result["pv_energy"] += pv_production * hours
+            result["export_energy"] += max(balance, 0.0) * hours
+            result["import_energy"] += max(-balance, 0.0) * hours
+            result["wallbox_energy"] += wallbox_power * hours
+            result["wallbox_pv_energy"] += min(wallbox_power, max(pv_production - base_load, 0.0)) * hours
+        result["samples"] += 1
+        last_ts = ts
+    return result
+
+def replay_days(days, settings, automation, workers=1):
+    """
+    Replay a list of days (lists of samples), optionally spread across a process pool.
+    The automatic charging starts over with each day.
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(replay_day, days, repeat(settings), repeat(automation)))
+    return [replay_day(samples, settings, automation) for samples in days]
+
+def summarize(results):
+    total = {key: sum(result[key] for result in results) for key in results[0] if key != "events"}
+    total["self_consumption"] = 1 - total["export_energy"] / total["pv_energy"] if total["pv_energy"] else 0.0
+    total["wallbox_pv_share"] = total["wallbox_pv_energy"] / total["wallbox_energy"] if total["wallbox_energy"] else 0.0
+    return total
+
+def load_senec_db_day(db_file, day, cars=((True, 3), (False, 3)), tz="Europe/Berlin"):
+    """
+    Samples of one local day (YYYY-MM-DD) recorded in a SenecDB file.
+    There is no recorded wallbox data, so it is assumed that the house consumption
+    does not contain any charging and the cars are connected as given.
+    """
+    local_zero = pytz.timezone(tz).localize(datetime.fromisoformat(day))
+    start = local_zero.astimezone(timezone.utc).replace(tzinfo=None)
+    db = SenecDB(db_file)
+    try:
+        rows = db.get_live_values_between_tss(start, start + timedelta(days=1))
+    finally:
+        db.close()
+    return [(datetime.fromisoformat(row[0]).replace(tzinfo=timezone.utc).timestamp(), row[1], row[2], cars)
+            for row in rows if row[1] is not None and row[2] is not None]
+
+def load_capture_file(path, tz="Europe/Berlin"):
+    """
+    Samples from a capture log as written with "capture_file" in the common settings (see
+    load_capture_log()), or from a file with one JSON snapshot of the Dashboard plugin
+    (/dashboard?format=json) per line, with an additional key "ts" (unix timestamp).
+    Returns one list of samples per local day.
+    """
+    with open(path, 'rb') as capture_file:
+        is_capture_log = capture_file.read(len(capture_log.MAGIC)) == capture_log.MAGIC
+    if is_capture_log:
+        return load_capture_log(path, tz)
+    timezone_local = pytz.timezone(tz)
+    days = {}
+    skipped = 0
+    with open(path, 'r') as capture_file:
+        for line in capture_file:
+            if not line.strip():
+                continue
+            sample = get_sample_from_snapshot(json.loads(line))
+            if sample:
+                day = datetime.fromtimestamp(sample[0], tz=timezone_local).date()
+                days.setdefault(day, []).append(sample)
+            else:
+                skipped += 1
+    if skipped:
+        log.warning("Skipped %s snapshots without ts or house and wallbox data in %s.", skipped, path)
+    return [days[day] for day in sorted(days)]
+
+def load_capture_log(path, tz="Europe/Berlin"):
+    """
+    Samples from a capture log of raw device responses. Each SENEC response makes one sample,
+    together with the last responses of the wallboxes (in order of their first appearance).
+    Returns one list of samples per local day.
+    """
+    goe = importlib.import_module("plugins.go-echarger.go-echarger")
+    goe_api = importlib.import_module("plugins.go-echarger.goe_api")
+    senec = Senec("replay")
+    senec_plugin = SenecHomeV3Hybrid()
+    no_wallbox = {"charging": {"current_power": 0, "pha_available": 3, "status": NO_CAR_CONNECTED}}
+    timezone_local = pytz.timezone(tz)
+    wallboxes = {}
+    wallbox_apis = {} # Merges partial statuses of API v2
+    days = {}
+    with CaptureReader(path) as reader:
+        for record in reader:
+            try:
+                if record.source.startswith("goe:"):
+                    device = wallboxes.setdefault(record.source, goe.goeDevice(record.source, record.source[4:]))
+                    device.updateData(json.loads(record.payload))
+                    continue
+                if record.source.startswith("goe-v2:"):
+                    ip = record.source[7:]
+                    status = wallbox_apis.setdefault(ip, goe_api.GoeApiV2(ip)).merge(json.loads(record.payload))
+                    wallboxes.setdefault(record.source, goe.goeDevice(record.source, ip)).updateData(status)
+                    continue
+                if not record.source.startswith("senec:"):
+                    continue
+                house = senec_plugin.transform_appliance_values(senec.decode_data(json.loads(record.payload)))
+            except (ValueError, KeyError) as e:
+                log.warning("Skipping unreadable %s record at %s: %s", record.source, record.wall_ts, e)
+                continue
+            wallbox_data = [device.data for device in wallboxes.values()] + [no_wallbox, no_wallbox]
+            sample = get_sample_from_snapshot({"ts": record.wall_ts, "house": house, "wallbox1": wallbox_data[0], "wallbox2": wallbox_data[1]})
+            if sample:
+                day = datetime.fromtimestamp(sample[0], tz=timezone_local).date()
+                days.setdefault(day, []).append(sample)
+    return [days[day] for day in sorted(days)]
+
+def get_sample_from_snapshot(snapshot):
+    try:
+        live_data = snapshot["house"]["live_data"]
+        wallboxes = [snapshot["wallbox1"], snapshot["wallbox2"]]
+        wallbox_power = sum(wallbox["charging"]["current_power"] for wallbox in wallboxes)
+        cars = tuple((wallbox["charging"]["status"] != NO_CAR_CONNECTED, wallbox["charging"]["pha_available"] or 3) for wallbox in wallboxes)
+        return (snapshot["ts"], live_data["pv_production"], live_data["house_power"] - wallbox_power, cars)
+    except (KeyError, TypeError):
+        return None
+
+def print_report(results, events=False):
+    for result in results:
+        if events:
+            for (ts, device_no, key, value) in result["events"]:
+                print(f"{datetime.fromtimestamp(ts).isoformat(sep=' ')}  wallbox {device_no}  {key}={value}")
+    total = summarize(results)
+    print(f"days: {len(results)}   samples: {total['samples']}   switches: {total['switches']}")
+    print(f"pv: {total['pv_energy'] / 1000.0:.1f} kWh   export: {total['export_energy'] / 1000.0:.1f} kWh   "
+          f"import: {total['import_energy'] / 1000.0:.1f} kWh   self_consumption: {total['self_consumption']:.1%}")
+    print(f"wallbox: {total['wallbox_energy'] / 1000.0:.1f} kWh   wallbox_pv_share: {total['wallbox_pv_share']:.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded data through the automatic charging.")
+    parser.add_argument("--db", help="SenecDB file with recorded measurements")
+    parser.add_argument("--day", action="append", default=[], help="Local day (YYYY-MM-DD) to replay from --db, can be repeated")
+    parser.add_argument("--capture", help="Capture log of raw device responses, or file with one Dashboard JSON snapshot per line")
+    parser.add_argument("--settings", help="settings.json to take the Dashboard settings from")
+    parser.add_argument("--workers", type=int, default=1, help="Replay days in parallel in this many processes")
+    parser.add_argument("--events", action="store_true", help="Print every command sent to a wallbox")
+    args = parser.parse_args()
+
+    # Keep the replay quiet
+    log_config.setup(logging.WARNING)
+
+    if args.capture:
+        days = load_capture_file(args.capture)
+    elif args.db and args.day:
+        days = [load_senec_db_day(args.db, day) for day in args.day]
+    else:
+        parser.error("Either --capture or --db and --day is required.")
+    if not days:
+        sys.exit("Nothing to replay.")
+
+    settings = {}
+    if args.settings:
+        with open(args.settings, 'r') as settings_file:
+            settings = json.load(settings_file).get("Dashboard", {})
+    automation = {"sunChargingParking": True, "sunChargingGarage": True}
+
+    print_report(replay_days(days, settings, automation, args.workers), args.events)
@@ -0,0 +1,125 @@
+"""
+Serialized snapshots shared between processes through a memory mapped file.
+
+One process (the collector) writes, any number of processes read without locks.
+The file holds two buffers and a sequence number (seqlock with double buffering):
+the writer fills the buffer readers are not using and then increments the sequence
+number by 2, which makes it current. A reader copies the current buffer and checks
+that the sequence number did not change in the meantime (the writer may be filling
+that buffer again right after the next increment) and that the checksum matches.
+Otherwise it reads again.
+
+Layout:
+    header:   magic, sequence number, buffer size
+    buffer:   length, crc32, entries
+    entry:    key length, etag length, body length, key, etag, body
+"""
+import os
+import mmap
+import zlib
+import struct
+import tempfile
+
+MAGIC = b"SWSNAP01"
+HEADER = struct.Struct("<8sQQ")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 8
+RECORD = struct.Struct("<II")
+ENTRY = struct.Struct("<HHI")
+
+def get_default_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "solar-wallbox-snapshots")
+
+def encode(entries):
+    parts = []
+    for key, (body, etag) in entries.items():
+        key = key.encode()
+        etag = etag.encode()
+        parts += [ENTRY.pack(len(key), len(etag), len(body)), key, etag, body]
+    return b"".join(parts)
+
+def decode(data):
+    entries = {}
+    offset = 0
+    while offset < len(data):
+        (key_length, etag_length, body_length) = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        key = data[offset:offset + key_length].decode()
+        offset += key_length
+        etag = data[offset:offset + etag_length].decode()
+        offset += etag_length
+        entries[key] = (data[offset:offset + body_length], etag)
+        offset += body_length
+    return entries
+
+class SharedSnapshotStore():
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        with open(path, "r+b" if writable else "rb") as store_file:
+            self.mm = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        (magic, _, self.buffer_size) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot store.")
+        self.cache = (None, {})
+
+    @classmethod
+    def create(cls, path, size=4 * 1024 * 1024):
+        """
+        Create (or reset) the store file with size bytes for the two buffers.
+        """
+        buffer_size = size // 2
+        with open(path, "wb") as store_file:
+            store_file.truncate(HEADER.size + 2 * buffer_size)
+            store_file.write(HEADER.pack(MAGIC, 0, buffer_size))
+        return cls(path, writable=True)
+
+    def __get_seq(self):
+        return SEQ.unpack_from(self.mm, SEQ_OFFSET)[0]
+
+    def __get_buffer_offset(self, seq):
+        return HEADER.size + (seq // 2) % 2 * self.buffer_size
+
+    def write(self, entries):
+        """
+        entries: {key: (body bytes, etag)}. Only one process may write.
+        """
+        data = encode(entries)
+        if RECORD.size + len(data) > self.buffer_size:
+            raise ValueError(f"Snapshots need {len(data)} bytes, the store holds {self.buffer_size - RECORD.size}.")
+        seq = self.__get_seq()
+        offset = self.__get_buffer_offset(seq + 2)
+        self.mm[offset + RECORD.size:offset + RECORD.size + len(data)] = data
+        RECORD.pack_into(self.mm, offset, len(data), zlib.crc32(data))
+        SEQ.pack_into(self.mm, SEQ_OFFSET, seq + 2)
+        return seq + 2
+
+    def read(self, retries=100):
+        """
+        {key: (body bytes, etag)} as last written. Decoded entries are reused while nothing changed.
+        """
+        for _ in range(retries):
+            seq = self.__get_seq()
+            if seq == self.cache[0]:
+                return self.cache[1]
+            offset = self.__get_buffer_offset(seq)
+            (length, crc) = RECORD.unpack_from(self.mm, offset)
+            if length <= self.buffer_size - RECORD.size:
+                data = self.mm[offset + RECORD.size:offset + RECORD.size + length]
+                # At seq + 2 the writer may already be filling this buffer for seq + 4.
+                # Only an unchanged seq proves the copy is complete, the CRC is a backstop.
+                if self.__get_seq() == seq and zlib.crc32(data) == crc:
+                    self.cache = (seq, decode(data))
+                    return self.cache[1]
+        raise RuntimeError(f"Could not read a consistent state of {self.path}.")
+
+    def get(self, key):
+        """
+        (body bytes, etag) or None.
+        """
+        return self.read().get(key)
+
+    def close(self):
+        self.mm.close()
@@ -0,0 +1,107 @@
+"""
+Immutable snapshots of plugin data, shared between threads without locks.
+
+A source publishes new data by creating a new Snapshot and swapping a single reference.
+Readers take that reference once and work with it, so they always see data of one
+point in time, no matter what the source does in the meantime. Published data must
+therefore never be changed afterwards: publish a new (copied) dict instead.
+
+Data is a dict or a record with an as_dict() method, which is only called when a
+dict is actually needed.
+"""
+import time
+import itertools
+
+import json_cache
+
+class Snapshot():
+    """
+    Data of one source at one point in time, with sequence number and timestamp.
+    The JSON serialization is created on first use and then kept.
+    """
+    __slots__ = ("seq", "ts", "data", "_json")
+
+    def __init__(self, seq, ts, data):
+        object.__setattr__(self, "seq", seq)
+        object.__setattr__(self, "ts", ts)
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "_json", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshots are immutable. Publish a new one instead.")
+
+    def __reduce__(self):
+        # Pickled to send it to another process, see plugin_process.py
+        return (Snapshot, (self.seq, self.ts, self.data))
+
+    def get_dict(self):
+        data = self.data
+        return data.as_dict() if hasattr(data, "as_dict") else data
+
+    def get_json(self):
+        """
+        (body, etag) of the serialized data.
+        """
+        if self._json is None:
+            # Concurrent first calls compute the same result, no need to lock
+            object.__setattr__(self, "_json", json_cache.serialize(self.data))
+        return self._json
+
+    def serve(self, req, resp):
+        body, etag = self.get_json()
+        json_cache.serve(req, resp, body, etag)
+
+class SnapshotPublisher():
+    """
+    Latest snapshot of one source. Only the source publishes, everybody may read.
+    """
+
+    def __init__(self, name, data=None):
+        self.name = name
+        self.counter = itertools.count(1)
+        self.current = Snapshot(0, 0.0, data if data is not None else {})
+
+    def publish(self, data, ts=None):
+        snapshot = Snapshot(next(self.counter), ts if ts is not None else time.time(), data)
+        self.current = snapshot
+        return snapshot
+
+    def mirror(self, snapshot):
+        """
+        Take over a snapshot published in another process, see plugin_process.py.
+        """
+        self.current = snapshot
+        return snapshot
+
+    def get(self):
+        return self.current
+
+class SnapshotView():
+    """
+    One coherent view on several sources, e.g. for one tick of a controller.
+    Each source is read exactly once, afterwards the view does not change anymore.
+    """
+    __slots__ = ("snapshots",)
+
+    def __init__(self, snapshots):
+        self.snapshots = dict(snapshots)
+
+    @classmethod
+    def read(cls, publishers):
+        """
+        View on the current snapshots of the publishers.
+        """
+        return cls({name: publisher.get() for name, publisher in publishers.items()})
+
+    def __getitem__(self, name):
+        return self.snapshots[name].get_dict()
+
+    def get_data(self):
+        return {name: snapshot.get_dict() for name, snapshot in self.snapshots.items()}
+
+    def get_seqs(self):
+        return {name: snapshot.seq for name, snapshot in self.snapshots.items()}
+
+    def get_max_age(self, now=None):
+        now = now if now is not None else time.time()
+        return max((now - snapshot.ts for snapshot in self.snapshots.values()), default=0.0)
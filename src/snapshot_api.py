@@ -0,0 +1,123 @@
+"""
+One endpoint for the current data of all sources, reduced to the fields a client shows.
+
+/api/snapshot returns {source: data} for the sources of all plugins (see Plugin.get_sources()),
+e.g. "house", "wallbox1", "wallbox2", "dashboard".
+/api/snapshot?fields=house.live_data.pv_production,wallbox*.charging.current_power returns only
+these fields. Every segment of a field is an fnmatch pattern for the keys on its level, a field
+ending on a dict selects the whole dict. Projections are compiled once per fields string, results
+are serialized once per fields string and data version.
+"""
+import logging
+import functools
+from fnmatch import fnmatchcase
+
+import json_cache
+from snapshot import SnapshotView
+
+log = logging.getLogger("SnapshotApi")
+
+ALL = None # Selects a whole subtree
+
+@functools.lru_cache(maxsize=256)
+def compile_fields(fields):
+    """
+    "a.b,a.c.*,x" -> {"a": {"b": ALL, "c": {"*": ALL}}, "x": ALL}, as (exact keys, patterns) per level.
+    Raises ValueError for empty segments.
+    """
+    tree = {}
+    for field in fields.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        segments = field.split(".")
+        if "" in segments:
+            raise ValueError(f"Invalid field: {field}")
+        node = tree
+        for segment in segments[:-1]:
+            if segment in node and node[segment] is ALL:
+                break
+            node = node.setdefault(segment, {})
+        else:
+            node[segments[-1]] = ALL
+    return freeze(tree)
+
+def freeze(tree):
+    exact = {}
+    patterns = []
+    for segment, subtree in tree.items():
+        subtree = freeze(subtree) if subtree is not ALL else ALL
+        if any(char in segment for char in "*?["):
+            patterns.append((segment, subtree))
+        else:
+            exact[segment] = subtree
+    return (exact, tuple(patterns))
+
+def project(data, projection):
+    """
+    Copy of the selected parts of data. Missing keys are left out.
+    """
+    (exact, patterns) = projection
+    if not isinstance(data, dict):
+        return data
+    result = {}
+    for key, subtree in exact.items():
+        if key in data:
+            result[key] = data[key] if subtree is ALL else project(data[key], subtree)
+    for (pattern, subtree) in patterns:
+        for key, value in data.items():
+            if not isinstance(key, str) or not fnmatchcase(key, pattern):
+                continue
+            value = value if subtree is ALL else project(value, subtree)
+            if isinstance(result.get(key), dict) and isinstance(value, dict):
+                value = merge(result[key], value)
+            result[key] = value
+    return result
+
+def merge(first, second):
+    merged = dict(first)
+    for key, value in second.items():
+        if isinstance(merged.get(key), dict) and isinstance(value, dict):
+            value = merge(merged[key], value)
+        merged[key] = value
+    return merged
+
+class SnapshotApi():
+
+    def __init__(self, plugins, max_cached=64):
+        self.plugins = plugins
+        self.max_cached = max_cached
+        self.cache = {} # fields -> (seqs, body, etag)
+
+    def get_sources(self):
+        sources = {}
+        for plugin in self.plugins.get_plugins():
+            sources.update(plugin.get_sources())
+        return sources
+
+    def get_json(self, fields=""):
+        """
+        (body, etag) of the current data, reduced to fields.
+        """
+        view = SnapshotView.read(self.get_sources())
+        seqs = view.get_seqs()
+        cached = self.cache.get(fields)
+        if cached is not None and cached[0] == seqs:
+            return cached[1:]
+        data = view.get_data()
+        if fields:
+            data = project(data, compile_fields(fields))
+        (body, etag) = json_cache.serialize(data)
+        if len(self.cache) >= self.max_cached and fields not in self.cache:
+            self.cache.clear()
+        self.cache[fields] = (seqs, body, etag)
+        return (body, etag)
+
+    def endpoint(self, req, resp):
+        try:
+            (body, etag) = self.get_json(req.params.get('fields', ""))
+        except ValueError as e:
+            resp.status_code = 400
+            resp.text = str(e)
+            return
+        json_cache.serve(req, resp, body, etag)
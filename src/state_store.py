@@ -0,0 +1,135 @@
+"""
+Keep the state of the plugins across restarts.
+
+The state of every plugin (see Plugin.get_state()) is written to one small JSON file
+at intervals and on shutdown, and handed back to the plugins (Plugin.restore_state())
+before their runtimes start. So a restart keeps the switches of the user, the controller
+does not start over and the last known data is served until new data arrives.
+
+The file is replaced atomically: it is written to a temporary file in the same directory,
+synced to disk and renamed, so a crash leaves either the old or the new state.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+
+import json_cache
+
+log = logging.getLogger("StateStore")
+
+VERSION = 1
+
+class StateStore():
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        (saved unix timestamp, {plugin name: state}), or (None, {}) if there is no usable state.
+        """
+        try:
+            with open(self.path, "rb") as state_file:
+                content = json.loads(state_file.read())
+        except FileNotFoundError:
+            return None, {}
+        except (OSError, ValueError) as e:
+            log.warning("Could not read state from %s: %s", self.path, e)
+            return None, {}
+        if not isinstance(content, dict) or content.get("version") != VERSION:
+            log.warning("Unknown state format in %s. Ignoring it.", self.path)
+            return None, {}
+        return content.get("saved"), content.get("plugins", {})
+
+    def save(self, states, now=None):
+        body = json_cache.dumps({"version": VERSION, "saved": now if now is not None else time.time(), "plugins": states})
+        directory = os.path.dirname(self.path) or "."
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "wb") as tmp_file:
+                tmp_file.write(body)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.path)
+            # The rename is only durable once the directory is synced
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return len(body)
+
+class Checkpointer():
+    """
+    Saves the state of all plugins every interval seconds and on shutdown.
+    State older than max_age seconds is not restored.
+    """
+
+    def __init__(self, store, plugins, interval=30, max_age=24 * 60 * 60):
+        self.store = store
+        self.plugins = plugins
+        self.interval = interval
+        self.max_age = max_age
+        self.started = False
+
+    @classmethod
+    def from_settings(cls, settings, plugins):
+        """
+        Checkpointer as configured in the common settings, None if disabled (state_file "").
+        """
+        common = settings['common']
+        path = common.get('state_file', f"{common['db_base_path']}/state.json")
+        if not path:
+            return None
+        return cls(StateStore(path), plugins, common.get('state_interval', 30), common.get('state_max_age', 24 * 60 * 60))
+
+    def restore(self, now=None):
+        """
+        Hand the saved state to the plugins. Call before their runtimes are started.
+        """
+        now = now if now is not None else time.time()
+        (saved, states) = self.store.load()
+        if saved is None:
+            log.info("No saved state found. Starting cold.")
+            return
+        age = now - saved
+        if age > self.max_age:
+            log.info("Saved state is %.0f s old. Starting cold.", age)
+            return
+        for plugin in self.plugins.get_plugins():
+            name = type(plugin).__name__
+            if name in states:
+                try:
+                    plugin.restore_state(states[name])
+                except (KeyError, TypeError, ValueError) as e:
+                    log.warning("Could not restore state of %s: %s", name, e)
+        log.info("Restored state of %s s ago.", round(age))
+
+    def save(self):
+        states = {}
+        for plugin in self.plugins.get_plugins():
+            state = self.plugins.get_state(plugin)
+            if state is not None:
+                states[type(plugin).__name__] = state
+        try:
+            size = self.store.save(states)
+            log.debug("Saved state (%s bytes).", size)
+        except (OSError, TypeError) as e:
+            log.error("Could not save state to %s: %s", self.store.path, e)
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        atexit.register(self.save)
+        threading.Thread(target=self.run, name="Checkpointer", daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.save()
@@ -0,0 +1,64 @@
+"""
+Tests for the append-only capture log of raw device responses
+"""
+import os
+import logging
+import unittest
+
+import capture_log
+from capture_log import CaptureWriter, CaptureReader
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("CaptureLog-Tests")
+capture_file = "./test_capture.log"
+
+class TestCaptureLog(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        os.remove(capture_file)
+
+    def write_records(self, compress):
+        writer = CaptureWriter(capture_file, compress=compress, block_size=256)
+        for i in range(100):
+            writer.append("senec:192.168.0.10" if i % 2 else "goe:192.168.0.11", b'{"no": %d}' % i)
+        writer.close()
+
+    def test_records_are_read_back_in_order(self) -> None:
+        # Act
+        self.write_records(compress=False)
+        with CaptureReader(capture_file) as reader:
+            records = list(reader)
+
+        # Assert
+        self.assertEqual(len(records), 100)
+        self.assertEqual(records[7].source, "senec:192.168.0.10")
+        self.assertEqual(records[7].payload, b'{"no": 7}')
+        self.assertTrue(all(a.monotonic_ns <= b.monotonic_ns for a, b in zip(records, records[1:])))
+
+    @unittest.skipIf(capture_log.zstandard is None, "zstandard not installed")
+    def test_compressed_blocks_are_read_back(self) -> None:
+        # Act
+        self.write_records(compress=True)
+        with CaptureReader(capture_file) as reader:
+            payloads = [record.payload for record in reader]
+
+        # Assert
+        self.assertEqual(payloads[99], b'{"no": 99}')
+
+    def test_incomplete_last_block_is_ignored(self) -> None:
+        # Arrange
+        self.write_records(compress=False)
+        with open(capture_file, "r+b") as f:
+            f.truncate(os.path.getsize(capture_file) - 5)
+
+        # Act
+        with CaptureReader(capture_file) as reader:
+            records = list(reader)
+
+        # Assert
+        self.assertGreater(len(records), 0)
+        self.assertLess(len(records), 100)
+        self.assertEqual(records[-1].payload, b'{"no": %d}' % (len(records) - 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Tests for the circuit breaker for unreachable appliances
+"""
+import time
+import logging
+import unittest
+
+from circuit_breaker import CircuitBreaker
+from metrics import registry
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("CircuitBreaker-Tests")
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.breaker = CircuitBreaker("test:10.0.0.1", failure_threshold=2, base_backoff=0.05, max_backoff=0.2, jitter=0.0)
+
+    def test_opens_after_repeated_failures(self) -> None:
+        # Act
+        self.breaker.record_failure()
+        still_closed = self.breaker.allow_request()
+        self.breaker.record_failure()
+
+        # Assert
+        self.assertTrue(still_closed)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.get_state()["state"], "open")
+        self.assertEqual(registry.get("device_circuit_state", device="test:10.0.0.1"), 2)
+
+    def test_probes_with_exponential_backoff(self) -> None:
+        # Arrange
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+        # Act: Probe fails, backoff doubles
+        time.sleep(0.06)
+        first_probe = self.breaker.allow_request()
+        second_request = self.breaker.allow_request()
+        self.breaker.record_failure()
+        time.sleep(0.06)
+        too_early = self.breaker.allow_request()
+        time.sleep(0.06)
+        second_probe = self.breaker.allow_request()
+        self.breaker.record_success()
+
+        # Assert
+        self.assertEqual((first_probe, second_request, too_early, second_probe), (True, False, False, True))
+        self.assertTrue(self.breaker.is_closed())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Tests for publish/subscribe between plugins
+"""
+import logging
+import threading
+import unittest
+
+from event_bus import EventBus, Event, Measurement, Command
+from metrics import registry
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("EventBus-Tests")
+
+class TestEventBus(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.bus = EventBus()
+
+    def test_subscription_filters_by_topic_and_type(self) -> None:
+        # Arrange
+        wallboxes = self.bus.subscribe("wallboxes", "measurement/wallbox/*", Measurement)
+        everything = self.bus.subscribe("everything")
+
+        # Act
+        self.bus.publish(Measurement("measurement/house", {"pv": 1}))
+        self.bus.publish(Measurement("measurement/wallbox/0", {"power": 2}))
+        self.bus.publish(Command("measurement/wallbox/1", ("allow_charging", 1)))
+
+        # Assert
+        self.assertEqual([event.topic for event in wallboxes.get_all(timeout=0)], ["measurement/wallbox/0"])
+        self.assertEqual(len(everything.get_all(timeout=0)), 3)
+        self.assertIsNone(wallboxes.get(timeout=0))
+
+    def test_full_queue_drops_oldest(self) -> None:
+        # Arrange
+        slow = self.bus.subscribe("slow-test-consumer", maxlen=2)
+
+        # Act
+        for value in range(5):
+            self.bus.publish(Event("measurement/house", value))
+
+        # Assert
+        self.assertEqual([event.payload for event in slow.get_all(timeout=0)], [3, 4])
+        self.assertEqual(slow.dropped, 3)
+        self.assertEqual(registry.get("event_bus_dropped_total", subscription="slow-test-consumer"), 3)
+
+    def test_consumer_wakes_up_on_publish(self) -> None:
+        # Arrange
+        subscription = self.bus.subscribe("consumer", "command/*")
+        publisher = threading.Timer(0.05, lambda: self.bus.publish(Command("command/senec/force_charge", True)))
+
+        # Act
+        publisher.start()
+        event = subscription.get(timeout=5)
+        subscription.close()
+        self.bus.publish(Command("command/senec/force_charge", False))
+
+        # Assert
+        self.assertTrue(event.payload)
+        self.assertIsNone(subscription.get(timeout=0))
+
+if __name__ == '__main__':
+    unittest.main()
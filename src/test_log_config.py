@@ -0,0 +1,57 @@
+"""
+Tests for the central logging configuration
+"""
+import logging
+import unittest
+
+from log_config import RepeatFilter
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("Logging-Tests")
+
+def create_record(msg, *args, level=logging.WARNING):
+    return logging.LogRecord("Senec", level, __file__, 1, msg, args, None)
+
+class TestRepeatFilter(unittest.TestCase):
+
+    def test_repeated_message_is_suppressed_and_counted(self) -> None:
+        # Arrange
+        repeat_filter = RepeatFilter(interval=60.0)
+
+        # Act
+        first = repeat_filter.filter(create_record("%s: Not reachable.", "10.0.0.1"))
+        repeated = [repeat_filter.filter(create_record("%s: Not reachable.", "10.0.0.1")) for _ in range(3)]
+        repeat_filter.interval = 0.0
+        after_interval = create_record("%s: Not reachable.", "10.0.0.1")
+        passed = repeat_filter.filter(after_interval)
+
+        # Assert
+        self.assertTrue(first)
+        self.assertEqual(repeated, [False, False, False])
+        self.assertTrue(passed)
+        self.assertEqual(after_interval.getMessage(), "10.0.0.1: Not reachable. (repeated 3 times)")
+
+    def test_other_messages_and_debug_pass(self) -> None:
+        # Arrange
+        repeat_filter = RepeatFilter(interval=60.0)
+        repeat_filter.filter(create_record("Timeout"))
+
+        # Act & Assert
+        self.assertTrue(repeat_filter.filter(create_record("Connection error")))
+        self.assertTrue(repeat_filter.filter(create_record("Timeout", level=logging.ERROR)))
+        self.assertTrue(repeat_filter.filter(create_record("Excess power: %.2f W", 1.0, level=logging.DEBUG)))
+        self.assertTrue(repeat_filter.filter(create_record("Excess power: %.2f W", 1.0, level=logging.DEBUG)))
+
+    def test_arguments_and_info_are_not_suppressed(self) -> None:
+        # Arrange
+        repeat_filter = RepeatFilter(interval=60.0)
+        repeat_filter.filter(create_record("%s: Not reachable.", "10.0.0.1"))
+        repeat_filter.filter(create_record("Found plugin class: %s.%s", "senec", "Senec", level=logging.INFO))
+
+        # Act & Assert
+        self.assertTrue(repeat_filter.filter(create_record("%s: Not reachable.", "10.0.0.2")))
+        self.assertTrue(repeat_filter.filter(create_record("Found plugin class: %s.%s", "goe", "GoE", level=logging.INFO)))
+        self.assertTrue(repeat_filter.filter(create_record("Found plugin class: %s.%s", "senec", "Senec", level=logging.INFO)))
+
+if __name__ == '__main__':
+    unittest.main()
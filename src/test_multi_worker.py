@@ -0,0 +1,61 @@
+"""
+Tests for forwarding requests from web workers to the collector
+"""
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+import responder
+
+from multi_worker import CommandServer, CommandClient, WorkerBackend
+from shared_snapshots import SharedSnapshotStore
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("MultiWorker-Tests")
+
+def set_value(req, resp):
+    # Like the go-eCharger endpoint with ?device=1&set=allow_charging=1
+    resp.media = {"device": int(req.params['device']), "set": req.params['set'], "agent": req.headers.get('User-Agent')}
+
+class TestWorkerBackend(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix="solar-wallbox-test-")
+        address = os.path.join(self.directory, "collector.sock")
+        authkey = os.urandom(32)
+        self.server = CommandServer(address, authkey)
+        self.server.start({"/goe": set_value})
+        self.store = SharedSnapshotStore.create(os.path.join(self.directory, "snapshots"), 64 * 1024)
+        backend = WorkerBackend(self.store, CommandClient(address, authkey), {"/goe"})
+        self.api = responder.API()
+        self.api.add_route("/goe", backend.get_endpoint("/goe"))
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.server.listener.close()
+        shutil.rmtree(self.directory)
+
+    def test_request_with_params_is_forwarded(self) -> None:
+        # Act
+        resp = self.api.requests.get("/goe?device=1&set=allow_charging=1", headers={"User-Agent": "test"})
+
+        # Assert: Single values, not the lists of the QueryDict
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {"device": 1, "set": "allow_charging=1", "agent": "test"})
+
+    def test_json_is_served_from_the_store(self) -> None:
+        # Arrange
+        self.store.write({"/goe?device=1": (b'{"power": 11040}', '"1"')})
+
+        # Act
+        resp = self.api.requests.get("/goe?format=json&device=1")
+        unknown = self.api.requests.get("/goe?format=json&device=2")
+
+        # Assert
+        self.assertEqual((resp.status_code, resp.json()), (200, {"power": 11040}))
+        self.assertEqual(unknown.status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
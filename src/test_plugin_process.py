@@ -0,0 +1,122 @@
+"""
+Tests for running plugin runtimes in child processes
+"""
+import os
+import time
+import logging
+import unittest
+
+import responder
+
+from metrics import registry
+from event_bus import EventBus, Measurement, Command
+from snapshot import SnapshotPublisher
+from plugin_process import PluginProcess
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("PluginProcess-Tests")
+
+class EchoPlugin():
+    """
+    Answers command/echo with the doubled payload on measurement/echo, crashes on "crash".
+    """
+
+    def __init__(self):
+        self.settings = {"plugin_path": "/echo"}
+        self.publisher = SnapshotPublisher("echo")
+        self.count = 0
+
+    def get_publishers(self):
+        return {"/echo": self.publisher}
+
+    def get_sources(self):
+        return {}
+
+    def get_state(self):
+        return {"count": self.count}
+
+    def restore_state(self, state):
+        self.count = state["count"]
+
+    def runtime(self, other_plugins):
+        commands = other_plugins.events.subscribe("Echo", "command/echo", Command)
+        while True:
+            for event in commands.get_all():
+                if event.payload == "crash":
+                    raise RuntimeError("Crashed on purpose")
+                self.count += 1
+                self.publisher.publish({"count": self.count})
+                other_plugins.events.publish(Measurement("measurement/echo", event.payload * 2, source="EchoPlugin"))
+
+    def endpoint(self, req, resp):
+        resp.media = {"count": self.count, "pid": os.getpid(), "ppid": os.getppid(), "param": req.params.get("param")}
+
+class FakePlugins():
+
+    def __init__(self):
+        self.events = EventBus()
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+def request(process, params=""):
+    """
+    Request to the endpoint of the process, as the web server routes it.
+    """
+    api = responder.API()
+    api.add_route("/echo", process.endpoint)
+    return api.requests.get(f"/echo{params}")
+
+class TestPluginProcess(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.plugin = EchoPlugin()
+        self.plugins = FakePlugins()
+        self.process = PluginProcess(self.plugin, self.plugins, restart_delay=0.1, sync_interval=0.02, state_interval=0.05)
+
+    def test_runtime_runs_in_child_and_reports_back(self) -> None:
+        # Arrange
+        echoes = self.plugins.events.subscribe("Test", "measurement/echo", Measurement)
+        self.process.start()
+        self.assertTrue(wait_for(lambda: self.process.subscription.patterns))
+
+        # Act
+        self.plugins.events.publish(Command("command/echo", 21, source="Test"))
+        echo = echoes.get(timeout=5)
+
+        # Assert: Events, snapshots, state and requests of the child
+        self.assertEqual((echo.payload, echo.source), (42, "EchoPlugin"))
+        self.assertTrue(wait_for(lambda: self.plugin.publisher.get().get_dict() == {"count": 1}))
+        self.assertTrue(wait_for(lambda: self.process.get_state() == {"count": 1}))
+        self.assertEqual(self.plugin.count, 0)
+        resp = request(self.process, "?param=x")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual((resp.json()["count"], resp.json()["param"]), (1, "x"))
+        self.assertNotEqual(resp.json()["pid"], os.getpid())
+
+    def test_crashed_child_is_restarted_with_its_state(self) -> None:
+        # Arrange
+        self.process.start()
+        self.assertTrue(wait_for(lambda: self.process.subscription.patterns))
+        self.plugins.events.publish(Command("command/echo", 1, source="Test"))
+        self.assertTrue(wait_for(lambda: self.process.get_state() == {"count": 1}))
+        pid = request(self.process).json()["pid"]
+
+        # Act
+        self.plugins.events.publish(Command("command/echo", "crash", source="Test"))
+        self.assertTrue(wait_for(lambda: registry.get("plugin_process_restarts_total", plugin="EchoPlugin") == 1))
+        self.assertTrue(wait_for(lambda: registry.get("plugin_process_running", plugin="EchoPlugin") == 1))
+
+        # Assert: Forked by the zygote, not by this process
+        resp = request(self.process)
+        self.assertEqual(resp.json()["count"], 1)
+        self.assertNotEqual(resp.json()["pid"], pid)
+        self.assertEqual(resp.json()["ppid"], self.process.zygote.pid)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests for the sampling profiler
+"""
+import time
+import logging
+import threading
+import unittest
+import tracemalloc
+
+from profiler import SamplingProfiler, ProfilerBusy
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("Profiler-Tests")
+
+def busy_control_loop(stop):
+    values = []
+    while not stop.is_set():
+        values.append(sum(range(1000)))
+        if len(values) > 1000:
+            values.clear()
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_samples_other_threads(self) -> None:
+        # Arrange
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_control_loop, args=(stop,), name="control")
+        worker.start()
+
+        try:
+            # Act
+            result = SamplingProfiler().profile(duration=0.3, interval=0.005)
+        finally:
+            stop.set()
+            worker.join()
+
+        # Assert
+        self.assertGreater(result.samples, 10)
+        control_stacks = [line for line in result.get_collapsed().splitlines() if line.startswith("control;")]
+        self.assertTrue(control_stacks)
+        self.assertIn("busy_control_loop (test_profiler.py:", control_stacks[0])
+        self.assertIn("busy_control_loop", result.get_report())
+        self.assertIsInstance(result.get_memory(), list)
+        self.assertTrue(all(";" not in frame for stack in result.stacks for frame in stack))
+
+    def test_only_one_session(self) -> None:
+        # Arrange
+        profiler = SamplingProfiler()
+        session = threading.Thread(target=profiler.profile, kwargs={"duration": 0.3, "trace_memory": False})
+        session.start()
+        time.sleep(0.05)
+
+        # Act & Assert
+        with self.assertRaises(ProfilerBusy):
+            profiler.profile(duration=0.1)
+        session.join()
+
+    def test_memory_tracing_is_stopped_after_a_failure(self) -> None:
+        # Act: sleep() fails for a negative interval
+        with self.assertRaises(ValueError):
+            SamplingProfiler().profile(duration=0.1, interval=-0.001)
+
+        # Assert
+        self.assertFalse(tracemalloc.is_tracing())
+
+if __name__ == '__main__':
+    unittest.main()
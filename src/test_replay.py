@@ -0,0 +1,144 @@
+"""
+Tests for replaying recorded data through the automatic charging
+"""
+import os
+import json
+import struct
+import logging
+import unittest
+from datetime import datetime, timezone
+
+import replay
+from capture_log import CaptureWriter
+from plugins.senec.senec_db import SenecDB
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("Replay-Tests")
+db_file = "./test_replay.sqlite"
+capture_file = "./test_replay.capture"
+
+START = 1685613600 # 2023-06-01 12:00 in Berlin
+CARS = ((True, 3), (False, 3))
+SETTINGS = {"hysteresis_seconds": 10, "min_command_interval": 10}
+AUTOMATION = {"sunChargingParking": True}
+
+def sunny_samples(start, seconds, pv_production=5000.0, base_load=500.0):
+    return [(start + n, pv_production, base_load, CARS) for n in range(seconds)]
+
+def encode_float(value):
+    return "fl_" + struct.pack('!f', value).hex().upper()
+
+def senec_response(pv_production, house_power):
+    """
+    Raw response of the SENEC appliance, as captured.
+    """
+    return json.dumps({
+        "ENERGY": {"STAT_HOURS_OF_OPERATION": "u3_00000010", "GUI_HOUSE_POW": encode_float(house_power),
+                   "GUI_INVERTER_POWER": encode_float(pv_production), "GUI_GRID_POW": encode_float(house_power - pv_production),
+                   "GUI_BAT_DATA_POWER": encode_float(0.0), "GUI_BAT_DATA_CURRENT": encode_float(0.0),
+                   "GUI_BAT_DATA_VOLTAGE": encode_float(50.0), "GUI_BAT_DATA_FUEL_CHARGE": encode_float(80.0)},
+        "FACTORY": {"DESIGN_CAPACITY": encode_float(10000.0), "MAX_CHARGE_POWER_DC": encode_float(2500.0),
+                    "MAX_DISCHARGE_POWER_DC": encode_float(3750.0)},
+        "BMS": {"CYCLES": ["u1_0001"], "CHARGED_ENERGY": ["u3_00000001"], "DISCHARGED_ENERGY": ["u3_00000001"]}
+    }).encode()
+
+def goe_response(car="2", power_kw100=1104):
+    """
+    Raw status of a go-eCharger (API v1) charging on three phases, as captured.
+    """
+    status = {key: "0" for key in ("ast", "err", "eca", "ecr")}
+    status.update({
+        "sse": "012345", "fwv": "040.0", "alw": "1", "uby": "0", "car": car, "amp": "16", "pha": "63",
+        "nrg": [230, 231, 229, 0, 160, 160, 160, 37, 37, 37, 0, power_kw100, 99, 99, 99, 0], "dws": "36000", "eto": "1234",
+        "rca": "", "rna": "", "rcr": "", "rnm": "", "al1": "6", "al2": "10", "al3": "16", "al4": "20", "al5": "32"
+    })
+    return json.dumps(status).encode()
+
+def create_measurement(pv_production, house_power):
+    return {"general": {"hours_of_operation": 0},
+            "live_data": {"house_power": house_power, "pv_production": pv_production, "grid_power": 0.0, "battery_charge_power": 0.0,
+                          "battery_charge_current": 0.0, "battery_voltage": 0.0, "battery_percentage": 0.0},
+            "battery_information": {"design_capacity": 0.0, "max_charge_power": 0.0, "max_discharge_power": 0.0,
+                                    "cycles": [0], "charged_energy": [0], "discharged_energy": [0]}}
+
+class TestReplay(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        for path in (db_file, capture_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_wallbox_charges_with_excess_after_hysteresis(self) -> None:
+        # Act: 4500 W excess are enough for 6 A on three phases (4140 W)
+        result = replay.replay_day(sunny_samples(START, 120), SETTINGS, AUTOMATION)
+
+        # Assert: Activated after 10 s, charging counts from the next sample on
+        self.assertEqual(result["events"], [(START + 10, 0, "max_ampere", 6), (START + 10, 0, "allow_charging", 1)])
+        self.assertEqual((result["samples"], result["switches"]), (120, 1))
+        self.assertAlmostEqual(result["pv_energy"], 5000.0 * 119 / 3600)
+        self.assertAlmostEqual(result["wallbox_energy"], 4140.0 * 109 / 3600)
+        self.assertAlmostEqual(result["wallbox_pv_energy"], result["wallbox_energy"])
+        self.assertAlmostEqual(result["import_energy"], 0.0)
+
+    def test_days_start_over_and_workers_give_the_same_results(self) -> None:
+        # Arrange
+        days = [sunny_samples(START, 60), sunny_samples(START + 86400, 60, pv_production=1000.0)]
+
+        # Act
+        serial = replay.replay_days(days, SETTINGS, AUTOMATION)
+        parallel = replay.replay_days(days, SETTINGS, AUTOMATION, workers=2)
+
+        # Assert
+        self.assertEqual(serial, parallel)
+        self.assertEqual([result["switches"] for result in serial], [1, 0])
+        self.assertEqual(replay.summarize(serial)["samples"], 120)
+
+    def test_senec_db_day_is_a_local_day(self) -> None:
+        # Arrange: 2023-06-01 in Berlin starts at 2023-05-31 22:00 UTC
+        db = SenecDB(db_file)
+        db.insert_measurement_with_custom_ts(create_measurement(100.0, 400.0), datetime(2023, 5, 31, 21, 59, 59))
+        db.insert_measurement_with_custom_ts(create_measurement(200.0, 500.0), datetime(2023, 5, 31, 22, 0, 0))
+        db.insert_measurement_with_custom_ts(create_measurement(5000.0, 600.0), datetime(2023, 6, 1, 10, 0, 0))
+        db.close()
+
+        # Act
+        samples = replay.load_senec_db_day(db_file, "2023-06-01")
+
+        # Assert
+        first = datetime(2023, 5, 31, 22, 0, 0, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(samples, [(first, 200.0, 500.0, CARS), (START, 5000.0, 600.0, CARS)])
+
+    def test_capture_file_reads_capture_logs(self) -> None:
+        # Arrange: As written by the SENEC and go-eCharger plugins
+        writer = CaptureWriter(capture_file)
+        writer.append("senec:10.0.0.10", senec_response(3000.0, 500.0))
+        writer.append("goe:10.0.0.11", goe_response())
+        writer.append("senec:10.0.0.10", senec_response(5000.0, 12000.0))
+        writer.close()
+
+        # Act
+        days = replay.load_capture_file(capture_file)
+
+        # Assert: Without the 11040 W the wallbox charges with
+        self.assertEqual(len(days), 1)
+        self.assertEqual([sample[1:] for sample in days[0]],
+                         [(3000.0, 500.0, ((False, 3), (False, 3))), (5000.0, 960.0, ((True, 3), (False, 3)))])
+
+    def test_capture_file_reads_dashboard_snapshots(self) -> None:
+        # Arrange: Snapshots of two local days, one without ts
+        wallbox = {"charging": {"current_power": 0, "pha_available": 3, "status": "Car is charging"}}
+        no_wallbox = {"charging": {"current_power": 0, "pha_available": 0, "status": replay.NO_CAR_CONNECTED}}
+        snapshots = [{"ts": ts, "house": {"live_data": {"pv_production": 4000.0, "house_power": 700.0}},
+                      "wallbox1": wallbox, "wallbox2": no_wallbox} for ts in (START, START + 1, START + 86400)]
+        del snapshots[1]["ts"]
+        with open(capture_file, "w") as f:
+            f.write("\n".join(json.dumps(snapshot) for snapshot in snapshots) + "\n")
+
+        # Act
+        days = replay.load_capture_file(capture_file)
+
+        # Assert
+        self.assertEqual(days, [[(START, 4000.0, 700.0, CARS)], [(START + 86400, 4000.0, 700.0, CARS)]])
+
+if __name__ == '__main__':
+    unittest.main()
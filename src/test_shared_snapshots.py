@@ -0,0 +1,74 @@
+"""
+Tests for the snapshots shared between the collector and the web workers
+"""
+import os
+import logging
+import tempfile
+import unittest
+
+from shared_snapshots import SharedSnapshotStore
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("SharedSnapshots-Tests")
+
+class TestSharedSnapshotStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "snapshots")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_reader_sees_latest_write(self) -> None:
+        # Arrange
+        writer = SharedSnapshotStore.create(self.path, size=4096)
+        reader = SharedSnapshotStore(self.path)
+        empty = reader.read()
+
+        # Act
+        writer.write({"/senec": (b'{"pv":1}', '"a"')})
+        first = reader.get("/senec")
+        writer.write({"/senec": (b'{"pv":2}', '"b"'), "/go-echarger?device=0": (b'{}', '"c"')})
+        writer.write({"/senec": (b'{"pv":3}', '"d"'), "/go-echarger?device=0": (b'{}', '"c"')})
+        latest = reader.read()
+
+        # Assert
+        self.assertEqual(empty, {})
+        self.assertEqual(first, (b'{"pv":1}', '"a"'))
+        self.assertEqual(latest, {"/senec": (b'{"pv":3}', '"d"'), "/go-echarger?device=0": (b'{}', '"c"')})
+        self.assertIs(reader.read(), latest)
+        writer.close()
+        reader.close()
+
+    def test_inconsistent_buffer_is_not_returned(self) -> None:
+        # Arrange
+        writer = SharedSnapshotStore.create(self.path, size=4096)
+        reader = SharedSnapshotStore(self.path)
+        writer.write({"/senec": (b'{"pv":1}', '"a"')})
+        # Data changed after the checksum, as seen while the writer reuses the buffer
+        header_size = 24
+        record_size = 8
+        writer.mm[header_size + writer.buffer_size + record_size] ^= 0xFF
+
+        # Act / Assert
+        with self.assertRaises(RuntimeError):
+            reader.read(retries=3)
+        writer.close()
+        reader.close()
+
+    def test_too_large_snapshots_are_rejected(self) -> None:
+        # Arrange
+        writer = SharedSnapshotStore.create(self.path, size=256)
+        writer.write({"/senec": (b'{"pv":1}', '"a"')})
+
+        # Act
+        with self.assertRaises(ValueError):
+            writer.write({"/senec": (b"x" * 200, '"b"')})
+
+        # Assert
+        self.assertEqual(SharedSnapshotStore(self.path).get("/senec"), (b'{"pv":1}', '"a"'))
+        writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
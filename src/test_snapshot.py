@@ -0,0 +1,62 @@
+"""
+Tests for the immutable snapshots shared between plugins
+"""
+import json
+import logging
+import unittest
+
+from snapshot import SnapshotPublisher, SnapshotView
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("Snapshot-Tests")
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_publish_swaps_snapshot(self) -> None:
+        # Arrange
+        publisher = SnapshotPublisher("house")
+        first = publisher.get()
+
+        # Act
+        second = publisher.publish({"live_data": {"pv_production": 1200}}, ts=100.0)
+
+        # Assert
+        self.assertEqual(first.seq, 0)
+        self.assertEqual(first.data, {})
+        self.assertEqual(second.seq, 1)
+        self.assertEqual(second.ts, 100.0)
+        self.assertIs(publisher.get(), second)
+        with self.assertRaises(AttributeError):
+            second.data = {}
+
+    def test_json_is_serialized_once(self) -> None:
+        # Arrange
+        snapshot = SnapshotPublisher("wallbox").publish({"charging": {"current_power": 4140}})
+
+        # Act
+        body, etag = snapshot.get_json()
+
+        # Assert
+        self.assertEqual(json.loads(body), {"charging": {"current_power": 4140}})
+        self.assertIs(snapshot.get_json()[0], body)
+        self.assertTrue(etag.startswith('"'))
+
+    def test_view_is_not_affected_by_later_publishes(self) -> None:
+        # Arrange
+        house = SnapshotPublisher("house")
+        wallbox = SnapshotPublisher("wallbox")
+        house.publish({"pv": 1}, ts=10.0)
+        wallbox.publish({"power": 2}, ts=12.0)
+
+        # Act
+        view = SnapshotView.read({"house": house, "wallbox1": wallbox})
+        house.publish({"pv": 3}, ts=13.0)
+
+        # Assert
+        self.assertEqual(view.get_data(), {"house": {"pv": 1}, "wallbox1": {"power": 2}})
+        self.assertEqual(view["house"], {"pv": 1})
+        self.assertEqual(view.get_seqs(), {"house": 1, "wallbox1": 1})
+        self.assertEqual(view.get_max_age(now=15.0), 5.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests for the combined snapshot of all sources with field selection
+"""
+import json
+import logging
+import unittest
+
+from snapshot import SnapshotPublisher
+from snapshot_api import SnapshotApi, compile_fields, project
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("SnapshotApi-Tests")
+
+HOUSE = {"live_data": {"pv_production": 5200.0, "house_power": 800.0}, "battery_info": {"temp": 21.5}}
+WALLBOX = {"charging": {"current_power": 4140, "pha_used": 3}, "rfid": {"cards": [{"name": "Card 1"}]}}
+
+class StandInSource():
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def get_sources(self):
+        return self.sources
+
+class StandInPlugins():
+
+    def __init__(self, *plugins):
+        self.plugins = plugins
+
+    def get_plugins(self):
+        return self.plugins
+
+class TestSnapshotApi(unittest.TestCase):
+
+    def test_project_selects_fields(self) -> None:
+        # Arrange
+        data = {"house": HOUSE, "wallbox1": WALLBOX, "wallbox2": WALLBOX, "dashboard": {"sunChargingGarage": True}}
+
+        # Act
+        result = project(data, compile_fields("house.live_data.pv_production, wallbox*.charging.current_power,wallbox1.rfid,nothing.here"))
+
+        # Assert
+        self.assertEqual(result, {
+            "house": {"live_data": {"pv_production": 5200.0}},
+            "wallbox1": {"charging": {"current_power": 4140}, "rfid": {"cards": [{"name": "Card 1"}]}},
+            "wallbox2": {"charging": {"current_power": 4140}}
+        })
+        self.assertIs(compile_fields("house.live_data"), compile_fields("house.live_data"))
+        with self.assertRaises(ValueError):
+            compile_fields("house..live_data")
+
+    def test_whole_subtree_wins_over_its_fields(self) -> None:
+        # Act
+        result = project({"house": HOUSE}, compile_fields("house.live_data.pv_production,house.live_data"))
+
+        # Assert
+        self.assertEqual(result, {"house": {"live_data": HOUSE["live_data"]}})
+
+    def test_serialized_once_per_data_version(self) -> None:
+        # Arrange
+        house = SnapshotPublisher("house")
+        wallbox = SnapshotPublisher("wallbox")
+        house.publish(HOUSE)
+        wallbox.publish(WALLBOX)
+        api = SnapshotApi(StandInPlugins(StandInSource({"house": house}), StandInSource({"wallbox1": wallbox})))
+
+        # Act
+        first = api.get_json("*.charging.current_power")
+        second = api.get_json("*.charging.current_power")
+        wallbox.publish({"charging": {"current_power": 0}})
+        third = api.get_json("*.charging.current_power")
+
+        # Assert
+        self.assertEqual(json.loads(first[0]), {"house": {}, "wallbox1": {"charging": {"current_power": 4140}}})
+        self.assertIs(first[0], second[0])
+        self.assertEqual(json.loads(third[0]), {"house": {}, "wallbox1": {"charging": {"current_power": 0}}})
+        self.assertNotEqual(first[1], third[1])
+
+if __name__ == '__main__':
+    unittest.main()
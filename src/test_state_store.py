@@ -0,0 +1,92 @@
+"""
+Tests for keeping the state of the plugins across restarts
+"""
+import os
+import logging
+import tempfile
+import unittest
+
+from state_store import StateStore, Checkpointer
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.DEBUG)
+log = logging.getLogger("StateStore-Tests")
+
+class FakePlugin():
+
+    def __init__(self, state=None):
+        self.state = state
+        self.restored = None
+
+    def get_state(self):
+        return self.state
+
+    def restore_state(self, state):
+        self.restored = state
+
+class FakePlugins():
+
+    def __init__(self, *plugins):
+        self.plugins = plugins
+
+    def get_plugins(self):
+        return self.plugins
+
+    def get_state(self, plugin):
+        return plugin.get_state()
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state", "state.json")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_save_replaces_state(self) -> None:
+        # Arrange
+        store = StateStore(self.path)
+        cold = store.load()
+
+        # Act
+        store.save({"Dashboard": {"sunChargingParking": False}}, now=100.0)
+        store.save({"Dashboard": {"sunChargingParking": True, "allocator": {0: {"counter": 30}}}}, now=200.0)
+        (saved, states) = store.load()
+
+        # Assert
+        self.assertEqual(cold, (None, {}))
+        self.assertEqual(saved, 200.0)
+        self.assertEqual(states, {"Dashboard": {"sunChargingParking": True, "allocator": {"0": {"counter": 30}}}})
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ["state.json"])
+
+    def test_broken_file_starts_cold(self) -> None:
+        # Arrange
+        store = StateStore(self.path)
+        store.save({"Dashboard": {}})
+        with open(self.path, "r+b") as state_file:
+            state_file.truncate(10)
+
+        # Act
+        result = store.load()
+
+        # Assert
+        self.assertEqual(result, (None, {}))
+
+    def test_checkpointer_restores_recent_state_only(self) -> None:
+        # Arrange
+        saved = FakePlugin({"counter": 12})
+        no_state = FakePlugin()
+        Checkpointer(StateStore(self.path), FakePlugins(saved, no_state)).save()
+        restored = FakePlugin()
+        too_late = FakePlugin()
+
+        # Act
+        Checkpointer(StateStore(self.path), FakePlugins(restored)).restore()
+        Checkpointer(StateStore(self.path), FakePlugins(too_late), max_age=60).restore(now=os.path.getmtime(self.path) + 61)
+
+        # Assert
+        self.assertEqual(restored.restored, {"counter": 12})
+        self.assertIsNone(too_late.restored)
+
+if __name__ == '__main__':
+    unittest.main()
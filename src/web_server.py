@@ -1,13 +1,21 @@
+import uvicorn
 import responder
 import datetime
 import logging
-import threading
 
-logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s',level=logging.INFO)
+from metrics import registry
+from profiler import SamplingProfiler, ProfilerBusy
+from snapshot_api import SnapshotApi
+from state_store import Checkpointer
+
 log = logging.getLogger("WebServer")
 
 class WebServer:
-    def __init__(self, settings, plugins):
+    def __init__(self, settings, plugins, backend=None):
+        """
+        backend: Serves the routes in a web worker process instead of the plugins, see multi_worker.py.
+                 Plugin runtimes are not started then.
+        """
         self.api = responder.API(
             title="Solar Wallbox",
             version="0.0.1",
@@ -18,21 +26,38 @@ class WebServer:
         self.address = settings["web"]["address"]
         self.port = settings["web"]["port"]
         self.plugins = plugins
+        self.profiler = SamplingProfiler() if settings["web"].get("profiling", False) else None
+        self.backend = backend
+        self.snapshot_api = SnapshotApi(plugins)
         self.__register_routes()
-        self.__start_plugin_runtimes()
+        if backend is None:
+            self.__start_plugin_runtimes(settings)
 
     def __register_routes(self):
         self.api.add_route("/", endpoint=self.__list_plugins)
         for plugin in self.plugins.get_plugins():
             plugin.add_webserver(self)
-            self.api.add_route(plugin.settings['plugin_path'], endpoint=plugin.endpoint)
+        for (path, endpoint) in self.get_endpoints().items():
+            self.api.add_route(path, endpoint=self.backend.get_endpoint(path) if self.backend else endpoint)
 
-    def __start_plugin_runtimes(self):
-        log.info("Starting plugin runtimes...")
+    def get_endpoints(self):
+        """
+        Routes that need the plugin runtimes: path -> endpoint
+        """
+        endpoints = {"/metrics": self.__metrics, "/api/snapshot": self.snapshot_api.endpoint}
+        if self.profiler:
+            endpoints["/admin/profile"] = self.__profile
         for plugin in self.plugins.get_plugins():
-            if plugin.has_runtime:
-                plugin_runtime_thread = threading.Thread(target=plugin.runtime, args=(self.plugins,), daemon=True)
-                plugin_runtime_thread.start()
+            endpoints[plugin.settings['plugin_path']] = self.plugins.get_endpoint(plugin)
+        return endpoints
+
+    def __start_plugin_runtimes(self, settings):
+        log.info("Starting plugin runtimes...")
+        self.plugins.start_runtimes()
+        # The state was restored in main.py, before any worker was forked
+        checkpointer = Checkpointer.from_settings(settings, self.plugins)
+        if checkpointer:
+            checkpointer.start()
 
     def render_template(self, path, template_vars=None):
         template_vars = template_vars if template_vars else {}
@@ -48,7 +73,41 @@ class WebServer:
         template_vars['res'] = self.__get_web_dict(self.plugins.list_plugins())
         resp.html = self.render_template("home/index.html", template_vars)
 
-    def run(self):
+    def __metrics(self, req, resp):
+        resp.text = registry.render()
+
+    def __profile(self, req, resp):
+        """
+        /admin/profile?seconds=10&interval_ms=10&memory=1&format=text|collapsed|json
+        """
+        try:
+            duration = float(req.params.get('seconds', 10))
+            interval = float(req.params.get('interval_ms', 10)) / 1000.0
+            if not interval > 0:
+                raise ValueError("interval_ms must be positive.")
+            result = self.profiler.profile(duration=duration, interval=interval,
+                                           trace_memory=req.params.get('memory', "1") == "1")
+        except ProfilerBusy as e:
+            resp.status_code = 409
+            resp.text = str(e)
+            return
+        except ValueError as e:
+            resp.status_code = 400
+            resp.text = str(e)
+            return
+        output_format = req.params.get('format', "text")
+        if output_format == "json":
+            resp.media = result.get_dict()
+        elif output_format == "collapsed":
+            resp.text = result.get_collapsed()
+        else:
+            resp.text = result.get_report()
+
+    def run(self, sockets=None):
+        if sockets:
+            # Web worker on a socket shared with the other workers
+            uvicorn.Server(uvicorn.Config(self.api)).run(sockets=sockets)
+            return
         self.api.run(address=self.address, port=self.port)
 
     def __get_web_dict(self, plugins):